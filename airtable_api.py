@@ -1,27 +1,23 @@
-from pyairtable import Table
-from config import AIRTABLE_API_KEY, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME
-import datetime
+from pyairtable import Api
+from config import AIRTABLE_API_KEY, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME, AIRTABLE_API_URL
 import json
 import base64
 import os
 import requests
 import logging
+import hashlib
+from rate_limiter import install_rate_limiter
+from metrics import metrics
+from invoice_formatter import InvoiceFormatter
 
-# Configuration du logging pour le debug
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('airtable_sync_debug.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger("airtable_api")
 
 class AirtableAPI:
     def __init__(self):
         """Initialisation de la connexion à Airtable"""
-        self.table = Table(AIRTABLE_API_KEY, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME)
+        self.table = Api(AIRTABLE_API_KEY, endpoint_url=AIRTABLE_API_URL).table(AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME)
+        # Toutes les requêtes Airtable passent par le limiteur de débit partagé
+        install_rate_limiter(self.table.api.session, AIRTABLE_API_URL)
         
         # Dictionnaire de traduction des statuts de facture
         self.status_translations = {
@@ -33,206 +29,113 @@ class AirtableAPI:
             "cancelled": "Annulée"
         }
 
-    def format_invoice_for_airtable(self, invoice):
-        """Convertit une facture Sellsy au format Airtable"""
-        # Vérifications de sécurité pour éviter les erreurs si des champs sont manquants
-        if not invoice:
-            print("⚠️ Données de facture invalides ou vides")
-            return None
-            
-        # Affichage des clés principales pour débogage
-        print(f"Structure de la facture - Clés principales: {list(invoice.keys())}")
-
-        # Debug: vérifier immédiatement l'ID
-        raw_id = invoice.get("id")
-        print(f"DEBUG - ID brut reçu: '{raw_id}' (type: {type(raw_id)})")
-        logger.debug(f"Format invoice - ID reçu: '{raw_id}', type: {type(raw_id)}, keys: {list(invoice.keys())}")
-
-        # Récupérer l'ID client de Sellsy avec gestion des cas où les champs sont manquants
-        client_id = None
-        client_name = ""
-
-        # Debug : afficher la structure du champ "related"
-        if "related" in invoice:
-            related_data = invoice.get("related", {})
-            print(f"DEBUG - Structure 'related': type={type(related_data)}, valeur={related_data}")
-            logger.debug(f"Champ 'related' de la facture: {related_data}")
-
-        # Vérifier les différentes structures possibles de l'API Sellsy pour les informations client
-        if "relation" in invoice:
-            if "id" in invoice["relation"]:
-                client_id = str(invoice["relation"]["id"])
-            if "name" in invoice["relation"]:
-                client_name = invoice["relation"]["name"]
-        elif "related" in invoice:
-            related_value = invoice.get("related", [])
-
-            # Le champ "related" peut être un dict ou une liste
-            if isinstance(related_value, dict):
-                # Si c'est un dictionnaire, extraire directement
-                if "id" in related_value:
-                    client_id = str(related_value.get("id", ""))
-                    client_name = related_value.get("name", "")
-                    print(f"✅ Client trouvé (dict): ID={client_id}, Nom={client_name}")
-            elif isinstance(related_value, list):
-                # Si c'est une liste, chercher le bon type
-                # Types possibles: individual, corporation, company
-                for related in related_value:
-                    client_type = related.get("type", "")
-                    if client_type in ["individual", "corporation", "company"]:
-                        client_id = str(related.get("id", ""))
-                        client_name = related.get("name", "")
-                        print(f"✅ Client trouvé (list, type={client_type}): ID={client_id}, Nom={client_name}")
-                        break
-
-            # Si le nom n'est pas disponible directement
-            if not client_name:
-                client_name = invoice.get("company_name", invoice.get("client_name", "Client #" + str(client_id) if client_id else ""))
-
-        # Log final pour vérifier ce qui a été extrait
-        if not client_id:
-            print(f"⚠️ Aucun ID client trouvé pour la facture {invoice.get('id', 'inconnue')}")
-            logger.warning(f"ID client manquant pour facture {invoice.get('id', 'inconnue')}")
-        
-        # Gestion de la date - vérifier plusieurs chemins possibles dans la structure JSON
-        created_date = ""
-        for date_field in ["created_at", "date", "created"]:
-            if date_field in invoice and invoice[date_field]:
-                created_date = invoice[date_field]
-                break
-        
-        # S'assurer que la date est au format YYYY-MM-DD pour Airtable
-        if created_date:
-            # Si la date contient un T (format ISO), prendre juste la partie date
-            if "T" in created_date:
-                created_date = created_date.split("T")[0]
-        else:
-            # Fournir une date par défaut si aucune n'est disponible
-            created_date = datetime.datetime.now().strftime("%Y-%m-%d")
-            print(f"⚠️ Date non trouvée pour la facture {invoice.get('id', 'inconnue')}, utilisation de la date actuelle")
-        
-        # Récupération des montants avec gestion des différentes structures possibles
-        montant_ht = 0
-        montant_ttc = 0
-        
-        # Extraction des montants - simplification et amélioration de la robustesse
-        if "amounts" in invoice:
-            print(f"Structure amounts: {list(invoice['amounts'].keys())}")
-            amounts = invoice["amounts"]
-            # Essayer différentes clés possibles pour montant HT
-            for key in ["total_excluding_tax", "total_excl_tax", "tax_excl", "total_raw_excl_tax"]:
-                if key in amounts and amounts[key] is not None:
-                    montant_ht = amounts[key]
-                    break
-            
-            # Essayer différentes clés possibles pour montant TTC
-            for key in ["total_including_tax", "total_incl_tax", "tax_incl", "total_incl_tax"]:
-                if key in amounts and amounts[key] is not None:
-                    montant_ttc = amounts[key]
-                    break
-        
-        # Fallback sur d'autres structures possibles si les montants sont toujours à 0
-        if montant_ht == 0 and "amount" in invoice:
-            amount = invoice["amount"]
-            if "tax_excl" in amount:
-                montant_ht = amount["tax_excl"]
-            
-        if montant_ttc == 0 and "amount" in invoice:
-            amount = invoice["amount"]
-            if "tax_incl" in amount:
-                montant_ttc = amount["tax_incl"]
-        
-        # Fallback sur les champs directs
-        if montant_ht == 0 and "total_amount_without_taxes" in invoice:
-            montant_ht = invoice["total_amount_without_taxes"]
-            
-        if montant_ttc == 0 and "total_amount_with_taxes" in invoice:
-            montant_ttc = invoice["total_amount_with_taxes"]
-        
-        # Récupération du numéro de facture
-        reference = ""
-        for ref_field in ["reference", "number", "decimal_number"]:
-            if ref_field in invoice and invoice[ref_field]:
-                reference = invoice[ref_field]
-                break
-            
-        # Récupération du statut
-        status = invoice.get("status", "")
-        
-        # Traduire le statut en français
-        status_fr = self.status_translations.get(status, status)
-        
-        # Récupération du lien PDF direct de Sellsy
-        pdf_link = invoice.get("pdf_link", "")
-        
-        # Conversion explicite des montants en float pour éviter les problèmes avec Airtable
+        # Formateur compilé par schéma de facture Sellsy
+        self.formatter = InvoiceFormatter(self.status_translations)
+
+        # Index en mémoire ID Sellsy -> enregistrement Airtable (None tant qu'il n'est pas chargé)
+        self.index = None
+
+        # Nombre de mises à jour évitées car les champs étaient identiques
+        self.skipped_count = 0
+
+    @metrics.timed("airtable_lookup")
+    def load_index(self):
+        """Charge en une seule passe paginée l'index ID Sellsy -> enregistrement Airtable"""
+        logger.info("📚 Chargement de l'index des factures Airtable...")
+        index = {}
+        page_count = 0
         try:
-            montant_ht = float(montant_ht) if montant_ht else 0.0
-            montant_ttc = float(montant_ttc) if montant_ttc else 0.0
-        except (ValueError, TypeError) as e:
-            print(f"⚠️ Erreur lors de la conversion des montants: {e}")
-            print(f"Valeurs avant conversion: HT={montant_ht}, TTC={montant_ttc}")
-            # Assigner des valeurs par défaut en cas d'erreur
-            montant_ht = 0.0
-            montant_ttc = 0.0
-        
-        # Vérifier que l'ID de facture existe
-        invoice_id = invoice.get("id")
-        if not invoice_id:
-            error_msg = f"ID de facture manquant dans les données Sellsy. Clés disponibles: {list(invoice.keys())}"
-            print(f"❌ {error_msg}")
-            logger.error(f"{error_msg}")
-            logger.error(f"Données complètes de la facture (100 premiers caractères): {str(invoice)[:100]}")
+            for page in self.table.iterate(page_size=100):
+                page_count += 1
+                for record in page:
+                    sellsy_id = str(record.get("fields", {}).get("ID_Facture", "") or "")
+                    if not sellsy_id:
+                        continue
+                    if sellsy_id in index:
+                        logger.warning("⚠️ Doublon Airtable pour la facture %s: %s et %s",
+                                       sellsy_id, index[sellsy_id]['id'], record['id'])
+                        continue
+                    index[sellsy_id] = {"id": record["id"], "fields": record.get("fields", {})}
+        except Exception as e:
+            logger.error("❌ Erreur lors du chargement de l'index Airtable: %s", e)
+            logger.warning("⚠️ Les recherches se feront facture par facture")
+            self.index = None
             return None
 
-        # Créer un dictionnaire avec des valeurs par défaut pour éviter les erreurs
-        result = {
-            "ID_Facture": str(invoice_id),  # Conversion explicite en str
-            "Numéro": reference,
-            "Date": created_date,  # Date formatée correctement
-            "Client": client_name,
-            "ID_Client_Sellsy": client_id,  # Ajout de l'ID client Sellsy
-            "Montant_HT": montant_ht,  # Maintenant c'est un float
-            "Montant_TTC": montant_ttc,  # Maintenant c'est un float
-            "Statut": status_fr,  # Statut traduit en français
-            "URL": f"https://go.sellsy.com/document/{invoice_id}"
-        }
-        
-        # Ajouter le lien direct vers le PDF si disponible
-        if pdf_link:
-            result["PDF_URL"] = pdf_link
-        
-        print(f"Montants finaux (après conversion): HT={montant_ht} (type: {type(montant_ht)}), TTC={montant_ttc} (type: {type(montant_ttc)})")
-        return result
+        self.index = index
+        logger.info("✅ Index chargé: %s factures en %s page(s)", len(index), page_count)
+        return index
+
+    def _update_index(self, sellsy_id, record_id, fields):
+        """Met à jour l'index en mémoire après une création ou une mise à jour"""
+        if self.index is None:
+            return
+        entry = self.index.get(sellsy_id)
+        if entry and entry["id"] == record_id:
+            entry["fields"] = {**entry["fields"], **fields}
+        else:
+            self.index[sellsy_id] = {"id": record_id, "fields": dict(fields)}
+
+    @staticmethod
+    def fields_hash(fields):
+        """Calcule une empreinte stable d'un dictionnaire de champs Airtable"""
+        normalized = {}
+        for key, value in fields.items():
+            # Airtable omet les champs vides et renvoie les nombres en float
+            if value is None or value == "":
+                continue
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                value = float(value)
+            normalized[key] = value
+        payload = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def is_unchanged(self, existing_record, fields):
+        """Indique si l'enregistrement Airtable contient déjà exactement ces champs"""
+        if not existing_record:
+            return False
+        existing_fields = existing_record.get("fields", {})
+        # Ne comparer que les champs écrits par la synchronisation
+        existing_subset = {key: existing_fields.get(key) for key in fields}
+        return self.fields_hash(existing_subset) == self.fields_hash(fields)
+
+    @metrics.timed("format")
+    def format_invoice_for_airtable(self, invoice):
+        """Convertit une facture Sellsy au format Airtable"""
+        return self.formatter.format(invoice)
+
+    def format_many(self, invoices):
+        """Convertit une page de factures Sellsy au format Airtable (une ligne par facture, None si invalide)"""
+        with metrics.timer("format"):
+            return self.formatter.format_many(invoices)
 
     def find_invoice_by_id(self, sellsy_id):
         """Recherche une facture dans Airtable par son ID Sellsy"""
         if not sellsy_id:
-            print("⚠️ ID Sellsy vide, impossible de rechercher la facture")
+            logger.warning("⚠️ ID Sellsy vide, impossible de rechercher la facture")
             return None
             
         sellsy_id = str(sellsy_id)  # Sécurité : conversion en chaîne
+
+        # Utiliser l'index en mémoire s'il a été chargé pour éviter un appel Airtable
+        if self.index is not None:
+            return self.index.get(sellsy_id)
+
         formula = f"{{ID_Facture}}='{sellsy_id}'"
-        print(f"🔍 Recherche dans Airtable avec formule : {formula}")
+        logger.debug("🔍 Recherche dans Airtable avec formule : %s", formula)
         try:
-            records = self.table.all(formula=formula)
-            print(f"Résultat de recherche : {len(records)} enregistrement(s) trouvé(s).")
+            with metrics.timer("airtable_lookup"):
+                records = self.table.all(formula=formula)
+            logger.debug("Résultat de recherche : %s enregistrement(s) trouvé(s).", len(records))
             return records[0] if records else None
         except Exception as e:
-            print(f"❌ Erreur lors de la recherche de la facture {sellsy_id} : {e}")
+            logger.error("❌ Erreur lors de la recherche de la facture %s : %s", sellsy_id, e)
             return None
 
-    def insert_or_update_invoice(self, invoice_data, pdf_path=None):
-        """Insère ou met à jour une facture dans Airtable avec PDF"""
-        if not invoice_data:
-            print("❌ Données de facture invalides, impossible d'insérer/mettre à jour")
-            return None
-            
+    def prepare_invoice_fields(self, invoice_data, pdf_path=None):
+        """Prépare une copie des champs Airtable d'une facture en tenant compte du PDF"""
         sellsy_id = str(invoice_data.get("ID_Facture", ""))
-        if not sellsy_id:
-            print("❌ ID Sellsy manquant dans les données, impossible d'insérer/mettre à jour")
-            return None
-        
+
         # Créer une copie des données pour ne pas modifier l'original
         invoice_data_copy = invoice_data.copy()
         
@@ -241,26 +144,55 @@ class AirtableAPI:
             try:
                 # Vérifier la taille du fichier PDF
                 file_size = os.path.getsize(pdf_path)
-                print(f"Taille du fichier PDF: {file_size} octets")
+                logger.debug("Taille du fichier PDF: %s octets", file_size)
                 
                 # Si le fichier est trop grand (plus de 2MB), utiliser un lien au lieu d'une pièce jointe
                 if file_size > 2000000:  # 2MB limite Airtable pour les attachements
-                    print(f"⚠️ Le fichier PDF est trop volumineux ({file_size/1000000:.2f} MB), utilisation du lien direct à la place")
+                    logger.warning("⚠️ Le fichier PDF est trop volumineux (%.2f MB), utilisation du lien direct à la place",
+                                   file_size/1000000)
                     # S'assurer que le lien PDF est dans les données
                     if "PDF_URL" in invoice_data_copy:
-                        print(f"✅ Utilisation du lien direct au lieu de la pièce jointe: {invoice_data_copy['PDF_URL']}")
+                        logger.debug("✅ Utilisation du lien direct au lieu de la pièce jointe: %s",
+                                     invoice_data_copy['PDF_URL'])
                     else:
-                        print("⚠️ Pas de lien PDF disponible, impossible d'ajouter la référence au PDF")
+                        logger.debug("⚠️ Pas de lien PDF disponible, impossible d'ajouter la référence au PDF")
                 elif file_size > 0:
                     # La méthode avec base64 cause des problèmes, utilisons l'URL du fichier
                     if "PDF_URL" in invoice_data_copy:
-                        print(f"✅ Utilisation du lien direct au lieu de la pièce jointe: {invoice_data_copy['PDF_URL']}")
+                        logger.debug("✅ Utilisation du lien direct au lieu de la pièce jointe: %s",
+                                     invoice_data_copy['PDF_URL'])
                     else:
-                        print("⚠️ Pas de lien PDF disponible, impossible d'ajouter la référence au PDF")
+                        logger.debug("⚠️ Pas de lien PDF disponible, impossible d'ajouter la référence au PDF")
                 else:
-                    print(f"⚠️ Fichier PDF vide pour la facture {sellsy_id}, impossible d'ajouter la pièce jointe")
+                    logger.warning("⚠️ Fichier PDF vide pour la facture %s, impossible d'ajouter la pièce jointe",
+                                   sellsy_id)
             except Exception as e:
-                print(f"❌ Erreur lors de la préparation du PDF pour Airtable: {e}")
+                logger.error("❌ Erreur lors de la préparation du PDF pour Airtable: %s", e)
+
+        return invoice_data_copy
+
+    def insert_or_update_invoice(self, invoice_data, pdf_path=None):
+        """Insère ou met à jour une facture dans Airtable avec PDF"""
+        record_id, _ = self.write_invoice(invoice_data, pdf_path)
+        return record_id
+
+    def write_invoice(self, invoice_data, pdf_path=None):
+        """
+        Insère ou met à jour une facture dans Airtable avec PDF et retourne (ID Airtable, résultat),
+        le résultat valant "created", "updated" ou "skipped" (enregistrement identique), ou
+        (None, None) si les données sont invalides
+        """
+        if not invoice_data:
+            logger.error("❌ Données de facture invalides, impossible d'insérer/mettre à jour")
+            return None, None
+            
+        sellsy_id = str(invoice_data.get("ID_Facture", ""))
+        if not sellsy_id:
+            logger.error("❌ ID Sellsy manquant dans les données, impossible d'insérer/mettre à jour")
+            return None, None
+        
+        # Créer une copie des données avec la gestion du PDF
+        invoice_data_copy = self.prepare_invoice_fields(invoice_data, pdf_path)
         
         try:
             existing_record = self.find_invoice_by_id(sellsy_id)
@@ -272,45 +204,184 @@ class AirtableAPI:
 
                 # Si l'enregistrement existant a déjà un ID valide, ne pas l'écraser
                 if existing_id and existing_id != sellsy_id:
-                    print(f"⚠️ Conflit d'ID détecté : Airtable a '{existing_id}', Sellsy renvoie '{sellsy_id}'")
-                    print(f"   Conservation de l'ID Airtable existant pour éviter d'écraser une correction manuelle")
+                    logger.warning("⚠️ Conflit d'ID détecté : Airtable a '%s', Sellsy renvoie '%s'",
+                                   existing_id, sellsy_id)
+                    logger.warning("   Conservation de l'ID Airtable existant pour éviter d'écraser une correction manuelle")
                     # Ne pas mettre à jour l'ID
                     invoice_data_copy.pop("ID_Facture", None)
 
-                print(f"🔁 Facture {sellsy_id} déjà présente, mise à jour en cours...")
-                self.table.update(record_id, invoice_data_copy)
-                print(f"✅ Facture {sellsy_id} mise à jour avec succès.")
-                return record_id
+                if self.is_unchanged(existing_record, invoice_data_copy):
+                    self.skipped_count += 1
+                    logger.debug("⏭️ Facture %s inchangée, mise à jour ignorée.", sellsy_id)
+                    return record_id, "skipped"
+
+                logger.debug("🔁 Facture %s déjà présente, mise à jour en cours...", sellsy_id)
+                with metrics.timer("airtable_write"):
+                    self.table.update(record_id, invoice_data_copy)
+                self._update_index(sellsy_id, record_id, invoice_data_copy)
+                logger.debug("✅ Facture %s mise à jour avec succès.", sellsy_id)
+                return record_id, "updated"
             else:
-                print(f"➕ Facture {sellsy_id} non trouvée, insertion en cours...")
-                record = self.table.create(invoice_data_copy)
-                print(f"✅ Facture {sellsy_id} ajoutée avec succès à Airtable (ID: {record['id']}).")
-                return record['id']
+                logger.debug("➕ Facture %s non trouvée, insertion en cours...", sellsy_id)
+                with metrics.timer("airtable_write"):
+                    record = self.table.create(invoice_data_copy)
+                self._update_index(sellsy_id, record["id"], invoice_data_copy)
+                logger.debug("✅ Facture %s ajoutée avec succès à Airtable (ID: %s).", sellsy_id, record['id'])
+                return record['id'], "created"
         except Exception as e:
-            print(f"❌ Erreur lors de l'insertion/mise à jour de la facture {sellsy_id}: {e}")
+            logger.error("❌ Erreur lors de l'insertion/mise à jour de la facture %s: %s", sellsy_id, e)
             # Afficher les clés pour le débogage
-            print(f"Clés dans les données: {list(invoice_data_copy.keys()) if invoice_data_copy else 'N/A'}")
-            print(f"Valeur du champ Date: '{invoice_data_copy.get('Date', 'N/A')}'" if invoice_data_copy else "N/A")
+            logger.debug("Clés dans les données: %s", list(invoice_data_copy.keys()) if invoice_data_copy else 'N/A')
+            logger.debug("Valeur du champ Date: '%s'", invoice_data_copy.get('Date', 'N/A'))
             raise e
 
+    def delete_records(self, record_ids):
+        """Supprime des enregistrements Airtable par lots (10 par requête) et retourne le nombre supprimé"""
+        record_ids = list(record_ids)
+        if not record_ids:
+            return 0
+        logger.info("🗑️ Suppression de %s enregistrement(s) Airtable...", len(record_ids))
+        with metrics.timer("airtable_write"):
+            deleted = self.table.batch_delete(record_ids)
+        if self.index is not None:
+            removed = set(record_ids)
+            self.index = {key: entry for key, entry in self.index.items() if entry["id"] not in removed}
+        logger.info("✅ %s enregistrement(s) supprimé(s)", len(deleted))
+        return len(deleted)
+
+class AirtableBatchWriter:
+    """Accumule les factures formatées et les écrit dans Airtable par lots de 10 (batch_upsert)"""
+
+    # Airtable n'accepte pas plus de 10 enregistrements par requête
+    BATCH_SIZE = 10
+
+    def __init__(self, airtable_api, batch_size=BATCH_SIZE, on_written=None):
+        self.airtable = airtable_api
+        self.batch_size = min(batch_size, self.BATCH_SIZE)
+        # Appelé avec les ID Sellsy effectivement écrits (ou inchangés) dans Airtable
+        self.on_written = on_written
+        self.pending = {}  # ID Sellsy -> champs Airtable en attente d'écriture
+        self.created_count = 0
+        self.updated_count = 0
+        self.skipped_count = 0
+        self.errors = []  # Liste de {"ID_Facture", "error"} pour les enregistrements en échec
+
+    def add(self, invoice_data, pdf_path=None):
+        """Ajoute une facture formatée au lot courant et l'envoie si le lot est complet"""
+        if not invoice_data:
+            logger.error("❌ Données de facture invalides, impossible de les ajouter au lot")
+            return False
+
+        sellsy_id = str(invoice_data.get("ID_Facture", ""))
+        if not sellsy_id:
+            logger.error("❌ ID Sellsy manquant dans les données, impossible de les ajouter au lot")
+            return False
+
+        fields = self.airtable.prepare_invoice_fields(invoice_data, pdf_path)
+
+        # Ne rien envoyer si l'enregistrement existant est identique
+        if self.airtable.is_unchanged(self.airtable.find_invoice_by_id(sellsy_id), fields):
+            self.skipped_count += 1
+            self.pending.pop(sellsy_id, None)
+            self._written([sellsy_id])
+            return True
+
+        # Une même facture ne peut apparaître qu'une fois par requête : la dernière version l'emporte
+        self.pending[sellsy_id] = fields
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Envoie à Airtable toutes les factures en attente, par lots de batch_size"""
+        while self.pending:
+            chunk_ids = list(self.pending)[:self.batch_size]
+            chunk = [(sellsy_id, self.pending.pop(sellsy_id)) for sellsy_id in chunk_ids]
+            self._write_chunk(chunk)
+
+    def _write_chunk(self, chunk):
+        """Écrit un lot avec batch_upsert, puis enregistrement par enregistrement en cas d'échec"""
+        records = []
+        for sellsy_id, fields in chunk:
+            existing_record = self.airtable.find_invoice_by_id(sellsy_id)
+            if existing_record:
+                records.append({"id": existing_record["id"], "fields": fields})
+            else:
+                records.append({"fields": fields})
+
+        logger.debug("📦 Envoi d'un lot de %s facture(s) à Airtable...", len(records))
+        try:
+            with metrics.timer("airtable_write"):
+                result = self.airtable.table.batch_upsert(records, key_fields=["ID_Facture"])
+        except Exception as e:
+            # Un enregistrement invalide fait échouer tout le lot : isoler le fautif
+            logger.warning("⚠️ Échec du lot (%s), écriture facture par facture...", e)
+            for sellsy_id, fields in chunk:
+                try:
+                    # Une seule recherche par facture: le résultat dit ce qui a réellement été fait
+                    _, outcome = self.airtable.write_invoice(fields)
+                    if outcome is None:
+                        raise ValueError("données de facture invalides")
+                    if outcome == "created":
+                        self.created_count += 1
+                    elif outcome == "updated":
+                        self.updated_count += 1
+                    else:
+                        self.skipped_count += 1
+                    self._written([sellsy_id])
+                except Exception as record_error:
+                    self.errors.append({"ID_Facture": sellsy_id, "error": str(record_error),
+                                        "error_class": type(record_error).__name__, "fields": fields})
+            return
+
+        created_ids = set(result.get("createdRecords", []))
+        for record in result.get("records", []):
+            fields = record.get("fields", {})
+            sellsy_id = str(fields.get("ID_Facture", "") or "")
+            if sellsy_id:
+                self.airtable._update_index(sellsy_id, record["id"], fields)
+            if record["id"] in created_ids:
+                self.created_count += 1
+            else:
+                self.updated_count += 1
+        self._written([sellsy_id for sellsy_id, _ in chunk])
+        logger.debug("✅ Lot écrit: %s créée(s), %s mise(s) à jour",
+                     len(result.get('createdRecords', [])), len(result.get('updatedRecords', [])))
+
+    def _written(self, sellsy_ids):
+        if self.on_written:
+            self.on_written(sellsy_ids)
+
+    def report(self):
+        """Affiche le bilan des écritures et le détail des enregistrements en échec"""
+        logger.info("📊 Airtable: %s créée(s), %s mise(s) à jour, %s inchangée(s) ignorée(s), %s erreur(s)",
+                    self.created_count, self.updated_count, self.skipped_count, len(self.errors))
+        for error in self.errors:
+            logger.error("   ❌ Facture %s: %s", error['ID_Facture'], error['error'])
+
 # Code principal pour synchroniser les factures Sellsy avec Airtable
 def sync_invoices_to_airtable(sellsy_api_client):
-    print("🚀 Début de la synchronisation des factures Sellsy vers Airtable...")
+    logger.info("🚀 Début de la synchronisation des factures Sellsy vers Airtable...")
 
     # Récupère toutes les factures depuis Sellsy
     invoices = sellsy_api_client.get_all_invoices()
 
     if invoices:
-        print(f"📦 {len(invoices)} factures récupérées depuis Sellsy.")
+        logger.info("📦 %s factures récupérées depuis Sellsy.", len(invoices))
         airtable_api = AirtableAPI()
+        airtable_api.load_index()
+        writer = AirtableBatchWriter(airtable_api)
 
-        # Parcours des factures récupérées et insertion ou mise à jour dans Airtable
-        for invoice in invoices:
-            formatted_invoice = airtable_api.format_invoice_for_airtable(invoice)
+        # Formatage de toutes les factures en un appel, puis insertion ou mise à jour dans Airtable par lots
+        rows = airtable_api.format_many(invoices)
+        for invoice, formatted_invoice in zip(invoices, rows):
             if formatted_invoice:
                 # Télécharger le PDF pour cette facture
-                pdf_path = sellsy_api_client.download_invoice_pdf(invoice["id"])
-                # Insérer ou mettre à jour avec le PDF
-                airtable_api.insert_or_update_invoice(formatted_invoice, pdf_path)
+                pdf_path = sellsy_api_client.download_invoice_pdf(invoice["id"], invoice_details=invoice)
+                # Ajouter au lot avec le PDF
+                writer.add(formatted_invoice, pdf_path)
 
-        print("✅ Synchronisation terminée.")
+        writer.flush()
+        writer.report()
+        logger.info("✅ Synchronisation terminée.")
@@ -0,0 +1,265 @@
+import asyncio
+from urllib.parse import quote
+import httpx
+import logging
+from config import (SELLSY_CLIENT_ID, SELLSY_API_URL, PDF_STORAGE_DIR, PDF_STORE_MAX_BYTES,
+                    SELLSY_POOL_SIZE, SELLSY_CONNECT_TIMEOUT, SELLSY_READ_TIMEOUT,
+                    AIRTABLE_API_KEY, AIRTABLE_BASE_ID, AIRTABLE_TABLE_NAME, AIRTABLE_API_URL, SELLSY_MIRROR_DB)
+from rate_limiter import get_rate_limiter
+from pdf_store import PdfDownloadError, conditional_headers, get_pdf_store
+from airtable_api import AirtableAPI
+from sellsy_api import request_access_token, token_request, token_response_data
+from token_manager import TokenManager
+from invoice_mirror import InvoiceMirror
+from metrics import metrics, status_label
+
+logger = logging.getLogger("async_clients")
+
+
+def create_async_client(pool_size=SELLSY_POOL_SIZE, connect_timeout=SELLSY_CONNECT_TIMEOUT,
+                        read_timeout=SELLSY_READ_TIMEOUT):
+    """Crée le client httpx partagé (pool de connexions persistantes commun à Sellsy et Airtable)"""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=pool_size * 2, max_keepalive_connections=pool_size),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        headers={"Accept-Encoding": "gzip, deflate"}
+    )
+
+
+async def send_rate_limited(client, method, url, **kwargs):
+    """Envoie une requête en passant par le limiteur de débit de l'hôte (sans bloquer la boucle)"""
+    limiter = get_rate_limiter(url)
+    await limiter.acquire_async()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except httpx.HTTPError:
+        metrics.count_request(url, None)
+        raise
+    metrics.count_request(url, response.status_code)
+    limiter.update_from_response(response.status_code, response.headers)
+    return response
+
+
+async def arequest_access_token(client):
+    """Demande un nouveau token d'accès Sellsy par le client httpx partagé (pool et limiteur de débit)"""
+    url, headers, data = token_request()
+    logger.debug("Tentative d'authentification à l'API Sellsy: %s", url)
+    try:
+        response = await send_rate_limited(client, "POST", url, headers=headers, content=data)
+    except httpx.HTTPError as e:
+        logger.error("❌ Erreur de connexion à l'API Sellsy: %s", e)
+        raise Exception(f"Impossible de se connecter à l'API Sellsy: {e}")
+    return token_response_data(response)
+
+
+class AsyncSellsyAPI:
+    """
+    Client Sellsy asynchrone (httpx) pour le service webhook: token, détails de
+    facture et téléchargement du PDF, sans bloquer la boucle asyncio.
+
+    Le token est fourni par un TokenManager: un seul renouvellement à la fois,
+    demandé par le client httpx partagé et anticipé avant l'expiration.
+    """
+
+    def __init__(self, client=None, pdf_store=None, token_manager=None, mirror=None):
+        self.api_url = SELLSY_API_URL
+        self.client = client or create_async_client()
+        self._owns_client = client is None
+        self.token_manager = token_manager or TokenManager(
+            request_access_token, cache_key=SELLSY_CLIENT_ID, afetch=lambda: arequest_access_token(self.client))
+        self.pdf_store = pdf_store or get_pdf_store(PDF_STORAGE_DIR, max_bytes=PDF_STORE_MAX_BYTES)
+        # Les détails relus à chaque webhook alimentent le miroir local
+        if mirror is None and SELLSY_MIRROR_DB:
+            mirror = InvoiceMirror()
+        self.mirror = mirror or None
+
+    async def aclose(self):
+        self.token_manager.close()
+        if self._owns_client:
+            await self.client.aclose()
+
+    async def get_access_token(self, stale_token=None):
+        """
+        Retourne un token valide. stale_token signale un token refusé (401): il n'est
+        renouvelé que s'il est toujours le token courant.
+        """
+        return await self.token_manager.aget_token(stale_token)
+
+    @metrics.timed("details")
+    async def get_invoice_details(self, invoice_id, max_retries=3, retry_delay=5):
+        """Récupère les détails d'une facture (None si introuvable ou après échec des tentatives)"""
+        invoice_id = str(invoice_id)
+        url = f"{self.api_url}/invoices/{invoice_id}"
+        token = await self.get_access_token()
+
+        for attempt in range(1, max_retries + 1):
+            try:
+                response = await send_rate_limited(self.client, "GET", url, headers={
+                    "Authorization": f"Bearer {token}",
+                    "Accept": "application/json"
+                })
+                if response.status_code == 200:
+                    data = response.json()
+                    invoice_data = data.get("data", data)
+                    invoice_data.setdefault("id", invoice_id)
+                    if self.mirror:
+                        await asyncio.to_thread(self.mirror.store_details, invoice_id, invoice_data,
+                                                response.headers.get("ETag"))
+                    return invoice_data
+                if response.status_code == 404:
+                    logger.error("❌ Facture %s non trouvée (404)", invoice_id)
+                    return None
+                if response.status_code == 401:
+                    logger.info("🔄 Token expiré, renouvellement...")
+                    token = await self.get_access_token(stale_token=token)
+                    metrics.count_retry("sellsy", 401)
+                    continue
+                if response.status_code == 429:
+                    # Le limiteur a été suspendu selon Retry-After
+                    logger.warning("⚠️ Limitation de débit (429), tentative %s/%s", attempt, max_retries)
+                    metrics.count_retry("sellsy", 429)
+                    continue
+                logger.error("❌ Erreur %s pour la facture %s: %s",
+                             response.status_code, invoice_id, response.text[:200])
+                metrics.count_retry("sellsy", status_label(response.status_code))
+            except httpx.HTTPError as e:
+                logger.error("❌ Exception lors de la récupération des détails: %s", e)
+                metrics.count_retry("sellsy", "error")
+
+            if attempt < max_retries:
+                await asyncio.sleep(retry_delay)
+
+        logger.error("❌ Échec après %s tentatives pour la facture %s", max_retries, invoice_id)
+        return None
+
+    @metrics.timed("pdf")
+    async def download_invoice_pdf(self, invoice_id, invoice_details=None, pdf_link=None):
+        """Télécharge le PDF d'une facture dans le magasin (GET conditionnel) et retourne son chemin"""
+        invoice_id = str(invoice_id)
+        store_entry = await asyncio.to_thread(self.pdf_store.get, invoice_id, True)
+        pdf_path = store_entry["path"] if store_entry else None
+        if pdf_path and not conditional_headers(store_entry):
+            return pdf_path
+
+        if not pdf_link:
+            if invoice_details is None:
+                invoice_details = await self.get_invoice_details(invoice_id)
+            pdf_link = (invoice_details or {}).get("pdf_link")
+
+        methods = [("Lien direct", pdf_link), ("API standard", f"{self.api_url}/invoices/{invoice_id}/document")]
+        for name, url in methods:
+            if not url:
+                continue
+
+            headers = {"Accept": "application/pdf"}
+            if pdf_path and store_entry.get("url") == url:
+                headers.update(conditional_headers(store_entry))
+
+            token = await self.get_access_token()
+            for attempt in range(2):
+                headers["Authorization"] = f"Bearer {token}"
+                limiter = get_rate_limiter(url)
+                await limiter.acquire_async()
+                try:
+                    async with self.client.stream("GET", url, headers=headers) as response:
+                        metrics.count_request(url, response.status_code)
+                        limiter.update_from_response(response.status_code, response.headers)
+                        if response.status_code == 304:
+                            logger.debug("📄 PDF inchangé pour la facture %s: %s", invoice_id, pdf_path)
+                            return pdf_path
+                        if response.status_code == 200:
+                            pdf_path, file_size = await self.pdf_store.save_async_response(invoice_id, response, url=url)
+                            logger.debug("✅ PDF téléchargé avec succès: %s (%s octets)", pdf_path, file_size)
+                            return pdf_path
+                        if response.status_code == 401 and attempt == 0:
+                            logger.info("🔄 Token expiré, renouvellement...")
+                            token = await self.get_access_token(stale_token=token)
+                            metrics.count_retry("sellsy", 401)
+                            continue
+                        logger.error("❌ Échec du téléchargement par %s: %s", name, response.status_code)
+                except PdfDownloadError as e:
+                    logger.warning("⚠️ Téléchargement par %s rejeté: %s", name, e)
+                except httpx.HTTPError as e:
+                    metrics.count_request(url, None)
+                    logger.error("❌ Exception lors du téléchargement par %s: %s", name, e)
+                break
+
+        logger.error("❌ Toutes les méthodes de téléchargement ont échoué")
+        return pdf_path
+
+
+class AsyncAirtableAPI:
+    """
+    Recherche et insertion/mise à jour asynchrones des factures dans Airtable (API REST
+    via httpx). Le formatage et la préparation des champs restent ceux d'AirtableAPI.
+    """
+
+    # Nombre de nouvelles tentatives sur un 429 Airtable
+    MAX_RETRIES = 5
+
+    def __init__(self, client=None, airtable=None):
+        self.client = client or create_async_client()
+        self._owns_client = client is None
+        self.airtable = airtable or AirtableAPI()
+        self.table_url = f"{AIRTABLE_API_URL}/v0/{AIRTABLE_BASE_ID}/{quote(str(AIRTABLE_TABLE_NAME), safe='')}"
+        self.headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}"}
+
+    async def aclose(self):
+        if self._owns_client:
+            await self.client.aclose()
+
+    def format_invoice_for_airtable(self, invoice):
+        return self.airtable.format_invoice_for_airtable(invoice)
+
+    async def _request(self, method, url, **kwargs):
+        """Requête Airtable avec nouvelles tentatives sur 429 (le limiteur applique Retry-After)"""
+        for _ in range(self.MAX_RETRIES):
+            response = await send_rate_limited(self.client, method, url, headers=self.headers, **kwargs)
+            if response.status_code != 429:
+                response.raise_for_status()
+                return response.json()
+            metrics.count_retry("airtable", 429)
+        logger.error("❌ Airtable: limitation de débit (429) persistante après %s tentatives (%s %s)",
+                     self.MAX_RETRIES, method, url)
+        raise httpx.HTTPStatusError(f"429 Too Many Requests après {self.MAX_RETRIES} tentatives: {url}",
+                                    request=response.request, response=response)
+
+    @metrics.timed("airtable_lookup")
+    async def find_invoice_by_id(self, sellsy_id):
+        """Recherche une facture par son ID Sellsy (None si absente)"""
+        data = await self._request("GET", self.table_url, params={
+            "filterByFormula": f"{{ID_Facture}}='{sellsy_id}'",
+            "maxRecords": 1
+        })
+        records = data.get("records", [])
+        return records[0] if records else None
+
+    async def insert_or_update_invoice(self, invoice_data, pdf_path=None):
+        """Insère ou met à jour une facture et retourne l'ID de l'enregistrement Airtable"""
+        sellsy_id = str(invoice_data.get("ID_Facture", ""))
+        if not sellsy_id:
+            logger.error("❌ ID Sellsy manquant dans les données, impossible d'insérer/mettre à jour")
+            return None
+
+        # Accès disque au PDF (existence, taille): hors de la boucle asyncio
+        fields = await asyncio.to_thread(self.airtable.prepare_invoice_fields, invoice_data, pdf_path)
+        existing_record = await self.find_invoice_by_id(sellsy_id)
+
+        if existing_record:
+            record_id = existing_record["id"]
+            existing_id = existing_record.get("fields", {}).get("ID_Facture", "")
+            if existing_id and existing_id != sellsy_id:
+                # Ne pas écraser une correction manuelle de l'ID
+                fields.pop("ID_Facture", None)
+            if self.airtable.is_unchanged(existing_record, fields):
+                logger.debug("⏭️ Facture %s inchangée, mise à jour ignorée.", sellsy_id)
+                return record_id
+            with metrics.timer("airtable_write"):
+                await self._request("PATCH", f"{self.table_url}/{record_id}", json={"fields": fields})
+            logger.debug("✅ Facture %s mise à jour avec succès.", sellsy_id)
+            return record_id
+
+        with metrics.timer("airtable_write"):
+            record = await self._request("POST", self.table_url, json={"fields": fields})
+        logger.debug("✅ Facture %s ajoutée avec succès à Airtable (ID: %s).", sellsy_id, record['id'])
+        return record["id"]
@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+"""
+Banc d'essai hors ligne: faux serveurs Sellsy v2 et Airtable locaux et mesure des performances
+
+Les faux serveurs (latence, quota, injection d'erreurs 429/401/5xx et taille du jeu de
+données configurables) tournent dans ce processus. Chaque scénario (sync, sync-missing,
+webhook) s'exécute dans un sous-processus pointé vers eux, ce qui isole sa mémoire
+maximale (RSS) et sa configuration. Exemple:
+
+    python benchmark.py --invoices 500 --latency 0.05 --error-429 0.02 --output bench.json
+    python benchmark.py --baseline bench.json   # échoue si le débit régresse
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+SCENARIOS = ["sync", "sync-missing", "webhook"]
+
+# Étapes mesurées côté client, déduites de l'URL de chaque requête
+STAGES = ["token", "list", "details", "pdf", "airtable_read", "airtable_write", "job"]
+
+
+# ---------------------------------------------------------------------------
+# Faux serveurs
+# ---------------------------------------------------------------------------
+
+class FakeConfig:
+    """Comportement des faux serveurs"""
+
+    def __init__(self, invoices=300, latency=0.05, jitter=0.5, rate_limit=0.0, error_429=0.0,
+                 error_401=0.0, error_5xx=0.0, pdf_size=20000, seed=42):
+        self.invoices = invoices
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.error_429 = error_429
+        self.error_401 = error_401
+        self.error_5xx = error_5xx
+        self.pdf_size = pdf_size
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def delay(self):
+        if self.latency:
+            with self.lock:
+                factor = 1 + self.random.uniform(-self.jitter, self.jitter)
+            time.sleep(max(0.0, self.latency * factor))
+
+    def injected_error(self, allow_401=True):
+        """Tire au sort une erreur injectée (code HTTP) ou None"""
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.error_429:
+            return 429
+        draw -= self.error_429
+        if allow_401 and draw < self.error_401:
+            return 401
+        draw -= self.error_401 if allow_401 else 0
+        if draw < self.error_5xx:
+            return 503
+        return None
+
+
+class FakeBackend:
+    """État partagé des faux serveurs: jeu de factures, table Airtable et compteurs de requêtes"""
+
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.counts = defaultdict(int)  # "route status" -> nombre
+        self.records = {}               # ID Airtable -> champs
+        self.next_record = 1
+        self.buckets = {}               # serveur -> [jetons, horodatage]
+        self.sellsy_url = None
+        self.invoices = [self._invoice(i) for i in range(1, config.invoices + 1)]
+
+    def _invoice(self, invoice_id):
+        day = 1 + invoice_id % 28
+        return {
+            "id": invoice_id,
+            "number": f"F-{invoice_id:06d}",
+            "date": f"2024-01-{day:02d}",
+            "created": f"2024-01-{day:02d}T10:00:00+01:00",
+            "updated": f"2024-02-{day:02d}T10:00:00+01:00",
+            "status": ["due", "paid", "late"][invoice_id % 3],
+            "related": [{"type": "company", "id": 1000 + invoice_id % 50, "name": f"Client {invoice_id % 50}"}],
+            "amounts": {"total_raw_excl_tax": f"{invoice_id * 10}.00", "total_incl_tax": f"{invoice_id * 12}.00"},
+        }
+
+    def details(self, invoice_id):
+        invoice = dict(self.invoices[invoice_id - 1])
+        invoice["pdf_link"] = f"{self.sellsy_url}/invoices/{invoice_id}/document"
+        return invoice
+
+    def list_entry(self, invoice, full=False):
+        """Entrée de liste: sans montants ni lien PDF (détails nécessaires), sauf recherche avec projection"""
+        if full:
+            return self.details(invoice["id"])
+        return {key: value for key, value in invoice.items() if key != "amounts"}
+
+    def count(self, route, status):
+        with self.lock:
+            self.counts[f"{route} {status}"] += 1
+
+    def rate_limited(self, server):
+        """Seau à jetons par serveur: True si la requête dépasse le quota"""
+        rate = self.config.rate_limit
+        if not rate:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated_at = self.buckets.get(server, (rate, now))
+            tokens = min(rate, tokens + (now - updated_at) * rate)
+            if tokens < 1:
+                self.buckets[server] = (tokens, now)
+                return True
+            self.buckets[server] = (tokens - 1, now)
+            return False
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.records.clear()
+            self.next_record = 1
+            self.buckets.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": dict(self.counts), "airtable_records": len(self.records)}
+
+    def upsert(self, record, key_fields):
+        """Crée ou met à jour un enregistrement Airtable; retourne (enregistrement, créé)"""
+        with self.lock:
+            record_id = record.get("id")
+            if not record_id and key_fields:
+                for existing_id, fields in self.records.items():
+                    if all(fields.get(key) == record["fields"].get(key) for key in key_fields):
+                        record_id = existing_id
+                        break
+            created = record_id is None or record_id not in self.records
+            if created:
+                record_id = record_id or f"rec{self.next_record:08d}"
+                self.next_record += 1
+                self.records[record_id] = {}
+            self.records[record_id].update(record.get("fields", {}))
+            return {"id": record_id, "createdTime": "2024-01-01T00:00:00.000Z",
+                    "fields": dict(self.records[record_id])}, created
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    backend = None
+    server_name = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw or b"{}")
+        except ValueError:
+            return {}
+
+    def _handle(self, method):
+        backend = self.backend
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        body = self._read_json() if method in ("POST", "PATCH") else {}
+
+        if parsed.path == "/__stats":
+            return self._send_json(200, backend.stats())
+        if parsed.path == "/__reset":
+            backend.reset()
+            return self._send_json(200, {"status": "reset"})
+
+        route = self.route(method, parsed.path)
+        backend.config.delay()
+
+        if backend.rate_limited(self.server_name):
+            backend.count(route, 429)
+            return self._send_json(429, {"error": "rate limited"}, {"Retry-After": "1"})
+        # Les 401 ne concernent que l'API Sellsy (token expiré); une clé Airtable refusée serait fatale
+        error = backend.config.injected_error(allow_401=self.server_name == "sellsy" and route != "token")
+        if error:
+            backend.count(route, error)
+            headers = {"Retry-After": "1"} if error == 429 else None
+            return self._send_json(error, {"error": "injected"}, headers)
+
+        status = self.respond(method, route, parsed.path, query, body)
+        backend.count(route, status)
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+
+class FakeSellsyHandler(FakeHandler):
+    server_name = "sellsy"
+
+    def route(self, method, path):
+        if path.endswith("/access-tokens"):
+            return "token"
+        if path.endswith("/document"):
+            return "pdf"
+        if path.endswith("/invoices") or path.endswith("/invoices/search"):
+            return "list"
+        return "details"
+
+    def respond(self, method, route, path, query, body):
+        backend = self.backend
+        if route == "token":
+            self._send_json(200, {"access_token": f"token-{time.time()}", "expires_in": 3600, "token_type": "Bearer"})
+            return 200
+
+        if route == "list":
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", ["100"])[0])
+            page = backend.invoices[offset:offset + limit]
+            full = path.endswith("/search")
+            self._send_json(200, {
+                "data": [backend.list_entry(invoice, full) for invoice in page],
+                "pagination": {"limit": limit, "count": len(page), "total": len(backend.invoices), "offset": offset}
+            })
+            return 200
+
+        match = re.search(r"/invoices/(\d+)", path)
+        invoice_id = int(match.group(1)) if match else 0
+        if not 1 <= invoice_id <= len(backend.invoices):
+            self._send_json(404, {"error": "not found"})
+            return 404
+
+        if route == "pdf":
+            etag = f'"pdf-{invoice_id}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return 304
+            content = b"%PDF-1.4\n" + b"0" * max(0, backend.config.pdf_size - 9)
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("Content-Length", str(len(content)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(content)
+            return 200
+
+        self._send_json(200, {"data": backend.details(invoice_id)}, {"ETag": f'"inv-{invoice_id}"'})
+        return 200
+
+
+class FakeAirtableHandler(FakeHandler):
+    server_name = "airtable"
+
+    def route(self, method, path):
+        return "airtable_read" if method == "GET" or path.endswith("/listRecords") else "airtable_write"
+
+    def respond(self, method, route, path, query, body):
+        backend = self.backend
+        parts = path.strip("/").split("/")  # v0, base, table[, record]
+        record_id = parts[3] if len(parts) > 3 and parts[3] != "listRecords" else None
+
+        if route == "airtable_read":
+            options = {**{key: values[0] for key, values in query.items()}, **body}
+            with backend.lock:
+                records = [{"id": rid, "createdTime": "2024-01-01T00:00:00.000Z", "fields": dict(fields)}
+                           for rid, fields in sorted(backend.records.items())]
+            formula = options.get("filterByFormula") or options.get("formula")
+            if formula:
+                match = re.search(r"\{ID_Facture\}='([^']*)'", formula)
+                wanted = match.group(1) if match else None
+                records = [r for r in records if str(r["fields"].get("ID_Facture", "")) == wanted]
+            page_size = int(options.get("pageSize", 100))
+            offset = int(options.get("offset", 0) or 0)
+            payload = {"records": records[offset:offset + page_size]}
+            if offset + page_size < len(records):
+                payload["offset"] = str(offset + page_size)
+            self._send_json(200, payload)
+            return 200
+
+        if method == "DELETE":
+            ids = query.get("records[]", [])
+            with backend.lock:
+                for rid in ids:
+                    backend.records.pop(rid, None)
+            self._send_json(200, {"records": [{"id": rid, "deleted": True} for rid in ids]})
+            return 200
+
+        if record_id:
+            record, _ = backend.upsert({"id": record_id, "fields": body.get("fields", {})}, None)
+            self._send_json(200, record)
+            return 200
+
+        if "records" in body:
+            key_fields = (body.get("performUpsert") or {}).get("fieldsToMergeOn")
+            result = {"records": [], "createdRecords": [], "updatedRecords": []}
+            for item in body["records"]:
+                record, created = backend.upsert(item, key_fields)
+                result["records"].append(record)
+                result["createdRecords" if created else "updatedRecords"].append(record["id"])
+            self._send_json(200, result)
+            return 200
+
+        record, _ = backend.upsert({"fields": body.get("fields", {})}, None)
+        self._send_json(200, record)
+        return 200
+
+
+class FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Connexions fermées par le client en fin de scénario: sans intérêt pour le rapport
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_fake_servers(config):
+    """Démarre les faux serveurs Sellsy (127.0.0.1) et Airtable (localhost: limiteur distinct)"""
+    backend = FakeBackend(config)
+    servers = []
+    for handler_class in (FakeSellsyHandler, FakeAirtableHandler):
+        handler = type(handler_class.__name__, (handler_class,), {"backend": backend})
+        server = FakeServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    sellsy_port, airtable_port = (server.server_address[1] for server in servers)
+    backend.sellsy_url = f"http://127.0.0.1:{sellsy_port}/v2"
+    return backend, servers, f"http://localhost:{airtable_port}"
+
+
+# ---------------------------------------------------------------------------
+# Scénarios (exécutés dans un sous-processus)
+# ---------------------------------------------------------------------------
+
+def _stage_for(method, url):
+    airtable_host = urlparse(os.environ["AIRTABLE_API_URL"]).netloc
+    parsed = urlparse(str(url))
+    if parsed.netloc == airtable_host:
+        return "airtable_read" if method == "GET" or parsed.path.endswith("/listRecords") else "airtable_write"
+    if parsed.path.endswith("/access-tokens"):
+        return "token"
+    if parsed.path.endswith("/document"):
+        return "pdf"
+    if parsed.path.endswith("/invoices") or parsed.path.endswith("/invoices/search"):
+        return "list"
+    return "details"
+
+
+def _instrument(samples):
+    """Mesure la durée réseau de chaque requête (requests et httpx), hors attente du limiteur"""
+    import requests.adapters
+    import httpx
+
+    original_send = requests.adapters.HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original_send(self, request, **kwargs)
+        finally:
+            samples[_stage_for(request.method, request.url)].append(time.perf_counter() - start)
+
+    requests.adapters.HTTPAdapter.send = send
+
+    original_async_send = httpx.AsyncClient.send
+
+    async def async_send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await original_async_send(self, request, **kwargs)
+        finally:
+            samples[_stage_for(request.method, request.url)].append(time.perf_counter() - start)
+
+    httpx.AsyncClient.send = async_send
+
+
+def _run_webhook(invoices, timeout=600):
+    from fastapi.testclient import TestClient
+    import webhook_handler
+
+    webhook_handler.webhook_workers.poll_interval = 0.05
+    durations = []
+    with TestClient(webhook_handler.app) as client:
+        for invoice_id in range(1, invoices + 1):
+            client.post("/webhook/sellsy", json={"eventType": "invoice.updated", "relatedid": str(invoice_id),
+                                                 "relatedtype": "invoice"})
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            stats = webhook_handler.webhook_queue.stats()
+            if stats["depth"] == 0 and stats["processing"] == 0:
+                break
+            time.sleep(0.1)
+        rows = webhook_handler.webhook_queue.db.execute(
+            "SELECT updated_at - created_at AS duration FROM jobs WHERE status = 'done'"
+        ).fetchall()
+        durations = [row["duration"] for row in rows]
+    return durations
+
+
+def run_scenario(name, invoices, result_file):
+    """Exécute un scénario contre les faux serveurs et écrit ses mesures dans result_file"""
+    import resource
+
+    samples = defaultdict(list)
+    _instrument(samples)
+
+    import main
+
+    start = time.perf_counter()
+    if name == "sync":
+        main.sync_invoices(days=3650)
+    elif name == "sync-missing":
+        main.sync_missing_invoices(limit=invoices)
+    elif name == "webhook":
+        samples["job"] = _run_webhook(invoices)
+    else:
+        raise ValueError(f"Scénario inconnu: {name}")
+    elapsed = time.perf_counter() - start
+
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump({
+            "elapsed": elapsed,
+            "samples": {stage: values for stage, values in samples.items()},
+            # ru_maxrss est en kilo-octets sous Linux
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }, f)
+
+
+# ---------------------------------------------------------------------------
+# Pilotage et rapport
+# ---------------------------------------------------------------------------
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def _scenario_env(workdir, sellsy_url, airtable_url, args):
+    env = dict(os.environ)
+    env.update({
+        "SELLSY_CLIENT_ID": "bench", "SELLSY_CLIENT_SECRET": "bench",
+        "SELLSY_API_URL": sellsy_url,
+        "SELLSY_TOKEN_URL": sellsy_url.rsplit("/v2", 1)[0] + "/oauth2/access-tokens",
+        "AIRTABLE_API_KEY": "bench", "AIRTABLE_BASE_ID": "appBench", "AIRTABLE_TABLE_NAME": "Factures",
+        "AIRTABLE_API_URL": airtable_url,
+        "PDF_STORAGE_DIR": os.path.join(workdir, "pdf_invoices"),
+        "SELLSY_MIRROR_DB": os.path.join(workdir, "sellsy_mirror.sqlite"),
+        "WEBHOOK_QUEUE_DB": os.path.join(workdir, "webhook_queue.sqlite"),
+        "SYNC_STATE_FILE": os.path.join(workdir, "sync_state.json"),
+        "SYNC_JOURNAL_DB": os.path.join(workdir, "sync_journal.sqlite"),
+        "DEAD_LETTER_DB": os.path.join(workdir, "dead_letter.sqlite"),
+        "SELLSY_TOKEN_CACHE_FILE": "",
+        "WEBHOOK_COALESCE_WINDOW": "0",
+        "WEBHOOK_RETRY_BASE_DELAY": "1",
+        "SELLSY_RATE_LIMIT": str(args.client_rate), "SELLSY_RATE_BURST": str(args.client_rate),
+        "AIRTABLE_RATE_LIMIT": str(args.client_rate), "AIRTABLE_RATE_BURST": str(args.client_rate),
+    })
+    return env
+
+
+def run_benchmark(args):
+    config = FakeConfig(invoices=args.invoices, latency=args.latency, jitter=args.jitter,
+                        rate_limit=args.rate_limit, error_429=args.error_429, error_401=args.error_401,
+                        error_5xx=args.error_5xx, pdf_size=args.pdf_size)
+    backend, servers, airtable_url = start_fake_servers(config)
+    print(f"🧪 Faux Sellsy: {backend.sellsy_url} | faux Airtable: {airtable_url} | {args.invoices} factures")
+
+    results = {}
+    try:
+        for name in args.scenarios:
+            backend.reset()
+            with tempfile.TemporaryDirectory() as workdir:
+                result_file = os.path.join(workdir, "result.json")
+                env = _scenario_env(workdir, backend.sellsy_url, airtable_url, args)
+                log = open(args.log, "a", encoding="utf-8") if args.log else subprocess.DEVNULL
+                try:
+                    completed = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--run-scenario", name,
+                         "--invoices", str(args.invoices), "--result-file", result_file],
+                        env=env, cwd=workdir, stdout=log, stderr=log
+                    )
+                finally:
+                    if args.log:
+                        log.close()
+                if completed.returncode != 0 or not os.path.exists(result_file):
+                    print(f"❌ Scénario {name} en échec (code {completed.returncode})")
+                    results[name] = {"error": f"code {completed.returncode}"}
+                    continue
+                with open(result_file, encoding="utf-8") as f:
+                    measured = json.load(f)
+
+            stats = backend.stats()
+            results[name] = {
+                "elapsed": round(measured["elapsed"], 3),
+                "invoices_per_sec": round(args.invoices / measured["elapsed"], 2) if measured["elapsed"] else None,
+                "airtable_records": stats["airtable_records"],
+                "peak_rss_mb": round(measured["peak_rss_mb"], 1),
+                "stages": {
+                    stage: {"count": len(values),
+                            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                            "p99_ms": round(percentile(values, 0.99) * 1000, 1)}
+                    for stage, values in measured["samples"].items() if values
+                },
+                "requests": stats["requests"],
+            }
+    finally:
+        for server in servers:
+            server.shutdown()
+    return results
+
+
+def print_results(results):
+    for name, result in results.items():
+        print(f"\n📊 Scénario {name}")
+        if "error" in result:
+            print(f"   ❌ {result['error']}")
+            continue
+        print(f"   {result['invoices_per_sec']} factures/s ({result['elapsed']} s), "
+              f"{result['airtable_records']} enregistrements Airtable, RSS max {result['peak_rss_mb']} Mo")
+        for stage in STAGES:
+            if stage in result["stages"]:
+                values = result["stages"][stage]
+                print(f"   {stage:<15} n={values['count']:<6} p50={values['p50_ms']:>8} ms  p99={values['p99_ms']:>8} ms")
+        print("   Requêtes: " + ", ".join(f"{key}={count}" for key, count in sorted(result["requests"].items())))
+
+
+def check_regressions(results, baseline, tolerance):
+    """Compare le débit de chaque scénario à une référence; retourne la liste des régressions"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name, {}).get("invoices_per_sec")
+        current = result.get("invoices_per_sec")
+        if reference and (current is None or current < reference * (1 - tolerance)):
+            regressions.append(f"{name}: {current} factures/s contre {reference} en référence")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc d'essai Sellsy - Airtable avec faux serveurs locaux")
+    parser.add_argument("--scenarios", type=lambda value: value.split(","), default=SCENARIOS,
+                        help=f"Scénarios séparés par des virgules ({','.join(SCENARIOS)})")
+    parser.add_argument("--invoices", type=int, default=300, help="Taille du jeu de factures")
+    parser.add_argument("--latency", type=float, default=0.05, help="Latence des faux serveurs (secondes)")
+    parser.add_argument("--jitter", type=float, default=0.5, help="Variation relative de la latence")
+    parser.add_argument("--rate-limit", type=float, default=0, help="Quota des faux serveurs (requêtes/s, 0 = illimité)")
+    parser.add_argument("--error-429", type=float, default=0, help="Proportion de réponses 429 injectées")
+    parser.add_argument("--error-401", type=float, default=0, help="Proportion de réponses 401 injectées (Sellsy)")
+    parser.add_argument("--error-5xx", type=float, default=0, help="Proportion de réponses 503 injectées")
+    parser.add_argument("--pdf-size", type=int, default=20000, help="Taille des PDF servis (octets)")
+    parser.add_argument("--client-rate", type=float, default=50, help="Quota du limiteur côté client (requêtes/s)")
+    parser.add_argument("--output", type=str, help="Enregistrer les résultats JSON dans ce fichier")
+    parser.add_argument("--baseline", type=str, help="Résultats de référence: échec si le débit régresse")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Baisse de débit tolérée (0.2 = 20%%)")
+    parser.add_argument("--log", type=str, help="Fichier recevant la sortie des scénarios")
+    parser.add_argument("--run-scenario", type=str, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        run_scenario(args.run_scenario, args.invoices, args.result_file)
+        return 0
+
+    results = run_benchmark(args)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Résultats enregistrés: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = check_regressions(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n❌ Régressions de débit:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print("\n✅ Aucune régression de débit")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
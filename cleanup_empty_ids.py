@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 """
 Script de nettoyage pour identifier et supprimer les factures avec ID vide dans Airtable
+
+La commande `python main.py reconcile --delete-orphans` couvre aussi ce cas (lignes sans
+ID_Facture), en plus des factures absentes de Sellsy.
 """
 
 from airtable_api import AirtableAPI
+from logging_setup import setup_logging
 
 def find_and_list_empty_id_invoices():
     """Trouve toutes les factures avec ID_Facture vide"""
@@ -49,20 +53,15 @@ def delete_empty_id_invoices(records):
 
     print(f"\nSuppression de {len(records)} facture(s) avec ID vide...\n")
 
-    for idx, record in enumerate(records, 1):
-        record_id = record.get('id')
-        fields = record.get('fields', {})
-        numero = fields.get('Numéro', 'N/A')
-
-        try:
-            airtable.table.delete(record_id)
-            print(f"{idx}/{len(records)} - Facture supprimée (Record ID: {record_id}, Numéro: {numero})")
-        except Exception as e:
-            print(f"{idx}/{len(records)} - Erreur lors de la suppression de {record_id}: {e}")
+    try:
+        airtable.delete_records(record.get('id') for record in records)
+    except Exception as e:
+        print(f"Erreur lors de la suppression: {e}")
 
     print("\nSuppression terminée.")
 
 if __name__ == "__main__":
+    setup_logging()
     print("=" * 60)
     print("NETTOYAGE DES FACTURES AVEC ID VIDE DANS AIRTABLE")
     print("=" * 60)
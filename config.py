@@ -1,6 +1,9 @@
+import logging
 import os
 from dotenv import load_dotenv
 
+logger = logging.getLogger("config")
+
 # Charger les variables d'environnement à partir du fichier .env si disponible
 load_dotenv()
 
@@ -8,18 +11,100 @@ load_dotenv()
 SELLSY_CLIENT_ID = os.getenv("SELLSY_CLIENT_ID")
 SELLSY_CLIENT_SECRET = os.getenv("SELLSY_CLIENT_SECRET")
 SELLSY_API_URL = os.getenv("SELLSY_API_URL", "https://api.sellsy.com/v2")
+SELLSY_TOKEN_URL = os.getenv("SELLSY_TOKEN_URL", "https://login.sellsy.com/oauth2/access-tokens")
 
 # Configuration Airtable
 AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
 AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
 AIRTABLE_TABLE_NAME = os.getenv("AIRTABLE_TABLE_NAME")
+AIRTABLE_API_URL = os.getenv("AIRTABLE_API_URL", "https://api.airtable.com")
 
 # Configuration du webhook
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "votre_secret_webhook")
 
+# File durable des webhooks (base SQLite, workers, tentatives et délai initial entre tentatives en secondes)
+WEBHOOK_QUEUE_DB = os.getenv("WEBHOOK_QUEUE_DB", "webhook_queue.sqlite")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_RETRY_BASE_DELAY = float(os.getenv("WEBHOOK_RETRY_BASE_DELAY", "10"))
+# Bail d'un job en cours (secondes): au-delà, un job resté "processing" (processus arrêté) est repris
+WEBHOOK_VISIBILITY_TIMEOUT = float(os.getenv("WEBHOOK_VISIBILITY_TIMEOUT", "300"))
+
+# Regroupement des webhooks d'une même facture: fenêtre d'attente, attente maximale (secondes)
+# et durée de conservation des clés d'idempotence (événements déjà reçus, avec identifiant de livraison)
+WEBHOOK_COALESCE_WINDOW = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "5"))
+WEBHOOK_COALESCE_MAX_WAIT = float(os.getenv("WEBHOOK_COALESCE_MAX_WAIT", "60"))
+WEBHOOK_IDEMPOTENCY_TTL = float(os.getenv("WEBHOOK_IDEMPOTENCY_TTL", "86400"))
+
 # Répertoire pour stocker les PDF des factures
 PDF_STORAGE_DIR = os.getenv("PDF_STORAGE_DIR", "pdf_invoices")
 
+# Taille maximale du magasin de PDF en Mo (0 = illimitée), au-delà les moins récents sont évincés
+PDF_STORE_MAX_BYTES = int(float(os.getenv("PDF_STORE_MAX_MB", "1024")) * 1024 * 1024)
+
+# Concurrence du pipeline de synchronisation (workers par étape et taille des files)
+SYNC_FETCH_WORKERS = int(os.getenv("SYNC_FETCH_WORKERS", "4"))
+SYNC_PDF_WORKERS = int(os.getenv("SYNC_PDF_WORKERS", "4"))
+SYNC_WRITE_WORKERS = int(os.getenv("SYNC_WRITE_WORKERS", "1"))
+SYNC_QUEUE_SIZE = int(os.getenv("SYNC_QUEUE_SIZE", "50"))
+
+# Connexions HTTP vers Sellsy (taille du pool par hôte et délais en secondes)
+SELLSY_POOL_SIZE = int(os.getenv("SELLSY_POOL_SIZE", "10"))
+SELLSY_CONNECT_TIMEOUT = float(os.getenv("SELLSY_CONNECT_TIMEOUT", "10"))
+SELLSY_READ_TIMEOUT = float(os.getenv("SELLSY_READ_TIMEOUT", "60"))
+
+# Token Sellsy: renouvellement anticipé (secondes avant expiration) et cache disque optionnel
+# (fichier lisible par le seul propriétaire, vide = désactivé) pour les exécutions courtes
+SELLSY_TOKEN_REFRESH_MARGIN = float(os.getenv("SELLSY_TOKEN_REFRESH_MARGIN", "300"))
+SELLSY_TOKEN_CACHE_FILE = os.getenv("SELLSY_TOKEN_CACHE_FILE", "")
+
+# Fichier d'état des synchronisations incrémentales (curseur de la dernière synchronisation)
+SYNC_STATE_FILE = os.getenv("SYNC_STATE_FILE", ".sync_state.json")
+
+# Journal de reprise des synchronisations (SQLite) et durée de conservation des runs terminés (jours)
+SYNC_JOURNAL_DB = os.getenv("SYNC_JOURNAL_DB", "sync_journal.sqlite")
+SYNC_JOURNAL_KEEP_DAYS = float(os.getenv("SYNC_JOURNAL_KEEP_DAYS", "14"))
+
+# Factures en échec (SQLite, vide = désactivé): nombre maximum de nouvelles tentatives par
+# `main.py retry-failed` et délai initial entre tentatives en secondes (doublé à chaque échec)
+DEAD_LETTER_DB = os.getenv("DEAD_LETTER_DB", "dead_letter.sqlite")
+DEAD_LETTER_MAX_ATTEMPTS = int(os.getenv("DEAD_LETTER_MAX_ATTEMPTS", "5"))
+DEAD_LETTER_RETRY_BASE_DELAY = float(os.getenv("DEAD_LETTER_RETRY_BASE_DELAY", "30"))
+
+# Nombre de pages de la liste des factures préchargées en parallèle
+SELLSY_PAGE_PREFETCH = int(os.getenv("SELLSY_PAGE_PREFETCH", "4"))
+
+# Listing par la recherche Sellsy (POST /invoices/search) avec projection des champs et objets liés
+SELLSY_USE_SEARCH = os.getenv("SELLSY_USE_SEARCH", "false").lower() in ("1", "true", "yes")
+SELLSY_SEARCH_FIELDS = [f for f in os.getenv(
+    "SELLSY_SEARCH_FIELDS",
+    "id,number,reference,date,created,updated,status,amounts,related,pdf_link,company_name"
+).split(",") if f]
+SELLSY_SEARCH_EMBED = [e for e in os.getenv("SELLSY_SEARCH_EMBED", "").split(",") if e]
+
+# Cache des détails de facture (durée de vie en secondes, nombre maximum d'entrées)
+SELLSY_DETAILS_CACHE_TTL = float(os.getenv("SELLSY_DETAILS_CACHE_TTL", "300"))
+SELLSY_DETAILS_CACHE_SIZE = int(os.getenv("SELLSY_DETAILS_CACHE_SIZE", "1000"))
+
+# Miroir local des factures Sellsy (SQLite, vide = désactivé) et durée de validité des détails
+# en secondes quand la liste ne permet pas de savoir s'ils ont changé
+SELLSY_MIRROR_DB = os.getenv("SELLSY_MIRROR_DB", "sellsy_mirror.sqlite")
+SELLSY_MIRROR_TTL = float(os.getenv("SELLSY_MIRROR_TTL", "3600"))
+
+# Quotas de requêtes par API (requêtes/s et taille de rafale) pour le limiteur de débit
+SELLSY_RATE_LIMIT = float(os.getenv("SELLSY_RATE_LIMIT", "5"))
+SELLSY_RATE_BURST = float(os.getenv("SELLSY_RATE_BURST", "5"))
+AIRTABLE_RATE_LIMIT = float(os.getenv("AIRTABLE_RATE_LIMIT", "5"))
+AIRTABLE_RATE_BURST = float(os.getenv("AIRTABLE_RATE_BURST", "5"))
+DEFAULT_RATE_LIMIT = float(os.getenv("DEFAULT_RATE_LIMIT", "10"))
+
+# Journalisation: niveau (DEBUG, INFO, WARNING...), fichier optionnel (vide = console seule)
+# avec rotation par taille (Mo) et nombre d'anciens fichiers conservés
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FILE = os.getenv("LOG_FILE", "")
+LOG_MAX_BYTES = int(float(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024)
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+
 # Vérification des variables requises
 missing_vars = []
 for var_name in ["SELLSY_CLIENT_ID", "SELLSY_CLIENT_SECRET", "AIRTABLE_API_KEY", "AIRTABLE_BASE_ID", "AIRTABLE_TABLE_NAME"]:
@@ -27,5 +112,5 @@ for var_name in ["SELLSY_CLIENT_ID", "SELLSY_CLIENT_SECRET", "AIRTABLE_API_KEY",
         missing_vars.append(var_name)
 
 if missing_vars:
-    print(f"ERREUR: Variables d'environnement manquantes: {', '.join(missing_vars)}")
-    print("Assurez-vous que ces variables sont définies dans le fichier .env ou dans les secrets GitHub.")
+    logger.error("ERREUR: Variables d'environnement manquantes: %s", ', '.join(missing_vars))
+    logger.error("Assurez-vous que ces variables sont définies dans le fichier .env ou dans les secrets GitHub.")
@@ -0,0 +1,133 @@
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from config import DEAD_LETTER_DB, DEAD_LETTER_MAX_ATTEMPTS, DEAD_LETTER_RETRY_BASE_DELAY
+
+logger = logging.getLogger("dead_letter")
+
+
+class DeadLetterStore:
+    """
+    Factures en échec (SQLite en mode WAL), une entrée par facture: étape, classe et
+    message de l'erreur, instantané des données au moment de l'échec.
+
+    Alimentée par le pipeline de synchronisation et par les webhooks abandonnés, elle est
+    vidée par `main.py retry-failed`, qui retraite les factures dues avec un délai
+    exponentiel avec gigue, jusqu'à max_attempts tentatives. Une facture ensuite écrite
+    avec succès dans Airtable, quelle que soit la commande, est résolue.
+    """
+
+    def __init__(self, path=DEAD_LETTER_DB, max_attempts=DEAD_LETTER_MAX_ATTEMPTS,
+                 base_delay=DEAD_LETTER_RETRY_BASE_DELAY):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS dead_letters (
+                    invoice_id TEXT PRIMARY KEY,
+                    stage TEXT,
+                    error_class TEXT,
+                    error TEXT,
+                    payload TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    first_failed_at REAL,
+                    last_failed_at REAL,
+                    resolved_at REAL
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_dead_letters_due "
+                            "ON dead_letters(resolved_at, next_attempt_at)")
+
+    def add(self, invoice_id, stage, error, payload=None, error_class=None):
+        """Enregistre l'échec d'une facture (une facture déjà résolue repart de zéro tentative)"""
+        if not invoice_id or str(invoice_id) == "None":
+            return
+        now = time.time()
+        if error_class is None:
+            error_class = type(error).__name__ if isinstance(error, BaseException) else "Error"
+        payload_json = json.dumps(payload, default=str) if payload is not None else None
+        with self._lock, self.db:
+            self.db.execute("""
+                INSERT INTO dead_letters (invoice_id, stage, error_class, error, payload, next_attempt_at,
+                                          first_failed_at, last_failed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(invoice_id) DO UPDATE SET
+                    stage = excluded.stage,
+                    error_class = excluded.error_class,
+                    error = excluded.error,
+                    payload = COALESCE(excluded.payload, dead_letters.payload),
+                    last_failed_at = excluded.last_failed_at,
+                    attempts = CASE WHEN dead_letters.resolved_at IS NULL THEN dead_letters.attempts ELSE 0 END,
+                    next_attempt_at = CASE WHEN dead_letters.resolved_at IS NULL
+                                           THEN dead_letters.next_attempt_at ELSE excluded.next_attempt_at END,
+                    first_failed_at = CASE WHEN dead_letters.resolved_at IS NULL
+                                           THEN dead_letters.first_failed_at ELSE excluded.first_failed_at END,
+                    resolved_at = NULL
+            """, (str(invoice_id), stage, error_class, str(error), payload_json, now, now, now))
+        logger.debug("🪦 Facture %s en échec à l'étape %s (%s)", invoice_id, stage, error_class)
+
+    def resolve(self, invoice_ids):
+        """Marque des factures comme résolues (synchronisées avec succès)"""
+        invoice_ids = [str(invoice_id) for invoice_id in invoice_ids]
+        if not invoice_ids:
+            return
+        now = time.time()
+        with self._lock, self.db:
+            self.db.executemany("UPDATE dead_letters SET resolved_at = ? WHERE invoice_id = ? AND resolved_at IS NULL",
+                                [(now, invoice_id) for invoice_id in invoice_ids])
+
+    def due(self, limit=None, stage=None):
+        """Entrées à retraiter maintenant (non résolues, tentatives restantes, délai écoulé)"""
+        query = ("SELECT * FROM dead_letters WHERE resolved_at IS NULL AND attempts < ? AND next_attempt_at <= ?"
+                 + (" AND stage = ?" if stage else "") + " ORDER BY next_attempt_at")
+        params = [self.max_attempts, time.time()] + ([stage] if stage else [])
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [dict(row) for row in self.db.execute(query, params).fetchall()]
+
+    def next_due_at(self, stage=None):
+        """Date de la prochaine tentative planifiée, ou None s'il n'y a plus rien à retraiter"""
+        query = ("SELECT MIN(next_attempt_at) AS next_at FROM dead_letters WHERE resolved_at IS NULL AND attempts < ?"
+                 + (" AND stage = ?" if stage else ""))
+        row = self.db.execute(query, [self.max_attempts] + ([stage] if stage else [])).fetchone()
+        return row["next_at"]
+
+    def begin_attempt(self, entries):
+        """Compte une tentative pour chaque entrée et planifie la suivante (délai exponentiel avec gigue)"""
+        now = time.time()
+        rows = []
+        for entry in entries:
+            attempts = entry["attempts"] + 1
+            delay = self.base_delay * (2 ** (attempts - 1))
+            rows.append((attempts, now + delay * random.uniform(0.8, 1.2), entry["invoice_id"]))
+        with self._lock, self.db:
+            self.db.executemany("UPDATE dead_letters SET attempts = ?, next_attempt_at = ? WHERE invoice_id = ?", rows)
+
+    def entries(self, include_resolved=False):
+        """Entrées de la file, des plus récentes aux plus anciennes"""
+        query = "SELECT * FROM dead_letters" + ("" if include_resolved else " WHERE resolved_at IS NULL")
+        return [dict(row) for row in self.db.execute(query + " ORDER BY last_failed_at DESC").fetchall()]
+
+    def counts(self):
+        """Nombre d'entrées à retraiter, abandonnées (tentatives épuisées) et résolues"""
+        row = self.db.execute("""
+            SELECT
+                SUM(resolved_at IS NULL AND attempts < ?) AS pending,
+                SUM(resolved_at IS NULL AND attempts >= ?) AS abandoned,
+                SUM(resolved_at IS NOT NULL) AS resolved
+            FROM dead_letters
+        """, (self.max_attempts, self.max_attempts)).fetchone()
+        return {key: row[key] or 0 for key in ("pending", "abandoned", "resolved")}
+
+    def close(self):
+        self.db.close()
@@ -4,19 +4,22 @@ Script de debug pour analyser la structure des données Sellsy
 """
 
 from sellsy_api import SellsyAPI
+from invoice_mirror import InvoiceMirror
+from logging_setup import setup_logging
 import json
+import sys
 
-def debug_recent_invoices():
-    """Analyse les 10 dernières factures pour voir leur structure"""
-    sellsy = SellsyAPI()
+def debug_recent_invoices(offline=False):
+    """Analyse les 10 dernières factures pour voir leur structure (depuis le miroir local si offline)"""
+    sellsy = InvoiceMirror() if offline else SellsyAPI()
 
     print("=" * 80)
     print("DEBUG: ANALYSE DES FACTURES SELLSY")
     print("=" * 80)
     print()
 
-    print("Récupération des 10 dernières factures...")
-    invoices = sellsy.get_all_invoices(limit=10)
+    print("Récupération des 10 dernières factures" + (" depuis le miroir local..." if offline else "..."))
+    invoices = sellsy.query(limit=10) if offline else sellsy.get_all_invoices(limit=10)
 
     if not invoices:
         print("Aucune facture trouvée.")
@@ -84,7 +87,7 @@ def debug_recent_invoices():
         if first_invoice_id:
             print(f"\n\nTEST: Récupération des détails de la facture {first_invoice_id}")
             print("-" * 80)
-            details = sellsy.get_invoice_details(first_invoice_id)
+            details = sellsy.get(first_invoice_id) if offline else sellsy.get_invoice_details(first_invoice_id)
 
             if details:
                 print("Détails récupérés avec succès!")
@@ -96,8 +99,11 @@ def debug_recent_invoices():
             print("\nATTENTION: La première facture n'a pas d'ID!")
 
 if __name__ == "__main__":
+    # Les messages de l'API (niveau DEBUG compris) accompagnent l'analyse des données
+    setup_logging("DEBUG")
     try:
-        debug_recent_invoices()
+        # --offline: lire le miroir local sans appeler l'API Sellsy
+        debug_recent_invoices(offline="--offline" in sys.argv)
     except Exception as e:
         print(f"\n\nERREUR: {e}")
         import traceback
@@ -0,0 +1,221 @@
+import datetime
+import logging
+
+logger = logging.getLogger("invoice_formatter")
+
+# Clés Sellsy possibles pour chaque champ, par ordre de priorité
+DATE_KEYS = ("created_at", "date", "created")
+REFERENCE_KEYS = ("reference", "number", "decimal_number")
+HT_KEYS = ("total_excluding_tax", "total_excl_tax", "tax_excl", "total_raw_excl_tax")
+TTC_KEYS = ("total_including_tax", "total_incl_tax", "tax_incl")
+
+# Types de tiers retenus comme client dans une liste "related"
+CLIENT_TYPES = ("individual", "corporation", "company")
+
+# Nombre maximum de schémas compilés gardés en cache
+MAX_SCHEMAS = 256
+
+
+def _shape(value):
+    """Forme d'un objet imbriqué: ses clés pour un dict, son type sinon"""
+    return tuple(value) if isinstance(value, dict) else type(value)
+
+
+def schema_signature(invoice):
+    """Signature du schéma d'une facture: clés de premier niveau et forme des objets client et montants"""
+    return (tuple(invoice), _shape(invoice.get("relation")), _shape(invoice.get("related")),
+            _shape(invoice.get("amounts")), _shape(invoice.get("amount")))
+
+
+def _present(candidates, keys):
+    """Clés candidates présentes dans le schéma, dans l'ordre de priorité"""
+    return tuple(key for key in candidates if key in keys)
+
+
+def _compile_client_name(keys):
+    """Nom de client de repli quand l'objet lié n'en fournit pas"""
+    if "company_name" in keys:
+        return lambda invoice, client_id: invoice["company_name"]
+    if "client_name" in keys:
+        return lambda invoice, client_id: invoice["client_name"]
+    return lambda invoice, client_id: ("Client #" + str(client_id)) if client_id else ""
+
+
+def _compile_client(sample, keys):
+    """Extracteur (ID client, nom) selon la structure relation / related du schéma"""
+    if "relation" in keys:
+        relation = sample["relation"]
+        has_id = isinstance(relation, dict) and "id" in relation
+        has_name = isinstance(relation, dict) and "name" in relation
+
+        def client(invoice):
+            relation = invoice["relation"]
+            return (str(relation["id"]) if has_id else None), (relation["name"] if has_name else "")
+        return client
+
+    if "related" not in keys:
+        return lambda invoice: (None, "")
+
+    fallback_name = _compile_client_name(keys)
+    related = sample["related"]
+    if isinstance(related, dict):
+        if "id" not in related:
+            return lambda invoice: (None, fallback_name(invoice, None))
+
+        def client(invoice):
+            related = invoice["related"]
+            client_id = str(related.get("id", ""))
+            return client_id, related.get("name", "") or fallback_name(invoice, client_id)
+        return client
+
+    if isinstance(related, list):
+        # Le type de chaque tiers n'est connu qu'à la lecture: parcours de la liste
+        def client(invoice):
+            for item in invoice["related"]:
+                if item.get("type", "") in CLIENT_TYPES:
+                    client_id = str(item.get("id", ""))
+                    return client_id, item.get("name", "") or fallback_name(invoice, client_id)
+            return None, fallback_name(invoice, None)
+        return client
+
+    return lambda invoice: (None, fallback_name(invoice, None))
+
+
+def _compile_amounts(sample, keys):
+    """Extracteur (HT, TTC) en float selon les structures de montants présentes dans le schéma"""
+    amounts = sample["amounts"] if "amounts" in keys else None
+    amount = sample["amount"] if "amount" in keys else None
+    ht_keys = _present(HT_KEYS, amounts) if isinstance(amounts, dict) else ()
+    ttc_keys = _present(TTC_KEYS, amounts) if isinstance(amounts, dict) else ()
+    amount_ht = isinstance(amount, dict) and "tax_excl" in amount
+    amount_ttc = isinstance(amount, dict) and "tax_incl" in amount
+    direct_ht = "total_amount_without_taxes" in keys
+    direct_ttc = "total_amount_with_taxes" in keys
+
+    def extract(invoice):
+        montant_ht = 0
+        montant_ttc = 0
+        if ht_keys or ttc_keys:
+            amounts = invoice["amounts"]
+            for key in ht_keys:
+                if amounts[key] is not None:
+                    montant_ht = amounts[key]
+                    break
+            for key in ttc_keys:
+                if amounts[key] is not None:
+                    montant_ttc = amounts[key]
+                    break
+
+        # Replis sur les autres structures si les montants sont toujours à 0
+        if montant_ht == 0 and amount_ht:
+            montant_ht = invoice["amount"]["tax_excl"]
+        if montant_ttc == 0 and amount_ttc:
+            montant_ttc = invoice["amount"]["tax_incl"]
+        if montant_ht == 0 and direct_ht:
+            montant_ht = invoice["total_amount_without_taxes"]
+        if montant_ttc == 0 and direct_ttc:
+            montant_ttc = invoice["total_amount_with_taxes"]
+
+        # Conversion explicite en float pour Airtable
+        try:
+            return (float(montant_ht) if montant_ht else 0.0), (float(montant_ttc) if montant_ttc else 0.0)
+        except (ValueError, TypeError) as e:
+            logger.warning("⚠️ Erreur lors de la conversion des montants: %s", e)
+            logger.debug("Valeurs avant conversion: HT=%s, TTC=%s", montant_ht, montant_ttc)
+            return 0.0, 0.0
+    return extract
+
+
+class InvoiceFormatter:
+    """
+    Conversion des factures Sellsy au format Airtable.
+
+    Les réponses Sellsy varient selon l'endpoint (liste, recherche, détail): client
+    dans "relation" ou "related" (dict ou liste), plusieurs clés possibles pour la date,
+    les montants et le numéro. Au lieu de sonder chaque facture, la structure est
+    résolue une fois par schéma (signature des clés) en un extracteur spécialisé,
+    mis en cache: les factures d'une même page le partagent.
+    """
+
+    def __init__(self, status_translations=None):
+        self.status_translations = status_translations or {}
+        self._extractors = {}  # signature -> extracteur compilé
+
+    def format(self, invoice):
+        """Convertit une facture Sellsy au format Airtable (None si elle est vide ou sans ID)"""
+        if not invoice:
+            logger.warning("⚠️ Données de facture invalides ou vides")
+            return None
+        signature = schema_signature(invoice)
+        extractor = self._extractors.get(signature)
+        if extractor is None:
+            extractor = self._compile(invoice)
+            if len(self._extractors) >= MAX_SCHEMAS:
+                self._extractors.clear()
+            self._extractors[signature] = extractor
+        return extractor(invoice)
+
+    def format_many(self, invoices):
+        """Convertit une page de factures; retourne une ligne par facture (None si elle n'a pu être formatée)"""
+        return [self.format(invoice) for invoice in invoices]
+
+    def _compile(self, sample):
+        """Construit l'extracteur spécialisé pour le schéma de la facture donnée"""
+        keys = set(sample)
+        logger.debug("Nouveau schéma de facture: clés %s", sorted(keys))
+        client = _compile_client(sample, keys)
+        amounts = _compile_amounts(sample, keys)
+        date_keys = _present(DATE_KEYS, keys)
+        reference_keys = _present(REFERENCE_KEYS, keys)
+        has_status = "status" in keys
+        has_pdf_link = "pdf_link" in keys
+        translations = self.status_translations
+
+        def extract(invoice):
+            invoice_id = invoice.get("id")
+            if not invoice_id:
+                logger.error("❌ ID de facture manquant dans les données Sellsy. Clés disponibles: %s", list(invoice))
+                return None
+
+            client_id, client_name = client(invoice)
+            if not client_id:
+                logger.warning("⚠️ Aucun ID client trouvé pour la facture %s", invoice_id)
+
+            # Date au format YYYY-MM-DD pour Airtable (partie date d'un horodatage ISO)
+            created_date = ""
+            for key in date_keys:
+                if invoice[key]:
+                    created_date = invoice[key]
+                    break
+            if created_date:
+                if "T" in created_date:
+                    created_date = created_date.split("T")[0]
+            else:
+                created_date = datetime.datetime.now().strftime("%Y-%m-%d")
+                logger.warning("⚠️ Date non trouvée pour la facture %s, utilisation de la date actuelle", invoice_id)
+
+            montant_ht, montant_ttc = amounts(invoice)
+
+            reference = ""
+            for key in reference_keys:
+                if invoice[key]:
+                    reference = invoice[key]
+                    break
+
+            status = invoice["status"] if has_status else ""
+            result = {
+                "ID_Facture": str(invoice_id),
+                "Numéro": reference,
+                "Date": created_date,
+                "Client": client_name,
+                "ID_Client_Sellsy": client_id,
+                "Montant_HT": montant_ht,
+                "Montant_TTC": montant_ttc,
+                "Statut": translations.get(status, status),
+                "URL": f"https://go.sellsy.com/document/{invoice_id}"
+            }
+            pdf_link = invoice["pdf_link"] if has_pdf_link else ""
+            if pdf_link:
+                result["PDF_URL"] = pdf_link
+            return result
+        return extract
@@ -0,0 +1,169 @@
+import json
+import sqlite3
+import threading
+import time
+from config import SELLSY_MIRROR_DB, SELLSY_MIRROR_TTL
+
+
+def _client_id(invoice):
+    """ID client d'une facture Sellsy (relation ou related, dict ou liste), ou None"""
+    relation = invoice.get("relation")
+    if isinstance(relation, dict) and relation.get("id"):
+        return str(relation["id"])
+    related = invoice.get("related")
+    if isinstance(related, dict) and related.get("id"):
+        return str(related["id"])
+    if isinstance(related, list):
+        for item in related:
+            if isinstance(item, dict) and item.get("type") in ("individual", "corporation", "company"):
+                return str(item.get("id"))
+    return None
+
+
+def _invoice_date(invoice):
+    for field in ("created_at", "date", "created"):
+        if invoice.get(field):
+            return str(invoice[field])
+    return None
+
+
+def _updated(invoice):
+    for field in ("updated", "updated_at"):
+        if invoice.get(field):
+            return str(invoice[field])
+    return None
+
+
+class InvoiceMirror:
+    """
+    Miroir local des factures Sellsy (SQLite en mode WAL), utilisé comme cache en lecture.
+
+    Chaque facture conserve le JSON de la liste et celui des détails, leur date de
+    récupération et l'ETag des détails. Les détails sont considérés frais si la
+    dernière liste annonce la même date de modification que celle des détails, ou à
+    défaut s'ils ont moins de ttl secondes. Les outils hors ligne (debug, rapports,
+    réconciliation) peuvent interroger le miroir sans appeler l'API.
+    """
+
+    def __init__(self, path=SELLSY_MIRROR_DB, ttl=SELLSY_MIRROR_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS invoices (
+                    id TEXT PRIMARY KEY,
+                    status TEXT,
+                    client_id TEXT,
+                    date TEXT,
+                    updated TEXT,
+                    list_json TEXT,
+                    list_fetched_at REAL,
+                    detail_json TEXT,
+                    detail_updated TEXT,
+                    detail_fetched_at REAL,
+                    etag TEXT
+                )
+            """)
+            for column in ("status", "client_id", "date", "updated"):
+                self.db.execute(f"CREATE INDEX IF NOT EXISTS idx_invoices_{column} ON invoices({column})")
+
+    def store_list(self, invoices):
+        """Enregistre une page de la liste des factures (les détails déjà connus sont conservés)"""
+        now = time.time()
+        rows = [
+            (str(invoice["id"]), invoice.get("status"), _client_id(invoice), _invoice_date(invoice),
+             _updated(invoice), json.dumps(invoice, default=str), now)
+            for invoice in invoices if invoice.get("id")
+        ]
+        with self._lock, self.db:
+            self.db.executemany("""
+                INSERT INTO invoices (id, status, client_id, date, updated, list_json, list_fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    status = excluded.status,
+                    client_id = COALESCE(excluded.client_id, invoices.client_id),
+                    date = COALESCE(excluded.date, invoices.date),
+                    updated = excluded.updated,
+                    list_json = excluded.list_json,
+                    list_fetched_at = excluded.list_fetched_at
+            """, rows)
+
+    def store_details(self, invoice_id, details, etag=None):
+        """Enregistre les détails d'une facture"""
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute("""
+                INSERT INTO invoices (id, status, client_id, date, updated, detail_json, detail_updated,
+                                      detail_fetched_at, etag)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    status = excluded.status,
+                    client_id = COALESCE(excluded.client_id, invoices.client_id),
+                    date = COALESCE(excluded.date, invoices.date),
+                    updated = COALESCE(excluded.updated, invoices.updated),
+                    detail_json = excluded.detail_json,
+                    detail_updated = excluded.detail_updated,
+                    detail_fetched_at = excluded.detail_fetched_at,
+                    etag = excluded.etag
+            """, (str(invoice_id), details.get("status"), _client_id(details), _invoice_date(details),
+                  _updated(details), json.dumps(details, default=str), _updated(details), now, etag))
+
+    def touch_details(self, invoice_id):
+        """Marque les détails comme revalidés (réponse 304)"""
+        with self._lock, self.db:
+            self.db.execute("UPDATE invoices SET detail_fetched_at = ? WHERE id = ?", (time.time(), str(invoice_id)))
+
+    def get_details(self, invoice_id):
+        """Retourne (détails, frais, etag) pour une facture, ou (None, False, None) si inconnue"""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT updated, detail_json, detail_updated, detail_fetched_at, etag FROM invoices WHERE id = ?",
+                (str(invoice_id),)
+            ).fetchone()
+        if row is None or row["detail_json"] is None:
+            return None, False, None
+        if row["updated"] and row["detail_updated"]:
+            fresh = row["updated"] == row["detail_updated"]
+        else:
+            fresh = time.time() - row["detail_fetched_at"] < self.ttl
+        return json.loads(row["detail_json"]), fresh, row["etag"]
+
+    def get(self, invoice_id):
+        """Retourne la facture la plus complète connue (détails, sinon liste), ou None"""
+        with self._lock:
+            row = self.db.execute("SELECT detail_json, list_json FROM invoices WHERE id = ?",
+                                  (str(invoice_id),)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row["detail_json"] or row["list_json"])
+
+    def query(self, status=None, client_id=None, date_from=None, date_to=None, limit=None):
+        """Interroge le miroir hors ligne (filtres sur les colonnes indexées), factures les plus récentes d'abord"""
+        clauses, params = [], []
+        for column, operator, value in [("status", "=", status), ("client_id", "=", client_id),
+                                        ("date", ">=", date_from), ("date", "<=", date_to)]:
+            if value is not None:
+                clauses.append(f"{column} {operator} ?")
+                params.append(str(value))
+        sql = "SELECT detail_json, list_json FROM invoices"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY date DESC, CAST(id AS INTEGER) DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+        with self._lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [json.loads(row["detail_json"] or row["list_json"]) for row in rows]
+
+    def iter_invoices(self, limit=10000, **filters):
+        """Même interface que SellsyAPI.iter_invoices, servie depuis le miroir (utilisation hors ligne)"""
+        return iter(self.query(limit=limit, **filters))
+
+    def count(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) AS total FROM invoices").fetchone()["total"]
@@ -0,0 +1,69 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+from config import LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT
+
+# Format des messages (console et fichier)
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Bibliothèques qui journalisent chaque requête HTTP: limitées à WARNING sauf en DEBUG
+NOISY_LOGGERS = ["httpx", "httpcore", "urllib3", "pyairtable"]
+
+_listener = None
+
+
+def parse_level(level):
+    """Niveau de journalisation à partir d'un nom (DEBUG, info...) ou d'un entier; INFO si inconnu"""
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).strip().upper())
+    return value if isinstance(value, int) else logging.INFO
+
+
+def setup_logging(level=LOG_LEVEL, log_file=LOG_FILE, max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Configure la journalisation du processus (peut être rappelée pour changer de niveau).
+
+    Les appelants ne font que déposer les messages retenus dans une file (QueueHandler);
+    un thread dédié les écrit sur la console et, si log_file est défini, dans un fichier
+    avec rotation par taille. Les messages sous le niveau configuré ne sont jamais formatés.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    level = parse_level(level)
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.handlers.RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                                             backupCount=backup_count, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    for name in NOISY_LOGGERS:
+        logging.getLogger(name).setLevel(max(level, logging.WARNING))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    return _listener
+
+
+def ensure_logging(level=LOG_LEVEL):
+    """Configure la journalisation si elle ne l'est pas encore (sans écraser le niveau choisi par main.py)"""
+    if _listener is None:
+        setup_logging(level)
+    return _listener
+
+
+@atexit.register
+def _flush_logging():
+    # Écrire les derniers messages encore dans la file avant la fin du processus
+    if _listener is not None:
+        _listener.stop()
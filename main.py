@@ -1,166 +1,323 @@
 import argparse
+import json
+import logging
+import time
 from sellsy_api import SellsyAPI
 from airtable_api import AirtableAPI
-import uvicorn
-from webhook_handler import app
-import time
+from sync_pipeline import SyncPipeline
+from reconcile import Reconciler
+from invoice_mirror import InvoiceMirror
+from sync_state import SyncState, CursorTracker, is_after_cursor, max_cursor
+from sync_journal import SyncJournal
+from dead_letter import DeadLetterStore
+from metrics import metrics
+from logging_setup import setup_logging
+from config import SYNC_FETCH_WORKERS, SYNC_PDF_WORKERS, SELLSY_USE_SEARCH, LOG_LEVEL, DEAD_LETTER_MAX_ATTEMPTS
 
-def sync_invoices(days=365):
-    """Synchronise les factures des X derniers jours"""
-    sellsy = SellsyAPI()
+logger = logging.getLogger("main")
+
+def _incremental_filters(sync_state, state_name):
+    """Filtres et curseur d'une synchronisation incrémentale ((None, None) si aucun curseur enregistré)"""
+    cursor = sync_state.get_cursor(state_name)
+    if not cursor:
+        logger.info("Aucun curseur enregistré, synchronisation complète.")
+        return None, None
+    
+    logger.info("Synchronisation incrémentale depuis %s (facture %s)...", cursor['timestamp'], cursor['id'])
+    return {"updated_after": cursor["timestamp"]}, cursor
+
+def _save_cursor_if_complete(sync_state, state_name, tracker, summary, listing_complete=True):
+    """Avance le curseur uniquement si toutes les factures ont été listées et traitées sans erreur"""
+    if summary["errors"] or not listing_complete:
+        logger.warning("⚠️ %s erreur(s)%s: curseur non avancé, ces factures seront reprises au prochain passage",
+                       len(summary['errors']), "" if listing_complete else " et liste incomplète")
+        return
+    if tracker.cursor:
+        sync_state.save_cursor(state_name, tracker.cursor)
+
+def _report_metrics(metrics_path=None):
+    """Affiche le résumé JSON des métriques (durées par étape, requêtes, tentatives, octets) et l'enregistre si demandé"""
+    summary = metrics.summary()
+    logger.info("📈 Métriques:\n%s", json.dumps(summary, indent=2, ensure_ascii=False))
+    if metrics_path:
+        with open(metrics_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        logger.info("💾 Métriques enregistrées: %s", metrics_path)
+
+def _remaining_invoices(sellsy, journal, limit, filters, cursor=None):
+    """
+    Factures restant à traiter pour le run du journal: celles déjà listées mais pas encore
+    synchronisées, puis la suite de la liste Sellsy (pages en échec comprises)
+    """
+    done = journal.done_ids()
+    yielded = set()
+    # Le filtre incrémental est inclusif: écarter les factures déjà traitées au même horodatage
+    for invoice in journal.pending_invoices():
+        yielded.add(str(invoice["id"]))
+        if is_after_cursor(invoice, cursor):
+            yield invoice
+    if journal.run["listing_done"]:
+        return
+    
+    for invoice in sellsy.iter_invoices(limit, journal=journal, **filters):
+        invoice_id = str(invoice.get("id") or "")
+        if invoice_id and (invoice_id in done or invoice_id in yielded):
+            continue
+        yielded.add(invoice_id)
+        if is_after_cursor(invoice, cursor):
+            yield invoice
+
+def _run_sync(sellsy, airtable, journal, fetch_workers, pdf_workers, metrics_path):
+    """Exécute (ou reprend) le run du journal et retourne (tracker, bilan)"""
+    params = journal.run["params"]
+    cursor = params.get("cursor")
+    invoices = _remaining_invoices(sellsy, journal, params["limit"], params["filters"], cursor)
+    if params.get("state_name"):
+        # Curseur de départ: le plus récent des factures déjà listées par le run
+        cursor = max_cursor(journal.iter_listed(), cursor)
+    
+    # Les factures sont traitées au fil de la pagination: listing et écriture se chevauchent
+    tracker = CursorTracker(invoices, cursor)
+    pipeline = SyncPipeline(sellsy, airtable, fetch_workers=fetch_workers, pdf_workers=pdf_workers, journal=journal)
+    try:
+        summary = pipeline.run(tracker)
+    except BaseException:
+        # Liste interrompue (erreur Sellsy, Ctrl+C): le run est clos comme incomplet pour être repris
+        journal.finish_run(False)
+        logger.error("❌ Run %s interrompu. Reprendre avec: python main.py sync --resume %s",
+                     journal.run_id, journal.run_id)
+        raise
+    run = journal.run
+    status = journal.finish_run(bool(run["listing_done"]) and not summary["errors"])
+    _report_metrics(metrics_path)
+    
+    if status == "completed":
+        logger.info("📓 Run %s terminé.", journal.run_id)
+    else:
+        logger.warning("⚠️ Run %s incomplet (%s facture(s) à reprendre, %s page(s) de liste en échec). "
+                       "Reprendre avec: python main.py sync --resume %s", journal.run_id,
+                       journal.counts().get("failed", 0), len(journal.failed_pages()), journal.run_id)
+    if params.get("state_name") and tracker.count:
+        # Une liste tronquée par la limite ne doit pas avancer le curseur: les factures non lues
+        # sont plus anciennes que celles traitées et seraient écartées au prochain passage
+        listing_complete = bool(run["listing_done"]) and not run["listing_truncated"]
+        _save_cursor_if_complete(SyncState(), params["state_name"], tracker, summary, listing_complete)
+    return tracker, summary
+
+def sync_invoices(days=365, fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS, incremental=False,
+                  use_search=SELLSY_USE_SEARCH, metrics_path=None):
+    """Synchronise les factures des X derniers jours (ou modifiées depuis la dernière synchronisation)"""
+    sellsy = SellsyAPI(use_search=use_search)
     airtable = AirtableAPI()
+    airtable.load_index()
     
-    print(f"Récupération des factures des {days} derniers jours...")
-    invoices = sellsy.get_invoices(days)
+    filters, cursor = (None, None)
+    if incremental:
+        filters, cursor = _incremental_filters(SyncState(), "sync")
+    if filters is None:
+        logger.info("Récupération des factures des %s derniers jours...", days)
+        filters = sellsy.recent_filters(days)
     
-    if not invoices:
-        print("Aucune facture trouvée.")
+    journal = SyncJournal()
+    journal.start_run("sync", {"limit": 10000, "filters": filters, "use_search": use_search,
+                               "state_name": "sync" if incremental else None, "cursor": cursor})
+    tracker, summary = _run_sync(sellsy, airtable, journal, fetch_workers, pdf_workers, metrics_path)
+    
+    if not tracker.count:
+        logger.info("Aucune facture trouvée.")
         return
     
-    print(f"{len(invoices)} factures trouvées.")
-    
-    for idx, invoice in enumerate(invoices):
-        try:
-            # Récupérer les détails complets si nécessaire
-            invoice_id = str(invoice["id"])
-            print(f"Traitement de la facture {invoice_id} ({idx+1}/{len(invoices)})...")
-            
-            # Ajouter un délai entre les requêtes pour éviter les limitations d'API
-            if idx > 0 and idx % 10 == 0:
-                print("Pause de 2 secondes pour éviter les limitations d'API...")
-                time.sleep(2)
-                
-            invoice_details = sellsy.get_invoice_details(invoice_id)
-            
-            if invoice_details:
-                # Formater pour Airtable
-                formatted_invoice = airtable.format_invoice_for_airtable(invoice_details)
-                
-                # Télécharger le PDF
-                pdf_path = sellsy.download_invoice_pdf(invoice_id)
-                
-                # Insérer ou mettre à jour dans Airtable avec le PDF
-                if formatted_invoice:
-                    airtable.insert_or_update_invoice(formatted_invoice, pdf_path)
-                    print(f"✅ Facture {invoice_id} traitée ({idx+1}/{len(invoices)}).")
-                else:
-                    print(f"⚠️ La facture {invoice_id} n'a pas pu être formatée correctement")
-            else:
-                print(f"⚠️ Impossible de récupérer les détails de la facture {invoice_id} - utilisation des données de base")
-                # Utilisez les données de base si les détails ne sont pas disponibles
-                formatted_invoice = airtable.format_invoice_for_airtable(invoice)
-                
-                # Télécharger le PDF même avec les données de base
-                pdf_path = sellsy.download_invoice_pdf(invoice_id)
-                
-                if formatted_invoice:
-                    airtable.insert_or_update_invoice(formatted_invoice, pdf_path)
-                    print(f"✅ Facture {invoice_id} traitée avec données de base ({idx+1}/{len(invoices)}).")
-                else:
-                    print(f"⚠️ La facture {invoice_id} n'a pas pu être formatée correctement, même avec les données de base")
-        except Exception as e:
-            print(f"❌ Erreur lors du traitement de la facture {invoice.get('id')}: {e}")
-    
-    print("Synchronisation terminée.")
+    logger.info("Synchronisation terminée. %s/%s factures traitées, %s écritures inchangées ignorées, %s erreurs.",
+                summary['processed'], tracker.count, summary['skipped'], len(summary['errors']))
 
-def sync_missing_invoices(limit=1000):
+def sync_missing_invoices(limit=1000, fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS, incremental=False,
+                          use_search=SELLSY_USE_SEARCH, metrics_path=None):
     """Synchronise les factures manquantes dans Airtable"""
-    sellsy = SellsyAPI()
+    sellsy = SellsyAPI(use_search=use_search)
+    airtable = AirtableAPI()
+    airtable.load_index()
+    
+    filters, cursor = (None, None)
+    if incremental:
+        filters, cursor = _incremental_filters(SyncState(), "sync-missing")
+    if filters is None:
+        logger.info("Récupération de toutes les factures de Sellsy (max %s)...", limit)
+        filters = {}
+    
+    # Les factures déjà présentes sont mises à jour (PDF compris), les autres sont ajoutées
+    journal = SyncJournal()
+    journal.start_run("sync-missing", {"limit": limit, "filters": filters, "use_search": use_search,
+                                       "state_name": "sync-missing" if incremental else None, "cursor": cursor})
+    tracker, summary = _run_sync(sellsy, airtable, journal, fetch_workers, pdf_workers, metrics_path)
+    
+    if not tracker.count:
+        logger.info("Aucune facture trouvée.")
+        return
+    
+    logger.info("Synchronisation terminée. %s factures trouvées dans Sellsy, %s nouvelles factures ajoutées, "
+                "%s factures déjà présentes mises à jour, %s inchangées, %s erreurs.",
+                tracker.count, summary['created'], summary['updated'], summary['skipped'], len(summary['errors']))
+
+def resume_sync(run_id, fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS, metrics_path=None):
+    """Reprend un run interrompu: seules les factures non terminées et la suite de la liste sont traitées"""
+    journal = SyncJournal()
+    run = journal.resume_run(run_id)
+    if run is None:
+        logger.error("❌ Run %s introuvable dans %s. Derniers runs:", run_id, journal.path)
+        for recent in journal.recent_runs():
+            logger.error("   %s  %-12s  %s", recent["run_id"], recent["command"], recent["status"])
+        return
+    if run["status"] == "completed":
+        logger.info("Run %s déjà terminé, rien à reprendre.", run_id)
+        return
+    
+    sellsy = SellsyAPI(use_search=run["params"].get("use_search", SELLSY_USE_SEARCH))
     airtable = AirtableAPI()
+    airtable.load_index()
+    tracker, summary = _run_sync(sellsy, airtable, journal, fetch_workers, pdf_workers, metrics_path)
     
-    print(f"Récupération de toutes les factures de Sellsy (max {limit})...")
-    all_invoices = sellsy.get_all_invoices(limit)
+    logger.info("Reprise terminée. %s facture(s) reprise(s), %s ajoutée(s), %s mise(s) à jour, %s inchangée(s), "
+                "%s erreur(s).", tracker.count, summary['created'], summary['updated'], summary['skipped'],
+                len(summary['errors']))
+
+def reconcile_invoices(limit=10000, dry_run=False, delete_orphans=False, report_path=None,
+                       fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS, use_search=SELLSY_USE_SEARCH,
+                       offline=False, metrics_path=None):
+    """Compare Sellsy et Airtable et ne traite que les différences"""
+    sellsy = SellsyAPI(use_search=use_search)
+    airtable = AirtableAPI()
+    if offline and delete_orphans:
+        # Le miroir peut ignorer des factures récentes: il ne suffit pas à prouver qu'une facture a disparu
+        logger.warning("⚠️ --delete-orphans ignoré en mode hors ligne")
+        delete_orphans = False
+    # Hors ligne, la liste Sellsy vient du miroir local (aucun appel de listing)
+    reconciler = Reconciler(sellsy, airtable, source=InvoiceMirror() if offline else None)
     
-    if not all_invoices:
-        print("Aucune facture trouvée.")
+    reconciler.diff(limit)
+    reconciler.print_report()
+    if report_path:
+        reconciler.save_report(report_path)
+    
+    if dry_run:
+        logger.info("Mode simulation: aucune modification effectuée.")
+        _report_metrics(metrics_path)
         return
     
-    print(f"{len(all_invoices)} factures trouvées dans Sellsy.")
-    
-    added_count = 0
-    updated_count = 0
-    error_count = 0
-    
-    for idx, invoice in enumerate(all_invoices):
-        try:
-            invoice_id = str(invoice["id"])
-            print(f"Traitement de la facture {invoice_id} ({idx+1}/{len(all_invoices)})...")
-            
-            # Ajouter un délai entre les requêtes pour éviter les limitations d'API
-            if idx > 0 and idx % 10 == 0:
-                print("Pause de 2 secondes pour éviter les limitations d'API...")
-                time.sleep(2)
-            
-            # Vérifier d'abord si la facture existe déjà dans Airtable
-            existing_record = airtable.find_invoice_by_id(invoice_id)
-            
-            if existing_record:
-                # Si la facture existe déjà, on peut quand même mettre à jour le PDF
-                print(f"🔄 Facture {invoice_id} déjà présente dans Airtable, mise à jour du PDF.")
-                pdf_path = sellsy.download_invoice_pdf(invoice_id)
-                
-                # Récupérer les détails pour la mise à jour
-                invoice_details = sellsy.get_invoice_details(invoice_id)
-                source_data = invoice_details if invoice_details else invoice
-                formatted_invoice = airtable.format_invoice_for_airtable(source_data)
-                
-                if formatted_invoice:
-                    airtable.insert_or_update_invoice(formatted_invoice, pdf_path)
-                    updated_count += 1
-                    print(f"✅ Facture {invoice_id} mise à jour avec PDF ({idx+1}/{len(all_invoices)}).")
-                continue
-                
-            # Récupérer les détails complets de la facture
-            invoice_details = sellsy.get_invoice_details(invoice_id)
-            
-            # Source de données à utiliser (détails ou basique)
-            source_data = invoice_details if invoice_details else invoice
-            
-            if not invoice_details:
-                print(f"⚠️ Impossible de récupérer les détails de la facture {invoice_id} - utilisation des données de base")
-            
-            # Télécharger le PDF pour cette facture
-            pdf_path = sellsy.download_invoice_pdf(invoice_id)
-            
-            # Formater pour Airtable
-            formatted_invoice = airtable.format_invoice_for_airtable(source_data)
-            
-            # Ajouter à Airtable
-            if formatted_invoice:
-                try:
-                    airtable.insert_or_update_invoice(formatted_invoice, pdf_path)
-                    added_count += 1
-                    print(f"➕ Facture {invoice_id} ajoutée avec PDF ({idx+1}/{len(all_invoices)}).")
-                except Exception as e:
-                    print(f"❌ Erreur lors de l'ajout de la facture {invoice_id} à Airtable: {e}")
-                    error_count += 1
-            else:
-                print(f"⚠️ La facture {invoice_id} n'a pas pu être formatée correctement")
-                error_count += 1
-                
-        except Exception as e:
-            print(f"❌ Erreur lors du traitement de la facture {invoice.get('id')}: {e}")
-            error_count += 1
-    
-    print(f"Synchronisation terminée. {added_count} nouvelles factures ajoutées, {updated_count} factures déjà présentes, {error_count} erreurs.")
+    summary = reconciler.apply(delete_orphans, fetch_workers, pdf_workers)
+    _report_metrics(metrics_path)
+    if summary:
+        logger.info("Réconciliation terminée. %s facture(s) ajoutée(s), %s mise(s) à jour, %s erreur(s).",
+                    summary['created'], summary['updated'], len(summary['errors']))
+    else:
+        logger.info("Réconciliation terminée. Aucune facture à synchroniser.")
 
-def start_webhook_server(host="0.0.0.0", port=8000):
+def retry_failed(max_attempts=DEAD_LETTER_MAX_ATTEMPTS, limit=None, stage=None, list_only=False,
+                 fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS, metrics_path=None):
+    """
+    Retraite les factures en échec par le même pipeline, jusqu'à ce qu'elles soient résolues
+    ou que leurs tentatives soient épuisées (délai exponentiel avec gigue entre deux tentatives)
+    """
+    dead_letters = DeadLetterStore(max_attempts=max_attempts)
+    if list_only:
+        entries = dead_letters.entries()
+        logger.info("🪦 %s facture(s) en échec:", len(entries))
+        for entry in entries:
+            logger.info("   %s  %-8s  %-20s  %s tentative(s)  %s", entry["invoice_id"], entry["stage"],
+                        entry["error_class"], entry["attempts"], entry["error"])
+        return
+    
+    counts = dead_letters.counts()
+    if not counts["pending"]:
+        logger.info("Aucune facture à retraiter (%s abandonnée(s) après %s tentatives).",
+                    counts["abandoned"], max_attempts)
+        return
+    
+    sellsy = SellsyAPI()
+    airtable = AirtableAPI()
+    airtable.load_index()
+    attempts = 0
+    while True:
+        entries = dead_letters.due(limit, stage)
+        if not entries:
+            next_at = dead_letters.next_due_at(stage)
+            if next_at is None:
+                break
+            wait = max(0.0, next_at - time.time())
+            logger.info("⏳ Prochaine tentative dans %.0f s", wait)
+            time.sleep(wait)
+            continue
+        
+        dead_letters.begin_attempt(entries)
+        attempts += 1
+        logger.info("🔁 Tentative %s: %s facture(s) en échec", attempts, len(entries))
+        # Toujours relire Sellsy: l'instantané enregistré sert au diagnostic, pas à l'écriture
+        pipeline = SyncPipeline(sellsy, airtable, fetch_workers=fetch_workers, pdf_workers=pdf_workers,
+                                dead_letters=dead_letters, require_details=True, refresh_details=True)
+        pipeline.run([{"id": entry["invoice_id"]} for entry in entries])
+    
+    _report_metrics(metrics_path)
+    counts = dead_letters.counts()
+    logger.info("Nouvelles tentatives terminées. %s facture(s) résolue(s) au total, %s abandonnée(s) après %s tentatives.",
+                counts["resolved"], counts["abandoned"], max_attempts)
+
+def start_webhook_server(host="0.0.0.0", port=8000, log_level=None):
     """Démarre le serveur webhook"""
-    print(f"Démarrage du serveur webhook sur {host}:{port}")
+    # Import différé: webhook_handler crée clients, file et connexions SQLite dès son import,
+    # inutiles aux autres commandes
+    import uvicorn
+    from webhook_handler import app
+    if log_level is not None:
+        setup_logging(log_level)
+    logger.info("Démarrage du serveur webhook sur %s:%s", host, port)
     uvicorn.run(app, host=host, port=port)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Outil de synchronisation Sellsy - Airtable")
+    parser.add_argument("--log-level", type=str, default=LOG_LEVEL, help="Niveau de journalisation (DEBUG, INFO, WARNING, ERROR)")
     
     subparsers = parser.add_subparsers(dest="command", help="Commandes disponibles")
     
     # Commande sync
     sync_parser = subparsers.add_parser("sync", help="Synchroniser les factures des derniers jours")
     sync_parser.add_argument("--days", type=int, default=30, help="Nombre de jours à synchroniser")
+    sync_parser.add_argument("--fetch-workers", type=int, default=SYNC_FETCH_WORKERS, help="Nombre de workers pour les détails Sellsy")
+    sync_parser.add_argument("--pdf-workers", type=int, default=SYNC_PDF_WORKERS, help="Nombre de workers pour les PDF")
+    sync_parser.add_argument("--incremental", action="store_true", help="Ne traiter que les factures modifiées depuis la dernière synchronisation")
+    sync_parser.add_argument("--search", action="store_true", help="Lister via la recherche Sellsy (filtres côté serveur, projection des champs)")
+    sync_parser.add_argument("--metrics", type=str, default=None, help="Enregistrer le résumé JSON des métriques dans ce fichier")
+    sync_parser.add_argument("--resume", type=str, default=None, metavar="RUN_ID", help="Reprendre un run interrompu (factures non terminées et suite de la liste)")
     
     # Commande sync-missing
     missing_parser = subparsers.add_parser("sync-missing", help="Synchroniser les factures manquantes")
     missing_parser.add_argument("--limit", type=int, default=1000, help="Nombre maximum de factures à vérifier")
+    missing_parser.add_argument("--fetch-workers", type=int, default=SYNC_FETCH_WORKERS, help="Nombre de workers pour les détails Sellsy")
+    missing_parser.add_argument("--pdf-workers", type=int, default=SYNC_PDF_WORKERS, help="Nombre de workers pour les PDF")
+    missing_parser.add_argument("--incremental", action="store_true", help="Ne traiter que les factures modifiées depuis la dernière synchronisation")
+    missing_parser.add_argument("--search", action="store_true", help="Lister via la recherche Sellsy (filtres côté serveur, projection des champs)")
+    missing_parser.add_argument("--metrics", type=str, default=None, help="Enregistrer le résumé JSON des métriques dans ce fichier")
+    missing_parser.add_argument("--resume", type=str, default=None, metavar="RUN_ID", help="Reprendre un run interrompu (factures non terminées et suite de la liste)")
+    
+    # Commande reconcile
+    reconcile_parser = subparsers.add_parser("reconcile", help="Comparer Sellsy et Airtable et ne traiter que les différences")
+    reconcile_parser.add_argument("--limit", type=int, default=10000, help="Nombre maximum de factures Sellsy à comparer")
+    reconcile_parser.add_argument("--dry-run", action="store_true", help="Afficher le rapport sans rien modifier")
+    reconcile_parser.add_argument("--delete-orphans", action="store_true", help="Supprimer les factures Airtable absentes de Sellsy et les lignes sans ID")
+    reconcile_parser.add_argument("--report", type=str, default=None, help="Enregistrer le rapport JSON dans ce fichier")
+    reconcile_parser.add_argument("--fetch-workers", type=int, default=SYNC_FETCH_WORKERS, help="Nombre de workers pour les détails Sellsy")
+    reconcile_parser.add_argument("--pdf-workers", type=int, default=SYNC_PDF_WORKERS, help="Nombre de workers pour les PDF")
+    reconcile_parser.add_argument("--search", action="store_true", help="Lister via la recherche Sellsy (filtres côté serveur, projection des champs)")
+    reconcile_parser.add_argument("--offline", action="store_true", help="Comparer avec le miroir local des factures au lieu de lister Sellsy")
+    reconcile_parser.add_argument("--metrics", type=str, default=None, help="Enregistrer le résumé JSON des métriques dans ce fichier")
+    
+    # Commande retry-failed
+    retry_parser = subparsers.add_parser("retry-failed", help="Retraiter les factures en échec des synchronisations et webhooks")
+    retry_parser.add_argument("--max-attempts", type=int, default=DEAD_LETTER_MAX_ATTEMPTS, help="Nombre maximum de tentatives par facture")
+    retry_parser.add_argument("--limit", type=int, default=None, help="Nombre maximum de factures par tentative")
+    retry_parser.add_argument("--stage", type=str, default=None, help="Ne retraiter que les échecs d'une étape (détails, pdf, format, airtable, webhook)")
+    retry_parser.add_argument("--list", action="store_true", help="Afficher les factures en échec sans les retraiter")
+    retry_parser.add_argument("--fetch-workers", type=int, default=SYNC_FETCH_WORKERS, help="Nombre de workers pour les détails Sellsy")
+    retry_parser.add_argument("--pdf-workers", type=int, default=SYNC_PDF_WORKERS, help="Nombre de workers pour les PDF")
+    retry_parser.add_argument("--metrics", type=str, default=None, help="Enregistrer le résumé JSON des métriques dans ce fichier")
     
     # Commande webhook
     webhook_parser = subparsers.add_parser("webhook", help="Démarrer le serveur webhook")
@@ -168,12 +325,24 @@ if __name__ == "__main__":
     webhook_parser.add_argument("--port", type=int, default=8000, help="Port du serveur")
     
     args = parser.parse_args()
+    setup_logging(args.log_level)
     
-    if args.command == "sync":
-        sync_invoices(args.days)
+    if args.command in ("sync", "sync-missing") and args.resume:
+        resume_sync(args.resume, args.fetch_workers, args.pdf_workers, args.metrics)
+    elif args.command == "sync":
+        sync_invoices(args.days, args.fetch_workers, args.pdf_workers, args.incremental,
+                      args.search or SELLSY_USE_SEARCH, args.metrics)
     elif args.command == "sync-missing":
-        sync_missing_invoices(args.limit)
+        sync_missing_invoices(args.limit, args.fetch_workers, args.pdf_workers, args.incremental,
+                              args.search or SELLSY_USE_SEARCH, args.metrics)
+    elif args.command == "reconcile":
+        reconcile_invoices(args.limit, args.dry_run, args.delete_orphans, args.report,
+                           args.fetch_workers, args.pdf_workers, args.search or SELLSY_USE_SEARCH, args.offline,
+                           args.metrics)
+    elif args.command == "retry-failed":
+        retry_failed(args.max_attempts, args.limit, args.stage, args.list, args.fetch_workers, args.pdf_workers,
+                     args.metrics)
     elif args.command == "webhook":
-        start_webhook_server(args.host, args.port)
+        start_webhook_server(args.host, args.port, args.log_level)
     else:
         parser.print_help()
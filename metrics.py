@@ -0,0 +1,184 @@
+import asyncio
+import functools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from config import SELLSY_API_URL, SELLSY_TOKEN_URL, AIRTABLE_API_URL
+
+# Étapes chronométrées, dans l'ordre du traitement d'une facture
+STAGES = ["token", "list_page", "details", "pdf", "format", "airtable_lookup", "airtable_write"]
+
+# Bornes des histogrammes de durée (secondes)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Préfixe des métriques Prometheus
+PREFIX = "sellsy_airtable"
+
+_SERVICES = {
+    urlparse(SELLSY_API_URL).hostname: "sellsy",
+    urlparse(SELLSY_TOKEN_URL).hostname: "sellsy",
+    urlparse(AIRTABLE_API_URL).hostname: "airtable",
+}
+
+
+def service_for(url):
+    """Service appelé (sellsy, airtable) d'après l'hôte de l'URL; les liens PDF externes sont comptés à part"""
+    host = urlparse(str(url)).hostname or ""
+    return _SERVICES.get(host, "sellsy" if host.endswith("sellsy.com") else "other")
+
+
+def status_label(status):
+    """Code HTTP tel que compté: les 5xx sont regroupés, None signale une erreur réseau"""
+    if status is None:
+        return "error"
+    if status >= 500:
+        return "5xx"
+    return str(status)
+
+
+class Metrics:
+    """
+    Registre des métriques du processus, partagé entre threads et tâches asyncio:
+    durée de chaque étape (histogrammes), requêtes par service et code HTTP,
+    nouvelles tentatives et octets téléchargés.
+
+    Exposé au format Prometheus par le service webhook (/metrics) et résumé en
+    JSON à la fin des synchronisations en ligne de commande.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}                # étape -> {"count", "sum", "max", "buckets"}
+            self.requests = defaultdict(int)   # (service, code) -> nombre
+            self.retries = defaultdict(int)    # (service, motif) -> nombre
+            self.bytes = defaultdict(int)      # type -> octets
+            self.started_at = time.time()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self.durations.get(stage)
+            if entry is None:
+                entry = self.durations[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+            entry["count"] += 1
+            entry["sum"] += seconds
+            entry["max"] = max(entry["max"], seconds)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+                    break
+
+    @contextmanager
+    def timer(self, stage):
+        """Chronomètre un bloc (la durée est enregistrée même si le bloc lève une exception)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Décorateur chronométrant une fonction ou une coroutine"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.timer(stage):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def count_request(self, url, status):
+        with self._lock:
+            self.requests[(service_for(url), status_label(status))] += 1
+
+    def count_retry(self, service, reason):
+        with self._lock:
+            self.retries[(service, str(reason))] += 1
+
+    def add_bytes(self, kind, size):
+        with self._lock:
+            self.bytes[kind] += size
+
+    def summary(self):
+        """Résumé JSON: durées par étape, requêtes par code, nouvelles tentatives et octets"""
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": entry["count"],
+                    "total_s": round(entry["sum"], 3),
+                    "avg_ms": round(entry["sum"] / entry["count"] * 1000, 1),
+                    "max_ms": round(entry["max"] * 1000, 1),
+                }
+                for stage, entry in sorted(self.durations.items(), key=lambda item: _stage_order(item[0]))
+            }
+            requests = defaultdict(dict)
+            for (service, status), count in sorted(self.requests.items()):
+                requests[service][status] = count
+            retries = defaultdict(dict)
+            for (service, reason), count in sorted(self.retries.items()):
+                retries[service][reason] = count
+            return {
+                "elapsed_s": round(time.time() - self.started_at, 1),
+                "stages": stages,
+                "requests": dict(requests),
+                "retries": dict(retries),
+                "bytes_downloaded": dict(self.bytes),
+            }
+
+    def render_prometheus(self, gauges=None):
+        """Texte au format d'exposition Prometheus; gauges ajoute des jauges {nom: (aide, {libellés: valeur})}"""
+        lines = []
+        with self._lock:
+            name = f"{PREFIX}_stage_duration_seconds"
+            lines += [f"# HELP {name} Durée des étapes de synchronisation", f"# TYPE {name} histogram"]
+            for stage, entry in sorted(self.durations.items(), key=lambda item: _stage_order(item[0])):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, entry["buckets"]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {entry["count"]}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {entry["sum"]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {entry["count"]}')
+
+            for suffix, help_text, labels, values in [
+                ("http_requests_total", "Requêtes HTTP par service et code", ("service", "status"), self.requests),
+                ("retries_total", "Nouvelles tentatives par service et motif", ("service", "reason"), self.retries),
+            ]:
+                name = f"{PREFIX}_{suffix}"
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for key, count in sorted(values.items()):
+                    label_text = ",".join(f'{label}="{value}"' for label, value in zip(labels, key))
+                    lines.append(f"{name}{{{label_text}}} {count}")
+
+            name = f"{PREFIX}_downloaded_bytes_total"
+            lines += [f"# HELP {name} Octets téléchargés", f"# TYPE {name} counter"]
+            for kind, size in sorted(self.bytes.items()):
+                lines.append(f'{name}{{kind="{kind}"}} {size}')
+
+        for gauge, (help_text, values) in (gauges or {}).items():
+            name = f"{PREFIX}_{gauge}"
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            for labels, value in values.items():
+                label_text = ",".join(f'{label}="{label_value}"' for label, label_value in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+
+# Registre partagé par tout le processus
+metrics = Metrics()
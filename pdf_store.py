@@ -0,0 +1,410 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from metrics import metrics
+
+logger = logging.getLogger("pdf_store")
+
+# Taille des blocs lus pendant le téléchargement en streaming
+CHUNK_SIZE = 64 * 1024
+
+# Fichiers du magasin dans le répertoire de stockage
+MANIFEST_FILENAME = "manifest.sqlite"
+OBJECTS_DIRNAME = "objects"
+
+# Anciens formats: fichiers à plat et index JSON des validateurs HTTP
+LEGACY_FILE_PATTERN = re.compile(r"^facture_(.+)\.pdf$")
+LEGACY_INDEX_FILENAME = "index.json"
+
+
+class PdfDownloadError(Exception):
+    """Téléchargement PDF invalide (contenu non PDF, taille incohérente...)"""
+
+
+def conditional_headers(entry):
+    """En-têtes de GET conditionnel à partir d'une entrée du manifeste"""
+    headers = {}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+class _PendingDownload:
+    """Fichier temporaire d'un téléchargement en cours (empreinte et taille calculées au fil de l'eau)"""
+
+    def __init__(self, objects_dir, headers):
+        self.headers = headers
+        fd, self.tmp_path = tempfile.mkstemp(dir=objects_dir, prefix=".download-", suffix=".part")
+        self.file = os.fdopen(fd, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        if self.size == 0:
+            content_type = self.headers.get("Content-Type", "")
+            if "pdf" not in content_type.lower() and not chunk.startswith(b"%PDF"):
+                raise PdfDownloadError(f"Contenu non PDF reçu: {content_type}")
+        self.file.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        metrics.add_bytes("pdf", len(chunk))
+
+    def finish(self):
+        """Ferme le fichier sur disque et vérifie la taille; retourne (empreinte, taille)"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+        if self.size == 0:
+            raise PdfDownloadError("Réponse vide")
+
+        # Content-Length n'est comparable que si le corps n'a pas été décompressé
+        expected = self.headers.get("Content-Length")
+        if expected and not self.headers.get("Content-Encoding"):
+            if int(expected) != self.size:
+                raise PdfDownloadError(f"Taille incohérente: {self.size} octets reçus, {expected} annoncés")
+        return self.digest.hexdigest(), self.size
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class PdfStore:
+    """
+    Magasin de PDF adressé par contenu.
+
+    Chaque PDF est stocké une seule fois sous objects/ab/cd/<sha256>.pdf (les
+    factures au contenu identique partagent le même objet). Un manifeste SQLite
+    associe chaque ID de facture à son empreinte, sa taille, ses validateurs HTTP
+    et sa date de dernier accès, ce qui permet d'évincer les PDF les moins
+    récemment utilisés au-delà de max_bytes (0 = pas de limite).
+
+    Rangement de l'objet, enregistrement au manifeste et éviction se font sous le
+    même verrou; les objets des factures en cours de téléchargement ne sont pas évincés.
+    """
+
+    def __init__(self, storage_dir, max_bytes=0):
+        self.storage_dir = storage_dir
+        self.objects_dir = os.path.join(storage_dir, OBJECTS_DIRNAME)
+        self.max_bytes = max_bytes
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+        # Réentrant: le rangement d'un téléchargement enchaîne enregistrement et éviction sous le même verrou
+        self._lock = threading.RLock()
+        self._in_flight = Counter()  # invoice_id -> téléchargements en cours
+        self.db = sqlite3.connect(os.path.join(storage_dir, MANIFEST_FILENAME), check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS pdfs (
+                    invoice_id TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    url TEXT,
+                    fetched_at TEXT,
+                    last_access REAL
+                )
+            """)
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_pdfs_hash ON pdfs(hash)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_pdfs_access ON pdfs(last_access)")
+
+        self._import_legacy_files()
+
+    def object_path(self, digest):
+        """Chemin de l'objet d'une empreinte (sous-répertoires sur 2 niveaux)"""
+        return os.path.join(self.objects_dir, digest[:2], digest[2:4], f"{digest}.pdf")
+
+    def get(self, invoice_id, touch=False):
+        """
+        Retourne l'entrée du manifeste d'une facture (avec le chemin de son objet sous "path")
+        si son objet existe, sinon None. Avec touch, la facture est marquée comme récemment
+        utilisée; la date d'accès ne sert qu'à l'éviction et n'est pas écrite sans max_bytes
+        """
+        with self._lock:
+            row = self.db.execute("SELECT * FROM pdfs WHERE invoice_id = ?", (str(invoice_id),)).fetchone()
+        if row is None:
+            return None
+        entry = dict(row)
+        entry["path"] = self.object_path(entry["hash"])
+        if not os.path.exists(entry["path"]):
+            self.remove(invoice_id)
+            return None
+        if touch and self.max_bytes:
+            entry["last_access"] = time.time()
+            with self._lock, self.db:
+                self.db.execute("UPDATE pdfs SET last_access = ? WHERE invoice_id = ?",
+                                (entry["last_access"], str(invoice_id)))
+        return entry
+
+    def path_for(self, invoice_id):
+        """Retourne le chemin du PDF d'une facture (et le marque comme récemment utilisé)"""
+        entry = self.get(invoice_id, touch=True)
+        return entry["path"] if entry else None
+
+    def remove(self, invoice_id):
+        """Retire une facture du manifeste (l'objet est supprimé s'il n'est plus référencé)"""
+        with self._lock:
+            row = self.db.execute("SELECT hash FROM pdfs WHERE invoice_id = ?", (str(invoice_id),)).fetchone()
+            if row is None:
+                return
+            with self.db:
+                self.db.execute("DELETE FROM pdfs WHERE invoice_id = ?", (str(invoice_id),))
+            self._delete_if_unreferenced(row["hash"])
+
+    def save_response(self, invoice_id, response, url=None):
+        """
+        Écrit en streaming le corps d'une réponse PDF dans un fichier temporaire en
+        calculant son empreinte, vérifie le contenu et la taille, puis le range
+        atomiquement dans le magasin. Retourne (chemin, taille); lève PdfDownloadError
+        si le contenu est invalide.
+        """
+        download = _PendingDownload(self.objects_dir, response.headers)
+        self._begin_download(invoice_id)
+        try:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                download.write(chunk)
+            return self._commit_download(invoice_id, download, url)
+        except Exception:
+            download.discard()
+            raise
+        finally:
+            self._end_download(invoice_id)
+
+    async def save_async_response(self, invoice_id, response, url=None):
+        """Équivalent de save_response pour une réponse httpx lue en streaming asynchrone"""
+        download = _PendingDownload(self.objects_dir, response.headers)
+        self._begin_download(invoice_id)
+        try:
+            async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                download.write(chunk)
+            # fsync et manifeste SQLite hors de la boucle asyncio
+            return await asyncio.to_thread(self._commit_download, invoice_id, download, url)
+        except Exception:
+            download.discard()
+            raise
+        finally:
+            self._end_download(invoice_id)
+
+    def _begin_download(self, invoice_id):
+        with self._lock:
+            self._in_flight[str(invoice_id)] += 1
+
+    def _end_download(self, invoice_id):
+        with self._lock:
+            self._in_flight[str(invoice_id)] -= 1
+            if self._in_flight[str(invoice_id)] <= 0:
+                del self._in_flight[str(invoice_id)]
+
+    def _commit_download(self, invoice_id, download, url):
+        """
+        Vérifie un téléchargement terminé, le range sous son empreinte, l'enregistre et
+        fait la place, sous un même verrou: une éviction concurrente ne peut supprimer
+        l'objet entre son rangement et son enregistrement
+        """
+        digest, size = download.finish()
+        with self._lock:
+            object_path = self._commit_object(download.tmp_path, digest)
+            self._record(invoice_id, digest, size,
+                         etag=download.headers.get("ETag"),
+                         last_modified=download.headers.get("Last-Modified"),
+                         url=url)
+            self.evict(keep=(digest,))
+        return object_path, size
+
+    def _commit_object(self, tmp_path, digest):
+        """Range un fichier temporaire sous son empreinte (dédoublonné s'il existe déjà)"""
+        object_path = self.object_path(digest)
+        if os.path.exists(object_path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(tmp_path, object_path)
+        return object_path
+
+    def _record(self, invoice_id, digest, size, etag=None, last_modified=None, url=None, fetched_at=None):
+        """Associe une facture à un objet dans le manifeste"""
+        with self._lock:
+            previous = self.db.execute("SELECT hash FROM pdfs WHERE invoice_id = ?", (str(invoice_id),)).fetchone()
+            with self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO pdfs (invoice_id, hash, size, etag, last_modified, url, fetched_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (str(invoice_id), digest, size, etag, last_modified, url,
+                     fetched_at or datetime.now().isoformat(), time.time())
+                )
+            if previous and previous["hash"] != digest:
+                self._delete_if_unreferenced(previous["hash"])
+
+    def _delete_if_unreferenced(self, digest):
+        """Supprime un objet qui n'est plus référencé par aucune facture (verrou déjà pris)"""
+        still_used = self.db.execute("SELECT 1 FROM pdfs WHERE hash = ? LIMIT 1", (digest,)).fetchone()
+        if still_used is None:
+            object_path = self.object_path(digest)
+            if os.path.exists(object_path):
+                os.remove(object_path)
+
+    def total_size(self):
+        """Taille totale des objets stockés (chaque contenu n'est compté qu'une fois)"""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT COALESCE(SUM(size), 0) AS total FROM (SELECT MAX(size) AS size FROM pdfs GROUP BY hash)"
+            ).fetchone()
+        return row["total"]
+
+    def evict(self, max_bytes=None, keep=()):
+        """
+        Évince les objets les moins récemment utilisés jusqu'à repasser sous max_bytes,
+        sauf ceux de keep et ceux des factures en cours de téléchargement
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if not max_bytes:
+            return 0
+
+        evicted = 0
+        with self._lock:
+            total = self.total_size()
+            if total <= max_bytes:
+                return 0
+
+            protected = set(keep)
+            for invoice_id in self._in_flight:
+                row = self.db.execute("SELECT hash FROM pdfs WHERE invoice_id = ?", (invoice_id,)).fetchone()
+                if row is not None:
+                    protected.add(row["hash"])
+            candidates = self.db.execute(
+                "SELECT hash, MAX(size) AS size FROM pdfs GROUP BY hash ORDER BY MAX(last_access) ASC"
+            ).fetchall()
+            for candidate in candidates:
+                if total <= max_bytes:
+                    break
+                if candidate["hash"] in protected:
+                    continue
+                with self.db:
+                    self.db.execute("DELETE FROM pdfs WHERE hash = ?", (candidate["hash"],))
+                self._delete_if_unreferenced(candidate["hash"])
+                total -= candidate["size"]
+                evicted += 1
+
+        logger.info("🧹 %s PDF évincé(s) du magasin (taille: %s / %s octets)", evicted, total, max_bytes)
+        return evicted
+
+    def missing(self, invoice_ids):
+        """Retourne les ID de facture dont le PDF n'est pas dans le magasin"""
+        return [str(invoice_id) for invoice_id in invoice_ids if self.get(invoice_id) is None]
+
+    def restore_from(self, source_dir):
+        """
+        Importe un autre magasin (par exemple un cache CI restauré) : copie les objets
+        absents et les entrées de manifeste inconnues. Retourne le nombre de factures importées.
+        """
+        source_manifest = os.path.join(source_dir, MANIFEST_FILENAME)
+        if not os.path.exists(source_manifest):
+            logger.warning("⚠️ Aucun manifeste PDF dans %s", source_dir)
+            return 0
+
+        source = sqlite3.connect(source_manifest)
+        source.row_factory = sqlite3.Row
+        imported = 0
+        try:
+            for row in source.execute("SELECT * FROM pdfs"):
+                entry = dict(row)
+                if self.get(entry["invoice_id"]) is not None:
+                    continue
+                source_object = os.path.join(source_dir, OBJECTS_DIRNAME, entry["hash"][:2], entry["hash"][2:4],
+                                             f"{entry['hash']}.pdf")
+                if not os.path.exists(source_object):
+                    continue
+                object_path = self.object_path(entry["hash"])
+                if not os.path.exists(object_path):
+                    os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=self.objects_dir, prefix=".restore-", suffix=".part")
+                    os.close(fd)
+                    shutil.copyfile(source_object, tmp_path)
+                    self._commit_object(tmp_path, entry["hash"])
+                self._record(entry["invoice_id"], entry["hash"], entry["size"], etag=entry["etag"],
+                             last_modified=entry["last_modified"], url=entry["url"], fetched_at=entry["fetched_at"])
+                imported += 1
+        finally:
+            source.close()
+
+        logger.info("📦 %s PDF importé(s) depuis %s", imported, source_dir)
+        self.evict()
+        return imported
+
+    def _import_legacy_files(self):
+        """Range dans le magasin les anciens fichiers facture_{id}.pdf et l'ancien index JSON"""
+        legacy_index = {}
+        legacy_index_path = os.path.join(self.storage_dir, LEGACY_INDEX_FILENAME)
+        if os.path.exists(legacy_index_path):
+            try:
+                with open(legacy_index_path, "r", encoding="utf-8") as f:
+                    legacy_index = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                legacy_index = {}
+
+        imported = 0
+        for filename in os.listdir(self.storage_dir):
+            match = LEGACY_FILE_PATTERN.match(filename)
+            if not match:
+                continue
+            invoice_id = match.group(1)
+            legacy_path = os.path.join(self.storage_dir, filename)
+            if os.path.getsize(legacy_path) == 0:
+                # Fichier vide laissé par une ancienne version en cas d'échec
+                os.remove(legacy_path)
+                continue
+
+            digest = hashlib.sha256()
+            with open(legacy_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+            size = os.path.getsize(legacy_path)
+            self._commit_object(legacy_path, digest.hexdigest())
+
+            validators = legacy_index.get(invoice_id, {})
+            self._record(invoice_id, digest.hexdigest(), size, etag=validators.get("etag"),
+                         last_modified=validators.get("last_modified"), url=validators.get("url"))
+            imported += 1
+
+        if os.path.exists(legacy_index_path):
+            os.remove(legacy_index_path)
+        if imported:
+            logger.info("📦 %s ancien(s) PDF rangé(s) dans le magasin %s", imported, self.storage_dir)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_pdf_store(storage_dir, max_bytes=0):
+    """
+    Retourne le magasin partagé d'un répertoire (créé à la première utilisation): les
+    clients synchrone et asynchrone d'un même processus partagent ainsi verrou,
+    téléchargements en cours et connexion au manifeste
+    """
+    key = os.path.realpath(storage_dir)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = PdfStore(storage_dir, max_bytes=max_bytes)
+            _stores[key] = store
+        return store
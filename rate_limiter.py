@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from config import (SELLSY_API_URL, SELLSY_TOKEN_URL, AIRTABLE_API_URL, SELLSY_RATE_LIMIT, SELLSY_RATE_BURST,
+                    AIRTABLE_RATE_LIMIT, AIRTABLE_RATE_BURST, DEFAULT_RATE_LIMIT)
+from metrics import metrics, service_for
+
+logger = logging.getLogger("rate_limiter")
+
+# Attente appliquée sur un 429 sans en-tête Retry-After (secondes)
+DEFAULT_RETRY_AFTER = 30
+
+
+class RateLimiter:
+    """
+    Seau à jetons (token bucket) partagé entre threads et tâches asyncio.
+
+    Chaque appel réserve un jeton puis attend hors du verrou le temps nécessaire,
+    ce qui garantit un débit moyen de `rate` requêtes/s avec des rafales de `burst`.
+    Le débit s'adapte aux réponses 429: il est divisé par deux (et le seau suspendu
+    pendant Retry-After), puis remonte progressivement à chaque réponse réussie.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=0.5):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def _reserve(self, tokens):
+        """Réserve des jetons et retourne le temps d'attente correspondant"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= tokens
+            # Pendant une suspension (429), updated_at est dans le futur
+            wait = max(0.0, self.updated_at - now)
+            if self.tokens < 0:
+                wait += -self.tokens / self.rate
+            return wait
+
+    def acquire(self, tokens=1):
+        """Attend (bloquant) qu'une requête puisse partir"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens=1):
+        """Attend (sans bloquer la boucle asyncio) qu'une requête puisse partir"""
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, retry_after=None):
+        """Suspend le seau et réduit le débit après une réponse 429"""
+        delay = DEFAULT_RETRY_AFTER if retry_after is None else max(0.0, float(retry_after))
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens = min(self.tokens, 0.0)
+            self.updated_at = max(self.updated_at, now + delay)
+            self.rate = max(self.min_rate, self.rate / 2)
+        logger.warning("⚠️ Limitation de débit (429): pause de %.0f s, débit réduit à %.2f req/s", delay, self.rate)
+
+    def record_success(self):
+        """Remonte progressivement le débit vers le quota configuré"""
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def update_from_response(self, status_code, headers):
+        """Adapte le seau à partir du statut et de l'en-tête Retry-After d'une réponse"""
+        if status_code == 429:
+            self.penalize(parse_retry_after(headers))
+        elif status_code < 500:
+            self.record_success()
+
+
+def parse_retry_after(headers):
+    """Retourne la valeur de Retry-After en secondes, ou None si absente/illisible"""
+    value = headers.get("Retry-After") if headers else None
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# Quotas par hôte (requêtes/s, rafale)
+_HOST_LIMITS = {
+    urlparse(SELLSY_API_URL).hostname: (SELLSY_RATE_LIMIT, SELLSY_RATE_BURST),
+    urlparse(SELLSY_TOKEN_URL).hostname: (SELLSY_RATE_LIMIT, SELLSY_RATE_BURST),
+    urlparse(AIRTABLE_API_URL).hostname: (AIRTABLE_RATE_LIMIT, AIRTABLE_RATE_BURST),
+}
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(url):
+    """Retourne le limiteur partagé de l'hôte de l'URL (créé à la première utilisation)"""
+    host = urlparse(url).hostname or url
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            rate, burst = _HOST_LIMITS.get(host, (DEFAULT_RATE_LIMIT, DEFAULT_RATE_LIMIT))
+            limiter = RateLimiter(rate, burst)
+            _limiters[host] = limiter
+        return limiter
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    Adaptateur requests qui fait passer chaque requête par le limiteur de son hôte.
+    Avec rate_limit_retries > 0, une réponse 429 est renvoyée jusqu'à ce nombre de fois,
+    après que le limiteur a appliqué Retry-After; sinon elle est retournée à l'appelant.
+    """
+
+    def __init__(self, *args, rate_limit_retries=0, **kwargs):
+        self.rate_limit_retries = rate_limit_retries
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        limiter = get_rate_limiter(request.url)
+        for attempt in range(self.rate_limit_retries + 1):
+            limiter.acquire()
+            try:
+                response = super().send(request, **kwargs)
+            except Exception:
+                metrics.count_request(request.url, None)
+                raise
+            metrics.count_request(request.url, response.status_code)
+            limiter.update_from_response(response.status_code, response.headers)
+            if response.status_code != 429 or attempt == self.rate_limit_retries:
+                break
+            metrics.count_retry(service_for(request.url), 429)
+            response.close()
+        if response.status_code == 429 and self.rate_limit_retries:
+            logger.error("❌ Limitation de débit (429) persistante après %s tentative(s): %s",
+                         self.rate_limit_retries + 1, request.url)
+        return response
+
+
+def install_rate_limiter(session, prefix):
+    """
+    Monte un RateLimitedAdapter sur une session en conservant sa stratégie de retry, 429 excepté:
+    un 429 absorbé par le Retry urllib3 (celui de pyairtable par exemple) n'atteindrait jamais
+    le limiteur. Les 429 sont donc renvoyés par l'adaptateur, autant de fois que le prévoyait le Retry.
+    """
+    retries = session.get_adapter(prefix).max_retries
+    rate_limit_retries = 0
+    if 429 in (retries.status_forcelist or ()):
+        rate_limit_retries = retries.total if isinstance(retries.total, int) else 5
+        # urllib3 renvoie aussi tout 429 portant Retry-After si respect_retry_after_header est actif
+        retries = retries.new(status_forcelist=[code for code in retries.status_forcelist if code != 429],
+                              respect_retry_after_header=False)
+    session.mount(prefix, RateLimitedAdapter(max_retries=retries, rate_limit_retries=rate_limit_retries))
+    return session
@@ -0,0 +1,175 @@
+import json
+import logging
+from sellsy_api import CLIENT_KEYS
+from sync_pipeline import SyncPipeline
+from sync_state import invoice_cursor
+from config import SYNC_FETCH_WORKERS, SYNC_PDF_WORKERS
+from metrics import metrics
+
+logger = logging.getLogger("reconcile")
+
+# Champs Airtable écrits par la synchronisation (seuls ceux-ci sont lus pendant la réconciliation)
+SYNC_FIELDS = ["ID_Facture", "Numéro", "Date", "Client", "ID_Client_Sellsy", "Montant_HT", "Montant_TTC",
+               "Statut", "URL", "PDF_URL"]
+
+# Champs formatés qui dépendent de clés Sellsy parfois absentes des pages de liste
+_SOURCE_KEYS = {
+    ("Client", "ID_Client_Sellsy"): CLIENT_KEYS,
+    ("Montant_HT", "Montant_TTC"): ("amounts", "amount", "total_amount_without_taxes", "total_amount_with_taxes"),
+    ("Date",): ("created_at", "date", "created"),
+    ("PDF_URL",): ("pdf_link",),
+}
+
+# Nombre d'ID affichés par catégorie dans le rapport
+REPORT_SAMPLE_SIZE = 20
+
+
+def comparable_fields(airtable, invoice):
+    """
+    Formate une facture de liste pour la comparer à Airtable, en retirant les champs
+    dont la source est absente de la liste (ils seraient remplis par des valeurs par défaut)
+    """
+    fields = airtable.format_invoice_for_airtable(invoice)
+    if not fields:
+        return None
+    for field_names, source_keys in _SOURCE_KEYS.items():
+        if not any(invoice.get(key) for key in source_keys):
+            for name in field_names:
+                fields.pop(name, None)
+    return fields
+
+
+class Reconciler:
+    """
+    Compare Sellsy et Airtable par opérations d'ensembles au lieu d'interroger Airtable
+    facture par facture.
+
+    Airtable est lu une seule fois (champs synchronisés uniquement) dans un index
+    ID -> enregistrement, puis la liste Sellsy est parcourue en flux et chaque facture
+    classée immédiatement. Seules les différences sont ensuite traitées:
+    - missing: dans Sellsy, absente d'Airtable (création)
+    - stale: présente des deux côtés mais avec des champs différents (mise à jour)
+    - orphaned: dans Airtable, absente de Sellsy (suppression sur demande)
+    - blank: enregistrement Airtable sans ID_Facture (ancien cleanup_empty_ids.py)
+    - conflicting: plusieurs enregistrements Airtable pour la même facture (à arbitrer à la main)
+    """
+
+    def __init__(self, sellsy, airtable, source=None):
+        self.sellsy = sellsy
+        self.airtable = airtable
+        # Source de la liste Sellsy: l'API, ou le miroir local pour une comparaison hors ligne
+        self.source = source or sellsy
+        self.records = {}      # ID Sellsy -> {"id", "fields"} (premier enregistrement trouvé)
+        self.duplicates = {}   # ID Sellsy -> [ID des enregistrements Airtable]
+        self.blank = []        # Enregistrements Airtable sans ID_Facture
+        self.to_sync = []      # Factures Sellsy à créer ou mettre à jour
+        self.report = None
+
+    @metrics.timed("airtable_lookup")
+    def scan_airtable(self):
+        """Charge l'index Airtable en une passe paginée"""
+        logger.info("📚 Lecture des factures Airtable...")
+        for page in self.airtable.table.iterate(page_size=100, fields=SYNC_FIELDS):
+            for record in page:
+                fields = record.get("fields", {})
+                sellsy_id = str(fields.get("ID_Facture", "") or "").strip()
+                if not sellsy_id:
+                    self.blank.append(record)
+                elif sellsy_id in self.records:
+                    self.duplicates.setdefault(sellsy_id, [self.records[sellsy_id]["id"]]).append(record["id"])
+                else:
+                    self.records[sellsy_id] = {"id": record["id"], "fields": fields}
+        logger.info("✅ %s facture(s) Airtable, %s sans ID, %s en double",
+                    len(self.records), len(self.blank), len(self.duplicates))
+
+    def diff(self, limit=10000):
+        """Classe les factures des deux côtés et retourne le rapport de réconciliation"""
+        self.scan_airtable()
+
+        missing, stale = [], []
+        seen = set()
+        unchanged = 0
+        updated = {}  # ID -> date de mise à jour Sellsy (pour le rapport)
+        for invoice in self.source.iter_invoices(limit):
+            sellsy_id = str(invoice.get("id", ""))
+            if not sellsy_id or sellsy_id in seen:
+                continue
+            seen.add(sellsy_id)
+            cursor = invoice_cursor(invoice)
+            updated[sellsy_id] = cursor["timestamp"] if cursor else None
+
+            record = self.records.get(sellsy_id)
+            if record is None:
+                missing.append(sellsy_id)
+                self.to_sync.append(invoice)
+                continue
+
+            fields = comparable_fields(self.airtable, invoice)
+            if fields is not None and self.airtable.is_unchanged(record, fields):
+                unchanged += 1
+            else:
+                stale.append(sellsy_id)
+                self.to_sync.append(invoice)
+
+        # Une liste tronquée (limite, pages en échec) ne permet pas de conclure qu'une facture a disparu de Sellsy
+        complete_listing = len(seen) < limit and getattr(self.source, "listing_complete", True)
+        orphaned = sorted(set(self.records) - seen) if complete_listing else []
+        if len(seen) >= limit:
+            logger.warning("⚠️ Limite de %s factures atteinte: les orphelins ne sont pas recherchés", limit)
+        elif not complete_listing:
+            logger.warning("⚠️ Liste Sellsy incomplète (pages en échec): les orphelins ne sont pas recherchés")
+
+        self.report = {
+            "sellsy_count": len(seen),
+            "airtable_count": len(self.records),
+            "complete_listing": complete_listing,
+            "unchanged": unchanged,
+            "missing": missing,
+            "stale": stale,
+            "orphaned": orphaned,
+            "blank": [record["id"] for record in self.blank],
+            "conflicting": self.duplicates,
+            "updated": {sellsy_id: updated[sellsy_id] for sellsy_id in missing + stale},
+        }
+        return self.report
+
+    def print_report(self):
+        report = self.report
+        logger.info("📊 Réconciliation: %s facture(s) Sellsy, %s Airtable",
+                    report['sellsy_count'], report['airtable_count'])
+        logger.info("   ✅ %s identique(s)", report['unchanged'])
+        for key, label in [("missing", "manquante(s) dans Airtable"), ("stale", "à mettre à jour"),
+                           ("orphaned", "orpheline(s) (absentes de Sellsy)"), ("blank", "sans ID_Facture"),
+                           ("conflicting", "en double dans Airtable")]:
+            ids = list(report[key])
+            if not ids:
+                continue
+            sample = ", ".join(ids[:REPORT_SAMPLE_SIZE]) + (" ..." if len(ids) > REPORT_SAMPLE_SIZE else "")
+            logger.info("   • %s %s: %s", len(ids), label, sample)
+
+    def save_report(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report, f, indent=2, ensure_ascii=False)
+        logger.info("💾 Rapport de réconciliation enregistré: %s", path)
+
+    def apply(self, delete_orphans=False, fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS):
+        """Traite uniquement les différences: synchronise missing/stale, supprime orphelins et lignes vides sur demande"""
+        summary = None
+        if self.to_sync:
+            # L'index déjà chargé évite toute recherche Airtable pendant l'écriture
+            self.airtable.index = dict(self.records)
+            pipeline = SyncPipeline(self.sellsy, self.airtable, fetch_workers=fetch_workers, pdf_workers=pdf_workers)
+            summary = pipeline.run(self.to_sync)
+
+        if delete_orphans:
+            record_ids = [self.records[sellsy_id]["id"] for sellsy_id in self.report["orphaned"]]
+            record_ids += self.report["blank"]
+            if record_ids:
+                self.airtable.delete_records(record_ids)
+        elif self.report["orphaned"] or self.report["blank"]:
+            logger.info("ℹ️ Orphelins et lignes sans ID conservés (utiliser --delete-orphans pour les supprimer)")
+
+        if self.report["conflicting"]:
+            logger.warning("⚠️ %s facture(s) en double dans Airtable à arbitrer manuellement",
+                           len(self.report['conflicting']))
+        return summary
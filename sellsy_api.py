@@ -1,431 +1,760 @@
+import asyncio
 import requests
 import json
 import time
 import base64
+import logging
 import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
 from datetime import datetime, timedelta
-from config import SELLSY_CLIENT_ID, SELLSY_CLIENT_SECRET, SELLSY_API_URL, PDF_STORAGE_DIR
+from config import (SELLSY_CLIENT_ID, SELLSY_CLIENT_SECRET, SELLSY_API_URL, SELLSY_TOKEN_URL, PDF_STORAGE_DIR,
+                    SELLSY_POOL_SIZE, SELLSY_CONNECT_TIMEOUT, SELLSY_READ_TIMEOUT,
+                    SELLSY_DETAILS_CACHE_TTL, SELLSY_DETAILS_CACHE_SIZE, PDF_STORE_MAX_BYTES,
+                    SYNC_PDF_WORKERS, SELLSY_PAGE_PREFETCH, SELLSY_USE_SEARCH, SELLSY_SEARCH_FIELDS,
+                    SELLSY_SEARCH_EMBED, SELLSY_MIRROR_DB)
+from rate_limiter import RateLimitedAdapter
+from pdf_store import PdfDownloadError, conditional_headers, get_pdf_store
+from token_manager import TokenManager
+from invoice_mirror import InvoiceMirror
+from metrics import metrics, status_label
+
+logger = logging.getLogger("sellsy_api")
+
+# Champs nécessaires au formatage Airtable: une facture qui les contient n'a pas besoin de ses détails
+DETAIL_KEYS = ("amounts", "pdf_link")
+CLIENT_KEYS = ("relation", "related")
+
+# Pages de liste consécutives en échec au-delà desquelles la pagination s'arrête
+MAX_FAILED_PAGES = 3
+
+# Réponse 304 aux détails demandés avec If-None-Match: la version du miroir est à jour
+NOT_MODIFIED = object()
+
+
+def build_search_filters(filters):
+    """
+    Convertit les filtres de get_all_invoices (created_after, created_before,
+    updated_after, updated_before, status) au format de POST /invoices/search.
+    Les autres filtres sont transmis tels quels.
+    """
+    search = {}
+    for key, value in filters.items():
+        if key in ("created_after", "created_before", "updated_after", "updated_before"):
+            field, bound = key.split("_")
+            search.setdefault(field, {})["start" if bound == "after" else "end"] = value
+        elif key == "status":
+            search["status"] = value if isinstance(value, list) else [value]
+        else:
+            search[key] = value
+    return search
+
+
+def is_complete_invoice(invoice):
+    """Indique si une facture de liste contient déjà tout ce que le formatage Airtable utilise"""
+    return all(key in invoice for key in DETAIL_KEYS) and any(key in invoice for key in CLIENT_KEYS)
+
+
+def token_request():
+    """Requête OAuth client_credentials Sellsy v2: (url, en-têtes, corps)"""
+    # Authentification avec les identifiants client en Base64
+    auth_string = f"{SELLSY_CLIENT_ID}:{SELLSY_CLIENT_SECRET}"
+    auth_bytes = auth_string.encode('ascii')
+    auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
+    
+    headers = {
+        "Authorization": f"Basic {auth_b64}",
+        "Content-Type": "application/x-www-form-urlencoded",
+        "Accept": "application/json"
+    }
+    return SELLSY_TOKEN_URL, headers, "grant_type=client_credentials"
+
+
+def token_response_data(response):
+    """Réponse OAuth d'une réponse HTTP de token (requests ou httpx); lève une exception en cas d'échec"""
+    logger.debug("Statut de la réponse: %s", response.status_code)
+    if response.status_code == 200:
+        try:
+            token_data = response.json()
+            logger.info("✅ Token d'accès obtenu avec succès")
+            return token_data
+        except json.JSONDecodeError as e:
+            logger.error("❌ Erreur de décodage JSON: %s", e)
+            logger.error("Contenu de la réponse (100 premiers caractères): %s", response.text[:100])
+            raise Exception("Réponse de l'API Sellsy invalide")
+    logger.error("❌ Erreur d'authentification Sellsy: Code %s", response.status_code)
+    logger.error("Réponse complète: %s", response.text)
+    raise Exception(f"Échec de l'authentification Sellsy (code {response.status_code})")
+
+
+def request_access_token(session=None, timeout=(SELLSY_CONNECT_TIMEOUT, SELLSY_READ_TIMEOUT)):
+    """Demande un nouveau token d'accès Sellsy selon la documentation v2 et retourne la réponse OAuth"""
+    url, headers, data = token_request()
+    logger.debug("Tentative d'authentification à l'API Sellsy: %s", url)
+    
+    try:
+        response = (session or requests).post(url, headers=headers, data=data, timeout=timeout)
+        if session is None:
+            # Sans session, la requête ne passe pas par RateLimitedAdapter qui compte les autres
+            metrics.count_request(url, response.status_code)
+    except requests.exceptions.RequestException as e:
+        logger.error("❌ Erreur de connexion à l'API Sellsy: %s", e)
+        raise Exception(f"Impossible de se connecter à l'API Sellsy: {e}")
+    return token_response_data(response)
+
 
 class SellsyAPI:
-    def __init__(self):
-        self.access_token = None
-        self.token_expires_at = 0
+    def __init__(self, pool_size=SELLSY_POOL_SIZE, timeout=(SELLSY_CONNECT_TIMEOUT, SELLSY_READ_TIMEOUT),
+                 page_prefetch=SELLSY_PAGE_PREFETCH, use_search=SELLSY_USE_SEARCH, mirror=None, pdf_store=None):
         self.api_url = SELLSY_API_URL
-        print(f"API URL configurée: {self.api_url}")
+        self.timeout = timeout
+        self.page_prefetch = max(1, page_prefetch)
+        
+        # Recherche côté serveur (POST /invoices/search) avec projection des champs
+        self.use_search = use_search
+        self.search_fields = SELLSY_SEARCH_FIELDS
+        self.search_embed = SELLSY_SEARCH_EMBED
+        self.session = self._create_session(pool_size)
+        self.token_manager = TokenManager(lambda: request_access_token(self.session, self.timeout),
+                                          cache_key=SELLSY_CLIENT_ID)
+        logger.debug("API URL configurée: %s", self.api_url)
+        
+        # Cache court des détails de facture pour éviter de les redemander pendant un même passage
+        self.details_cache = OrderedDict()  # ID -> (horodatage, détails)
+        self.details_cache_ttl = SELLSY_DETAILS_CACHE_TTL
+        self.details_cache_size = SELLSY_DETAILS_CACHE_SIZE
+        self._details_cache_lock = threading.Lock()
         
         # Vérifier que les identifiants sont bien définis (sans les afficher)
         if not SELLSY_CLIENT_ID or not SELLSY_CLIENT_SECRET:
-            print("ERREUR: Identifiants Sellsy manquants dans les variables d'environnement")
+            logger.error("ERREUR: Identifiants Sellsy manquants dans les variables d'environnement")
         
         # Créer le répertoire de stockage des PDF s'il n'existe pas
         if not os.path.exists(PDF_STORAGE_DIR):
             os.makedirs(PDF_STORAGE_DIR)
-            print(f"Répertoire de stockage des PDF créé: {PDF_STORAGE_DIR}")
-
-    def get_access_token(self):
-        """Obtient ou renouvelle le token d'accès Sellsy selon la documentation v2"""
-        current_time = time.time()
+            logger.info("Répertoire de stockage des PDF créé: %s", PDF_STORAGE_DIR)
         
-        # Vérifier si le token est encore valide
-        if self.access_token and current_time < self.token_expires_at - 60:
-            return self.access_token
+        # Magasin des PDF adressé par contenu (manifeste, validateurs HTTP, éviction LRU)
+        self.pdf_store = pdf_store or get_pdf_store(PDF_STORAGE_DIR, max_bytes=PDF_STORE_MAX_BYTES)
         
-        # Si non, demander un nouveau token
-        url = "https://login.sellsy.com/oauth2/access-tokens"
+        # Miroir local des factures (cache en lecture persistant, désactivé si SELLSY_MIRROR_DB est vide)
+        if mirror is None and SELLSY_MIRROR_DB:
+            mirror = InvoiceMirror()
+        self.mirror = mirror or None
         
-        # Authentification avec les identifiants client en Base64
-        auth_string = f"{SELLSY_CLIENT_ID}:{SELLSY_CLIENT_SECRET}"
-        auth_bytes = auth_string.encode('ascii')
-        auth_b64 = base64.b64encode(auth_bytes).decode('ascii')
+        # Bilan de la dernière liste: pages toujours en échec, liste parcourue jusqu'au bout
+        self.failed_pages = []
+        self.listing_complete = True
+        self.listing_truncated = False
+
+    def _create_session(self, pool_size):
+        """Crée la session HTTP partagée (connexions persistantes, gzip, limiteur de débit)"""
+        session = requests.Session()
+        session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive"
+        })
+        # Un pool par hôte (api, login, liens PDF), dimensionné pour les workers concurrents
+        adapter = RateLimitedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def close(self):
+        """Ferme les connexions de la session HTTP et arrête le renouvellement du token"""
+        self.token_manager.close()
+        self.session.close()
+
+    def _request(self, method, url, **kwargs):
+        """Envoie une requête HTTP via la session partagée (le limiteur de débit est dans l'adaptateur)"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get_access_token(self, stale_token=None):
+        """Retourne un token d'accès valide (partagé entre threads, un seul renouvellement à la fois)"""
+        return self.token_manager.get_token(stale_token)
+
+    def recent_filters(self, days):
+        """Filtres de date pour les factures des derniers jours spécifiés"""
+        start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+        end_date = datetime.now().strftime("%Y-%m-%d")
         
-        headers = {
-            "Authorization": f"Basic {auth_b64}",
-            "Content-Type": "application/x-www-form-urlencoded",
-            "Accept": "application/json"
+        logger.info("🔍 Récupération des factures du %s au %s (période de %s jours)", start_date, end_date, days)
+        return {
+            "created_after": f"{start_date}T00:00:00Z",
+            "created_before": f"{end_date}T23:59:59Z"
         }
-        
-        data = "grant_type=client_credentials"
-        
-        print(f"Tentative d'authentification à l'API Sellsy: {url}")
-        
-        try:
-            response = requests.post(url, headers=headers, data=data)
-            print(f"Statut de la réponse: {response.status_code}")
-            
-            if response.status_code == 200:
-                try:
-                    token_data = response.json()
-                    self.access_token = token_data["access_token"]
-                    self.token_expires_at = current_time + token_data["expires_in"]
-                    print("✅ Token d'accès obtenu avec succès")
-                    return self.access_token
-                except json.JSONDecodeError as e:
-                    print(f"❌ Erreur de décodage JSON: {e}")
-                    print(f"Contenu de la réponse (100 premiers caractères): {response.text[:100]}")
-                    raise Exception("Réponse de l'API Sellsy invalide")
-            else:
-                print(f"❌ Erreur d'authentification Sellsy: Code {response.status_code}")
-                print(f"Réponse complète: {response.text}")
-                raise Exception(f"Échec de l'authentification Sellsy (code {response.status_code})")
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Erreur de connexion à l'API Sellsy: {e}")
-            raise Exception(f"Impossible de se connecter à l'API Sellsy: {e}")
+
+    def iter_recent_invoices(self, days=365):
+        """Itère sur les factures des derniers jours spécifiés au fil de la pagination"""
+        # Limite très élevée pour garantir qu'on récupère tout
+        return self.iter_invoices(limit=10000, **self.recent_filters(days))
 
     def get_invoices(self, days=365):
         """Récupère les factures des derniers jours spécifiés (défaut: 365 jours = 1 an)"""
-        # Calcul de la date à partir d'il y a un an
-        start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        end_date = datetime.now().strftime("%Y-%m-%d")
+        return list(self.iter_recent_invoices(days))
+
+    @metrics.timed("list_page")
+    def _fetch_invoice_page(self, offset, page_size, filters, max_retries=5, retry_delay=5):
+        """
+        Récupère une page de la liste des factures avec gestion des erreurs
         
-        print(f"🔍 Récupération des factures du {start_date} au {end_date} (période de {days} jours)")
+        Returns:
+            (factures, pagination) en cas de succès, None après max_retries échecs
+        """
+        params = {
+            "limit": page_size,
+            "offset": offset,
+            "order": "created",           # Tri par date de création
+            "direction": "desc"          # Ordre décroissant (plus récent d'abord)
+        }
         
-        # Utiliser la méthode générique pour récupérer toutes les factures avec filtre de date
-        return self.get_all_invoices(
-            limit=10000,  # Limite très élevée pour garantir qu'on récupère tout
-            created_after=f"{start_date}T00:00:00Z",
-            created_before=f"{end_date}T23:59:59Z"
-        )
+        if self.use_search:
+            # Filtres dans le corps, projection et objets liés en paramètres
+            method = "POST"
+            url = f"{self.api_url}/invoices/search"
+            body = {"filters": build_search_filters(filters)}
+            if self.search_fields:
+                params["field[]"] = self.search_fields
+            if self.search_embed:
+                params["embed[]"] = self.search_embed
+        else:
+            # Ajout des filtres additionnels
+            method = "GET"
+            url = f"{self.api_url}/invoices"
+            body = None
+            params.update(filters)
+        
+        page_number = offset // page_size + 1
+        logger.debug("📄 Récupération de la page %s (offset %s): %s", page_number, offset, url)
+        
+        retry_count = 0
+        token = self.get_access_token()
+        while retry_count < max_retries:
+            headers = {
+                "Authorization": f"Bearer {token}",
+                "Content-Type": "application/json",
+                "Accept": "application/json"
+            }
+            try:
+                response = self._request(method, url, headers=headers, params=params, json=body)
+                status_code = response.status_code
+                logger.debug("📊 Statut de la réponse (page %s): %s", page_number, status_code)
+                
+                if status_code == 200:
+                    response_data = response.json()
+                    return response_data.get("data", []), response_data.get("pagination") or {}
+                
+                elif status_code == 401:
+                    # Token expiré, renouvellement (une seule fois quel que soit le nombre de workers)
+                    logger.info("🔄 Token expiré, renouvellement...")
+                    token = self.get_access_token(stale_token=token)
+                    retry_count += 1
+                    metrics.count_retry("sellsy", 401)
+                
+                elif status_code == 429:
+                    # Rate limiting - le limiteur a été suspendu selon Retry-After
+                    retry_count += 1
+                    metrics.count_retry("sellsy", 429)
+                    logger.warning("⚠️ Limitation de débit (429), tentative %s/%s pour la page %s",
+                                   retry_count, max_retries, page_number)
+                
+                else:
+                    logger.error("❌ Erreur lors de la récupération (page %s): %s - %s",
+                                 page_number, status_code, response.text)
+                    retry_count += 1
+                    metrics.count_retry("sellsy", status_label(status_code))
+                    if retry_count < max_retries:
+                        logger.warning("⏱️ Tentative %s/%s après %s secondes...", retry_count, max_retries, retry_delay)
+                        time.sleep(retry_delay)
+            
+            except Exception as e:
+                # Gestion des exceptions (problèmes réseau, etc.)
+                logger.error("❌ Exception lors de la récupération de la page %s: %s", page_number, e)
+                retry_count += 1
+                metrics.count_retry("sellsy", "error")
+                if retry_count < max_retries:
+                    logger.warning("⏱️ Tentative %s/%s après %s secondes...", retry_count, max_retries, retry_delay)
+                    time.sleep(retry_delay)
+        
+        logger.error("❌ Nombre maximum de tentatives atteint pour la page %s", page_number)
+        return None
 
-    def get_all_invoices(self, limit=10000, **filters):
+    def iter_invoices(self, limit=10000, journal=None, **filters):
         """
-        Récupère toutes les factures avec pagination robuste et gestion d'erreurs améliorée
+        Générateur des factures Sellsy, produites au fur et à mesure de l'arrivée des pages
+        
+        La première page donne le total (pagination.total): les pages suivantes sont
+        alors préchargées en parallèle (page_prefetch pages d'avance), le débit étant
+        régulé par le limiteur. La mémoire reste bornée par la taille des pages
+        préchargées. Les factures sont dédoublonnées par ID, car une facture créée
+        pendant le parcours décale les offsets suivants.
+        
+        Une page en échec n'interrompt pas la liste: elle est notée et redemandée en fin
+        de parcours. Les pages toujours en échec restent dans failed_pages et
+        listing_complete est alors faux. Une liste arrêtée par la limite n'est pas
+        complète non plus (listing_truncated): les factures les plus anciennes n'ont pas
+        été lues. Avec un journal de synchronisation, les pages reçues y sont
+        enregistrées et la liste reprend au curseur du run.
         
         Args:
             limit: Nombre maximum de factures à récupérer (défaut: 10000)
+            journal: Journal du run (SyncJournal) à alimenter et depuis lequel reprendre
             **filters: Filtres additionnels à passer à l'API Sellsy
                     - created_after: Date de début (format ISO)
                     - created_before: Date de fin (format ISO)
                     - status: Statut des factures
         """
-        token = self.get_access_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "Accept": "application/json"
-        }
-        
-        all_invoices = []
-        current_page = 1
         page_size = 100  # La taille de page maximale généralement acceptée par Sellsy
+        seen_ids = set()
+        yielded = 0
+        duplicates = 0
+        start_offset = journal.run["listing_offset"] if journal else 0
+        retry_offsets = journal.failed_pages() if journal else []
+        budget = max(0, limit - start_offset)
+        failed = []
+        self.failed_pages = []
+        self.listing_complete = False
+        self.listing_truncated = False
         
-        # Paramètres de pagination
-        max_retries = 5        # Nombre maximum de tentatives par page
-        retry_delay = 5        # Délai entre les tentatives en secondes
-        page_delay = 1         # Délai entre les pages en secondes
-        
-        print(f"🚀 Récupération de toutes les factures (limite: {limit})...")
+        logger.info("🚀 Récupération de toutes les factures (limite: %s)...", limit)
         if filters:
-            print(f"📋 Filtres appliqués: {filters}")
-        
-        # Boucle de pagination
-        while len(all_invoices) < limit:
-            # Construction des paramètres de la requête
-            params = {
-                "limit": page_size,
-                "offset": (current_page - 1) * page_size,  # Utiliser offset au lieu de page
-                "order": "created",           # Tri par date de création
-                "direction": "desc"          # Ordre décroissant (plus récent d'abord)
-            }
-            
-            # Ajout des filtres additionnels
-            params.update(filters)
-            
-            url = f"{self.api_url}/invoices"
-            print(f"📄 Récupération de la page {current_page} (offset {params['offset']}): {url}")
-            
-            # Gestion des tentatives pour cette page
-            retry_count = 0
-            success = False
-            
-            while retry_count < max_retries and not success:
-                try:
-                    response = requests.get(url, headers=headers, params=params)
-                    status_code = response.status_code
-                    print(f"📊 Statut de la réponse: {status_code}")
-                    
-                    if status_code == 200:
-                        # Traitement des données en cas de succès
-                        response_data = response.json()
-                        page_invoices = response_data.get("data", [])
-
-                        # Si la page est vide, on a fini
-                        if not page_invoices:
-                            print("🏁 Page vide reçue, fin de la pagination")
-                            return all_invoices[:limit]
-
-                        # Vérifier que chaque facture a un ID
-                        for invoice in page_invoices:
-                            if "id" not in invoice or not invoice["id"]:
-                                print(f"⚠️ Facture sans ID détectée dans la liste - Clés: {list(invoice.keys())}")
-
-                        # Nombre de factures restantes à récupérer
-                        remaining = limit - len(all_invoices)
-
-                        # Ajouter seulement les factures nécessaires
-                        invoices_to_add = page_invoices[:remaining]
-                        all_invoices.extend(invoices_to_add)
-                        
-                        print(f"✅ Page {current_page}: {len(invoices_to_add)} factures récupérées (total: {len(all_invoices)}/{limit})")
-                        
-                        # Vérifier si on doit continuer la pagination
-                        if len(all_invoices) >= limit:
-                            print("🏁 Limite atteinte, fin de la récupération")
-                            return all_invoices[:limit]
-                        
-                        if len(page_invoices) < page_size:
-                            print("🏁 Dernière page atteinte (moins de résultats que la taille de page)")
-                            return all_invoices[:limit]
-                        
-                        # Passer à la page suivante
-                        current_page += 1
-                        success = True
-                        
-                        # Pause entre les pages pour éviter de surcharger l'API
-                        print(f"⏱️ Pause de {page_delay} seconde(s) entre les pages...")
-                        time.sleep(page_delay)
-                        
-                    elif status_code == 401:
-                        # Token expiré, renouvellement
-                        print("🔄 Token expiré, renouvellement...")
-                        self.token_expires_at = 0
-                        token = self.get_access_token()
-                        headers["Authorization"] = f"Bearer {token}"
-                        retry_count += 1
-                        print(f"🔄 Nouveau token obtenu, tentative {retry_count}/{max_retries} pour la page {current_page}")
-                    
-                    elif status_code == 429:
-                        # Rate limiting - attendre plus longtemps
-                        wait_time = 30  # 30 secondes par défaut
-                        if 'Retry-After' in response.headers:
-                            try:
-                                wait_time = int(response.headers['Retry-After'])
-                            except ValueError:
-                                pass
-                        
-                        print(f"⚠️ Limitation de débit (429), attente de {wait_time} secondes...")
-                        time.sleep(wait_time)
-                        retry_count += 1
-                    
-                    else:
-                        # Autres erreurs
-                        print(f"❌ Erreur lors de la récupération (page {current_page}): {status_code} - {response.text}")
-                        retry_count += 1
-                        
-                        if retry_count >= max_retries:
-                            print(f"❌ Nombre maximum de tentatives atteint pour la page {current_page}")
-                        else:
-                            print(f"⏱️ Tentative {retry_count}/{max_retries} après {retry_delay} secondes...")
-                            time.sleep(retry_delay)
-                
-                except Exception as e:
-                    # Gestion des exceptions (problèmes réseau, etc.)
-                    print(f"❌ Exception lors de la récupération de la page {current_page}: {e}")
-                    retry_count += 1
-                    
-                    if retry_count >= max_retries:
-                        print(f"❌ Nombre maximum de tentatives atteint pour la page {current_page}")
-                    else:
-                        print(f"⏱️ Tentative {retry_count}/{max_retries} après {retry_delay} secondes...")
-                        time.sleep(retry_delay)
+            logger.info("📋 Filtres appliqués: %s", filters)
+        if start_offset:
+            logger.info("↪️ Reprise de la liste à l'offset %s", start_offset)
+        
+        pages = chain(self._iter_pages(page_size, limit, filters, start_offset, failed, journal),
+                      self._retry_pages(page_size, filters, failed, retry_offsets, journal))
+        limit_reached = False
+        self._listing_total = None
+        for offset, page_invoices in pages:
+            if journal:
+                journal.record_page(offset, page_invoices, offset + page_size)
+            if self.mirror:
+                self.mirror.store_list(page_invoices)
+            for invoice in page_invoices:
+                invoice_id = invoice.get("id")
+                if not invoice_id:
+                    logger.warning("⚠️ Facture sans ID détectée dans la liste - Clés: %s", list(invoice.keys()))
+                elif str(invoice_id) in seen_ids:
+                    duplicates += 1
+                    continue
+                else:
+                    seen_ids.add(str(invoice_id))
+                if yielded >= budget:
+                    more_invoices = True
+                    break
+                yielded += 1
+                yield invoice
+            else:
+                # Page entièrement lue: d'autres factures existent si elle était pleine et que le total le confirme
+                total = self._listing_total
+                more_invoices = len(page_invoices) >= page_size and (total is None or offset + page_size < total)
+            if yielded >= budget:
+                limit_reached = True
+                if more_invoices:
+                    logger.warning("🏁 Limite de %s factures atteinte: liste tronquée, les plus anciennes ne sont "
+                                   "pas lues", limit)
+                    self.listing_complete = False
+                    self.listing_truncated = True
+                else:
+                    logger.info("🏁 Limite atteinte avec la dernière facture de la liste")
+                    self.listing_complete = True
+                break
+        
+        if limit_reached:
+            # Les pages en échec avant la limite n'ont pas été redemandées
+            self.failed_pages = sorted(set(failed) | set(retry_offsets) | set(self.failed_pages))
+        if self.failed_pages:
+            self.listing_complete = False
+            logger.error("❌ %s page(s) de liste toujours en échec (offsets %s): liste incomplète",
+                         len(self.failed_pages), self.failed_pages)
+        if journal:
+            # Une liste tronquée sans page en échec clôt le listing du run: sa limite est atteinte
+            journal.set_listing_done(self.listing_complete or (limit_reached and not self.failed_pages),
+                                     truncated=self.listing_truncated)
+        if duplicates:
+            logger.info("🔁 %s doublon(s) ignoré(s) pendant la pagination", duplicates)
+        logger.info("🎉 Total des factures récupérées: %s", yielded)
+
+    async def aiter_invoices(self, limit=10000, **filters):
+        """Variante asynchrone de iter_invoices: la pagination tourne dans un thread sans bloquer la boucle"""
+        iterator = self.iter_invoices(limit, **filters)
+        end = object()
+        while True:
+            invoice = await asyncio.to_thread(next, iterator, end)
+            if invoice is end:
+                break
+            yield invoice
+
+    def get_all_invoices(self, limit=10000, **filters):
+        """Récupère toutes les factures dans une liste (voir iter_invoices)"""
+        return list(self.iter_invoices(limit, **filters))
+
+    def _page_failed(self, offset, page_size, failed, journal):
+        """Note une page de liste en échec après les nouvelles tentatives de _fetch_invoice_page"""
+        logger.warning("⚠️ Impossible de récupérer la page à l'offset %s, elle sera redemandée", offset)
+        failed.append(offset)
+        if journal:
+            journal.record_failed_page(offset, "échec après nouvelles tentatives", offset + page_size)
+
+    def _iter_pages(self, page_size, limit, filters, start_offset=0, failed=None, journal=None):
+        """
+        Produit les pages (offset, factures) de la liste dans l'ordre, en préchargeant si le total est connu
+        
+        Les pages en échec sont ajoutées à failed. Après MAX_FAILED_PAGES échecs consécutifs
+        (ou si la première page manque), la liste s'arrête: listing_complete reste faux.
+        """
+        failed = failed if failed is not None else []
+        # Première page: elle fournit le total pour planifier les suivantes
+        result = self._fetch_invoice_page(start_offset, page_size, filters)
+        if result is None:
+            logger.warning("⚠️ Impossible de récupérer la première page")
+            self._page_failed(start_offset, page_size, failed, journal)
+            return
+        page_invoices, pagination = result
+        logger.debug("✅ Offset %s: %s factures récupérées", start_offset, len(page_invoices))
+        yield start_offset, page_invoices
+        
+        total = pagination.get("total")
+        self._listing_total = total if isinstance(total, int) else None
+        if len(page_invoices) < page_size or limit <= start_offset + page_size:
+            logger.info("🏁 Fin de la pagination après la première page")
+            self.listing_complete = True
+            return
+        
+        consecutive_failures = 0
+        if not isinstance(total, int):
+            # Pas de total annoncé: pagination séquentielle jusqu'à une page incomplète
+            offset = start_offset + page_size
+            while offset < limit:
+                result = self._fetch_invoice_page(offset, page_size, filters)
+                if result is None:
+                    self._page_failed(offset, page_size, failed, journal)
+                    consecutive_failures += 1
+                    if consecutive_failures >= MAX_FAILED_PAGES:
+                        logger.error("❌ %s pages consécutives en échec, arrêt de la pagination", consecutive_failures)
+                        return
+                    offset += page_size
+                    continue
+                consecutive_failures = 0
+                page_invoices, _ = result
+                yield offset, page_invoices
+                if len(page_invoices) < page_size:
+                    logger.info("🏁 Dernière page atteinte (moins de résultats que la taille de page)")
+                    break
+                offset += page_size
+            self.listing_complete = True
+            return
+        
+        logger.info("📚 %s factures annoncées par Sellsy, préchargement de %s page(s) en parallèle",
+                    total, self.page_prefetch)
+        offsets = iter(range(start_offset + page_size, min(total, limit), page_size))
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=self.page_prefetch)
+        
+        def submit_next():
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.append((offset, executor.submit(self._fetch_invoice_page, offset, page_size, filters)))
+        
+        try:
+            for _ in range(self.page_prefetch):
+                submit_next()
             
-            # Si toutes les tentatives ont échoué pour cette page
-            if not success:
-                print(f"⚠️ Impossible de récupérer la page {current_page} après {max_retries} tentatives")
-                print(f"⚠️ Retour des {len(all_invoices)} factures déjà récupérées")
-                return all_invoices[:limit]
-    
-        print(f"🎉 Total des factures récupérées: {len(all_invoices)}")
-        return all_invoices[:limit]
+            while pending:
+                offset, future = pending.popleft()
+                result = future.result()
+                submit_next()
+                if result is None:
+                    self._page_failed(offset, page_size, failed, journal)
+                    consecutive_failures += 1
+                    if consecutive_failures >= MAX_FAILED_PAGES:
+                        logger.error("❌ %s pages consécutives en échec, arrêt de la pagination", consecutive_failures)
+                        return
+                    continue
+                consecutive_failures = 0
+                page_invoices, _ = result
+                logger.debug("✅ Offset %s: %s factures récupérées", offset, len(page_invoices))
+                yield offset, page_invoices
+                if len(page_invoices) < page_size:
+                    break
+            self.listing_complete = True
+        finally:
+            # Ne pas attendre les pages devenues inutiles (limite atteinte, consommateur arrêté)
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _retry_pages(self, page_size, filters, failed, retry_offsets=(), journal=None):
+        """Redemande en fin de liste les pages en échec (de ce parcours ou d'un run précédent)"""
+        offsets = sorted(set(failed) | set(retry_offsets))
+        if offsets:
+            logger.info("🔁 Nouvelle tentative pour %s page(s) de liste en échec", len(offsets))
+        for offset in offsets:
+            result = self._fetch_invoice_page(offset, page_size, filters)
+            if result is None:
+                self.failed_pages.append(offset)
+                if journal:
+                    journal.record_failed_page(offset, "échec après nouvelles tentatives")
+                continue
+            logger.info("✅ Page à l'offset %s récupérée", offset)
+            yield offset, result[0]
+
+    def _get_cached_details(self, invoice_id):
+        """Retourne les détails en cache s'ils sont encore frais, sinon None"""
+        with self._details_cache_lock:
+            cached = self.details_cache.get(invoice_id)
+            if not cached:
+                return None
+            fetched_at, invoice_data = cached
+            if time.time() - fetched_at > self.details_cache_ttl:
+                del self.details_cache[invoice_id]
+                return None
+            return invoice_data
+
+    def _cache_details(self, invoice_id, invoice_data):
+        """Ajoute des détails au cache en évinçant les plus anciens au-delà de la taille maximale"""
+        if self.details_cache_ttl <= 0:
+            return
+        with self._details_cache_lock:
+            self.details_cache[invoice_id] = (time.time(), invoice_data)
+            self.details_cache.move_to_end(invoice_id)
+            while len(self.details_cache) > self.details_cache_size:
+                self.details_cache.popitem(last=False)
 
-    def get_invoice_details(self, invoice_id):
-        """Récupère les détails d'une facture spécifique"""
+    def get_invoice_details(self, invoice_id, use_cache=True):
+        """Récupère les détails d'une facture spécifique (avec cache court)"""
         if not invoice_id:
-            print("❌ ID de facture invalide")
+            logger.error("❌ ID de facture invalide")
             return None
             
         invoice_id = str(invoice_id)  # Conversion en chaîne
+        if use_cache:
+            invoice_data = self._get_cached_details(invoice_id)
+            if invoice_data is not None:
+                logger.debug("📦 Détails de la facture %s servis depuis le cache", invoice_id)
+                return invoice_data
+        
+        # Miroir local: détails frais servis sans appel, sinon revalidés avec leur ETag
+        mirrored, etag = None, None
+        if self.mirror:
+            mirrored, fresh, etag = self.mirror.get_details(invoice_id)
+            if mirrored is not None and fresh and use_cache:
+                logger.debug("🗄️ Détails de la facture %s servis depuis le miroir local", invoice_id)
+                self._cache_details(invoice_id, mirrored)
+                return mirrored
+        
+        invoice_data, etag = self._fetch_invoice_details(invoice_id, etag if mirrored is not None else None)
+        if invoice_data is NOT_MODIFIED:
+            logger.debug("🗄️ Détails de la facture %s inchangés (304), version du miroir conservée", invoice_id)
+            self.mirror.touch_details(invoice_id)
+            invoice_data = mirrored
+        elif invoice_data is not None and self.mirror:
+            self.mirror.store_details(invoice_id, invoice_data, etag)
+        if invoice_data is not None:
+            self._cache_details(invoice_id, invoice_data)
+        return invoice_data
+
+    @metrics.timed("details")
+    def _fetch_invoice_details(self, invoice_id, etag=None):
+        """
+        Interroge l'API Sellsy pour les détails d'une facture
+        
+        Returns:
+            (détails, ETag), (NOT_MODIFIED, etag) si la version connue est à jour, (None, None) en cas d'échec
+        """
         token = self.get_access_token()
         headers = {
             "Authorization": f"Bearer {token}",
             "Accept": "application/json"
         }
+        if etag:
+            headers["If-None-Match"] = etag
         
         url = f"{self.api_url}/invoices/{invoice_id}"
-        print(f"🔍 Récupération des détails de la facture {invoice_id}: {url}")
+        logger.debug("🔍 Récupération des détails de la facture %s: %s", invoice_id, url)
         
         max_retries = 3
         retry_count = 0
         
         while retry_count < max_retries:
             try:
-                response = requests.get(url, headers=headers)
+                response = self._request("GET", url, headers=headers)
                 status_code = response.status_code
-                print(f"📊 Statut: {status_code}")
+                logger.debug("📊 Statut: %s", status_code)
                 
                 if status_code == 200:
                     data = response.json()
                     # Vérifier le format de la réponse
                     if "data" in data:
-                        print(f"✅ Détails de la facture {invoice_id} récupérés (format avec data)")
+                        logger.debug("✅ Détails de la facture %s récupérés (format avec data)", invoice_id)
                         invoice_data = data.get("data", {})
                     else:
-                        print(f"✅ Détails de la facture {invoice_id} récupérés (format direct)")
+                        logger.debug("✅ Détails de la facture %s récupérés (format direct)", invoice_id)
                         invoice_data = data
 
                     # S'assurer que l'ID est présent dans les détails
                     if "id" not in invoice_data:
-                        print(f"⚠️ L'ID est manquant dans les détails, ajout de l'ID depuis la requête")
+                        logger.debug("⚠️ L'ID est manquant dans les détails, ajout de l'ID depuis la requête")
                         invoice_data["id"] = invoice_id
 
-                    return invoice_data
+                    return invoice_data, response.headers.get("ETag")
+                
+                elif status_code == 304:
+                    return NOT_MODIFIED, etag
                 
                 elif status_code == 401:
                     # Renouveler le token et réessayer
-                    print("🔄 Token expiré, renouvellement...")
-                    self.token_expires_at = 0
-                    token = self.get_access_token()
+                    logger.info("🔄 Token expiré, renouvellement...")
+                    token = self.get_access_token(stale_token=token)
                     headers["Authorization"] = f"Bearer {token}"
                     retry_count += 1
+                    metrics.count_retry("sellsy", 401)
                 
                 elif status_code == 404:
-                    print(f"❌ Facture {invoice_id} non trouvée (404)")
-                    return None
+                    logger.error("❌ Facture %s non trouvée (404)", invoice_id)
+                    return None, None
+                
+                elif status_code == 429:
+                    # Rate limiting - le limiteur a été suspendu selon Retry-After
+                    retry_count += 1
+                    metrics.count_retry("sellsy", 429)
+                    logger.warning("⚠️ Limitation de débit (429), tentative %s/%s", retry_count, max_retries)
                 
                 else:
-                    print(f"❌ Erreur {status_code}: {response.text}")
+                    logger.error("❌ Erreur %s: %s", status_code, response.text)
                     retry_count += 1
+                    metrics.count_retry("sellsy", status_label(status_code))
                     if retry_count < max_retries:
                         wait_time = 5  # 5 secondes entre les tentatives
-                        print(f"⏱️ Tentative {retry_count}/{max_retries} dans {wait_time} secondes...")
+                        logger.warning("⏱️ Tentative %s/%s dans %s secondes...", retry_count, max_retries, wait_time)
                         time.sleep(wait_time)
             
             except Exception as e:
-                print(f"❌ Exception lors de la récupération des détails: {e}")
+                logger.error("❌ Exception lors de la récupération des détails: %s", e)
                 retry_count += 1
+                metrics.count_retry("sellsy", "error")
                 if retry_count < max_retries:
                     wait_time = 5
-                    print(f"⏱️ Tentative {retry_count}/{max_retries} dans {wait_time} secondes...")
+                    logger.warning("⏱️ Tentative %s/%s dans %s secondes...", retry_count, max_retries, wait_time)
                     time.sleep(wait_time)
         
-        print(f"❌ Échec après {max_retries} tentatives pour la facture {invoice_id}")
-        return None
+        logger.error("❌ Échec après %s tentatives pour la facture %s", max_retries, invoice_id)
+        return None, None
     
-    def download_invoice_pdf(self, invoice_id):
-        """Télécharge le PDF d'une facture et retourne le chemin du fichier"""
+    @metrics.timed("pdf")
+    def download_invoice_pdf(self, invoice_id, invoice_details=None, pdf_link=None):
+        """
+        Télécharge le PDF d'une facture et retourne le chemin du fichier
+        
+        Args:
+            invoice_id: ID Sellsy de la facture
+            invoice_details: Détails déjà récupérés (évite un nouvel appel à l'API)
+            pdf_link: Lien PDF direct déjà connu
+        """
         if not invoice_id:
-            print("❌ ID de facture invalide pour le téléchargement du PDF")
+            logger.error("❌ ID de facture invalide pour le téléchargement du PDF")
             return None
         
         # Conversion explicite en string
         invoice_id = str(invoice_id)
         
-        # Définir le chemin du fichier PDF
-        pdf_filename = f"facture_{invoice_id}.pdf"
-        pdf_path = os.path.join(PDF_STORAGE_DIR, pdf_filename)
+        # Un PDF déjà stocké sans validateurs HTTP (ancien téléchargement) est conservé tel quel
+        store_entry = self.pdf_store.get(invoice_id, touch=True)
+        pdf_path = store_entry["path"] if store_entry else None
+        has_file = pdf_path is not None
+        if has_file and not conditional_headers(store_entry):
+            logger.debug("📄 PDF déjà existant pour la facture %s: %s (%s octets)",
+                         invoice_id, pdf_path, store_entry['size'])
+            return pdf_path
         
-        # Vérifier si le fichier existe déjà
-        if os.path.exists(pdf_path):
-            file_size = os.path.getsize(pdf_path)
-            if file_size > 0:
-                print(f"📄 PDF déjà existant pour la facture {invoice_id}: {pdf_path} ({file_size} octets)")
-                return pdf_path
-            else:
-                print(f"⚠️ Fichier PDF existant mais vide, retéléchargement...")
-        
-        # Si non, d'abord récupérer les détails de la facture pour obtenir le lien PDF direct
-        invoice_details = self.get_invoice_details(invoice_id)
-        if not invoice_details:
-            print(f"❌ Impossible de récupérer les détails pour télécharger le PDF")
-            return None
+        # Sinon, utiliser le lien PDF fourni ou celui des détails (récupérés seulement si absents)
+        if not pdf_link:
+            if invoice_details is None:
+                invoice_details = self.get_invoice_details(invoice_id)
+                if not invoice_details:
+                    logger.error("❌ Impossible de récupérer les détails pour télécharger le PDF")
+                    return pdf_path if has_file else None
+            pdf_link = invoice_details.get("pdf_link")
         
-        # Vérifier si le lien PDF est disponible directement dans les détails de la facture
-        pdf_link = invoice_details.get("pdf_link")
         if not pdf_link:
-            print(f"⚠️ Lien PDF non trouvé dans les détails de la facture {invoice_id}")
+            logger.warning("⚠️ Lien PDF non trouvé dans les détails de la facture %s", invoice_id)
             # Essayer l'URL standard quand même
         else:
-            print(f"🔗 Lien PDF trouvé: {pdf_link}")
-        
-        # Méthodes de téléchargement à essayer
-        methods = [
-            {
-                "name": "Lien direct",
-                "url": pdf_link,
-                "headers": {
-                    "Authorization": f"Bearer {self.get_access_token()}",
-                    "Accept": "application/pdf"
-                },
-                "skip_if_none": True  # Ignorer si pdf_link est None
-            },
-            {
-                "name": "API standard",
-                "url": f"{self.api_url}/invoices/{invoice_id}/document",
-                "headers": {
-                    "Authorization": f"Bearer {self.get_access_token()}",
-                    "Accept": "application/pdf"
-                },
-                "skip_if_none": False
-            }
-        ]
+            logger.debug("🔗 Lien PDF trouvé: %s", pdf_link)
+        
+        # Méthodes de téléchargement à essayer (le lien direct est ignoré s'il est absent)
+        methods = [("Lien direct", pdf_link), ("API standard", f"{self.api_url}/invoices/{invoice_id}/document")]
         
-        # Essayer chaque méthode jusqu'à ce qu'une fonctionne
-        for method in methods:
-            # Vérifier si on doit sauter cette méthode
-            if method["skip_if_none"] and not method["url"]:
+        for name, url in methods:
+            if not url:
                 continue
-                
-            url = method["url"]
-            name = method["name"]
-            print(f"📥 Téléchargement par {name}: {url}")
             
-            try:
-                response = requests.get(url, headers=method["headers"])
-                status_code = response.status_code
-                print(f"📊 Statut: {status_code}")
-                
-                if status_code == 200:
-                    # Vérifier que c'est bien un PDF
-                    content_type = response.headers.get('Content-Type', '')
-                    content_length = len(response.content)
-                    
-                    if ('pdf' not in content_type.lower() and 
-                        content_length < 1000 and 
-                        not response.content.startswith(b'%PDF')):
-                        print(f"⚠️ Contenu non PDF reçu: {content_type}, taille: {content_length}")
-                        continue
-                    
-                    # Sauvegarder le PDF
-                    with open(pdf_path, 'wb') as f:
-                        f.write(response.content)
-                    
-                    file_size = os.path.getsize(pdf_path)
-                    print(f"✅ PDF téléchargé avec succès: {pdf_path} ({file_size} octets)")
-                    return pdf_path
-                
-                elif status_code == 401:
-                    # Renouveler le token et réessayer une fois
-                    print("🔄 Token expiré, renouvellement...")
-                    self.token_expires_at = 0
-                    new_token = self.get_access_token()
-                    method["headers"]["Authorization"] = f"Bearer {new_token}"
-                    
-                    # Nouvel essai avec le token renouvelé
-                    response = requests.get(url, headers=method["headers"])
-                    if response.status_code == 200:
-                        with open(pdf_path, 'wb') as f:
-                            f.write(response.content)
-                        file_size = os.path.getsize(pdf_path)
-                        print(f"✅ PDF téléchargé après renouvellement: {pdf_path} ({file_size} octets)")
-                        return pdf_path
-                
-                print(f"❌ Échec du téléchargement par {name}: {status_code}")
-                
-            except Exception as e:
-                print(f"❌ Exception lors du téléchargement par {name}: {e}")
-        
-        # Si toutes les méthodes ont échoué, créer un fichier vide
-        print("❌ Toutes les méthodes de téléchargement ont échoué")
-        with open(pdf_path, 'w') as f:
-            f.write("")
-        print(f"⚠️ Fichier vide créé: {pdf_path}")
-        return pdf_path
+            # GET conditionnel si le fichier local provient de cette même URL
+            headers = {"Accept": "application/pdf"}
+            if has_file and store_entry.get("url") == url:
+                headers.update(conditional_headers(store_entry))
+            
+            logger.debug("📥 Téléchargement par %s: %s", name, url)
+            token = self.get_access_token()
+            for attempt in range(2):
+                headers["Authorization"] = f"Bearer {token}"
+                try:
+                    with self._request("GET", url, headers=headers, stream=True) as response:
+                        status_code = response.status_code
+                        logger.debug("📊 Statut: %s", status_code)
+                        
+                        if status_code == 304:
+                            logger.debug("📄 PDF inchangé pour la facture %s: %s", invoice_id, pdf_path)
+                            return pdf_path
+                        
+                        if status_code == 200:
+                            pdf_path, file_size = self.pdf_store.save_response(invoice_id, response, url=url)
+                            logger.debug("✅ PDF téléchargé avec succès: %s (%s octets)", pdf_path, file_size)
+                            return pdf_path
+                        
+                        if status_code == 401 and attempt == 0:
+                            # Renouveler le token et réessayer une fois
+                            logger.info("🔄 Token expiré, renouvellement...")
+                            token = self.get_access_token(stale_token=token)
+                            metrics.count_retry("sellsy", 401)
+                            continue
+                        
+                        logger.error("❌ Échec du téléchargement par %s: %s", name, status_code)
+                except PdfDownloadError as e:
+                    logger.warning("⚠️ Téléchargement par %s rejeté: %s", name, e)
+                except Exception as e:
+                    logger.error("❌ Exception lors du téléchargement par %s: %s", name, e)
+                break
+        
+        # Aucun fichier vide n'est créé: un échec reste distinguable d'un PDF valide
+        logger.error("❌ Toutes les méthodes de téléchargement ont échoué")
+        if has_file:
+            logger.warning("⚠️ Conservation de la version précédente: %s", pdf_path)
+            return pdf_path
+        return None
+
+    def prefetch_pdfs(self, invoices, workers=SYNC_PDF_WORKERS):
+        """
+        Télécharge en parallèle les PDF absents du magasin (par exemple pour préparer
+        un cache CI). Retourne le nombre de PDF téléchargés.
+        """
+        invoices_by_id = {str(invoice["id"]): invoice for invoice in invoices if invoice.get("id")}
+        missing_ids = self.pdf_store.missing(invoices_by_id)
+        logger.info("📥 Préchargement de %s PDF absents du magasin (%s factures)", len(missing_ids), len(invoices_by_id))
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            results = executor.map(
+                # Les données de liste ne sont réutilisées que si elles contiennent le lien PDF
+                lambda invoice_id: self.download_invoice_pdf(
+                    invoice_id, pdf_link=invoices_by_id[invoice_id].get("pdf_link")
+                ),
+                missing_ids
+            )
+            downloaded = sum(1 for pdf_path in results if pdf_path)
+        
+        logger.info("✅ %s/%s PDF préchargés", downloaded, len(missing_ids))
+        return downloaded
@@ -0,0 +1,215 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from config import SYNC_JOURNAL_DB, SYNC_JOURNAL_KEEP_DAYS
+
+logger = logging.getLogger("sync_journal")
+
+
+class SyncJournal:
+    """
+    Journal de reprise des synchronisations (SQLite en mode WAL).
+
+    Chaque run enregistre ses paramètres (commande, filtres, limite), le curseur de
+    listing (offset de la prochaine page à demander), les pages en échec et, pour
+    chaque facture listée, son état: pending, done ou failed (avec l'étape et l'erreur).
+    Un run interrompu est repris par `main.py sync --resume <run-id>`: seules les
+    factures non terminées et la suite de la liste sont traitées.
+    """
+
+    def __init__(self, path=SYNC_JOURNAL_DB):
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS runs (
+                    run_id TEXT PRIMARY KEY,
+                    command TEXT,
+                    params TEXT,
+                    status TEXT,
+                    listing_offset INTEGER DEFAULT 0,
+                    listing_done INTEGER DEFAULT 0,
+                    listing_truncated INTEGER DEFAULT 0,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            columns = {row["name"] for row in self.db.execute("PRAGMA table_info(runs)")}
+            if "listing_truncated" not in columns:
+                # Base créée par une version précédente
+                self.db.execute("ALTER TABLE runs ADD COLUMN listing_truncated INTEGER DEFAULT 0")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS run_invoices (
+                    run_id TEXT,
+                    invoice_id TEXT,
+                    state TEXT,
+                    stage TEXT,
+                    error TEXT,
+                    payload TEXT,
+                    updated_at REAL,
+                    PRIMARY KEY (run_id, invoice_id)
+                )
+            """)
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS run_pages (
+                    run_id TEXT,
+                    page_offset INTEGER,
+                    error TEXT,
+                    attempts INTEGER DEFAULT 1,
+                    PRIMARY KEY (run_id, page_offset)
+                )
+            """)
+
+    @property
+    def run(self):
+        """Ligne du run courant (paramètres décodés)"""
+        row = self.db.execute("SELECT * FROM runs WHERE run_id = ?", (self.run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run["params"] = json.loads(run["params"] or "{}")
+        return run
+
+    def start_run(self, command, params):
+        """Crée un nouveau run et retourne son identifiant"""
+        self.purge()
+        self.run_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        with self._lock, self.db:
+            self.db.execute("INSERT INTO runs (run_id, command, params, status, started_at) VALUES (?, ?, ?, ?, ?)",
+                            (self.run_id, command, json.dumps(params, default=str), "running", time.time()))
+        logger.info("📓 Run %s (%s) démarré", self.run_id, command)
+        return self.run_id
+
+    def resume_run(self, run_id):
+        """Reprend un run existant; retourne sa ligne, ou None s'il est inconnu"""
+        self.run_id = run_id
+        run = self.run
+        if run is None:
+            self.run_id = None
+            return None
+        if run["status"] == "completed":
+            return run
+        counts = self.counts()
+        logger.info("📓 Reprise du run %s (%s): %s facture(s) terminée(s), %s à reprendre, %s page(s) en échec%s",
+                    run_id, run["command"], counts.get("done", 0), counts.get("pending", 0) + counts.get("failed", 0),
+                    len(self.failed_pages()), "" if run["listing_done"] else f", liste à reprendre à l'offset "
+                    f"{run['listing_offset']}")
+        with self._lock, self.db:
+            self.db.execute("UPDATE runs SET status = 'running', finished_at = NULL WHERE run_id = ?", (run_id,))
+        return run
+
+    def recent_runs(self, limit=10):
+        """Derniers runs (du plus récent au plus ancien)"""
+        rows = self.db.execute("SELECT run_id, command, status, started_at FROM runs ORDER BY started_at DESC LIMIT ?",
+                               (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def record_page(self, offset, invoices, next_offset=None):
+        """Enregistre une page de liste reçue: factures à traiter et avancée du curseur de listing"""
+        now = time.time()
+        rows = [(self.run_id, str(invoice["id"]), "pending", "liste", json.dumps(invoice, default=str), now)
+                for invoice in invoices if invoice.get("id")]
+        with self._lock, self.db:
+            self.db.executemany("""
+                INSERT OR IGNORE INTO run_invoices (run_id, invoice_id, state, stage, payload, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            self.db.execute("DELETE FROM run_pages WHERE run_id = ? AND page_offset = ?", (self.run_id, offset))
+            if next_offset is not None:
+                self.db.execute("UPDATE runs SET listing_offset = MAX(listing_offset, ?) WHERE run_id = ?",
+                                (next_offset, self.run_id))
+
+    def record_failed_page(self, offset, error, next_offset=None):
+        """Enregistre une page de liste en échec (elle sera redemandée)"""
+        with self._lock, self.db:
+            self.db.execute("""
+                INSERT INTO run_pages (run_id, page_offset, error) VALUES (?, ?, ?)
+                ON CONFLICT(run_id, page_offset) DO UPDATE SET
+                    error = excluded.error,
+                    attempts = run_pages.attempts + 1
+            """, (self.run_id, offset, str(error)))
+            if next_offset is not None:
+                self.db.execute("UPDATE runs SET listing_offset = MAX(listing_offset, ?) WHERE run_id = ?",
+                                (next_offset, self.run_id))
+
+    def failed_pages(self):
+        """Offsets des pages de liste en échec"""
+        rows = self.db.execute("SELECT page_offset FROM run_pages WHERE run_id = ? ORDER BY page_offset",
+                               (self.run_id,)).fetchall()
+        return [row["page_offset"] for row in rows]
+
+    def set_listing_done(self, done, truncated=False):
+        """Note la fin du listing du run; truncated: arrêté par la limite, des factures plus anciennes restent"""
+        with self._lock, self.db:
+            self.db.execute("UPDATE runs SET listing_done = ?, listing_truncated = ? WHERE run_id = ?",
+                            (1 if done else 0, 1 if truncated else 0, self.run_id))
+
+    def mark_done(self, invoice_ids, stage="airtable"):
+        """Marque des factures comme synchronisées"""
+        now = time.time()
+        with self._lock, self.db:
+            self.db.executemany("""
+                UPDATE run_invoices SET state = 'done', stage = ?, error = NULL, updated_at = ?
+                WHERE run_id = ? AND invoice_id = ?
+            """, [(stage, now, self.run_id, str(invoice_id)) for invoice_id in invoice_ids])
+
+    def mark_failed(self, invoice_id, stage, error):
+        """Marque une facture en échec à une étape (elle sera reprise)"""
+        with self._lock, self.db:
+            self.db.execute("""
+                UPDATE run_invoices SET state = 'failed', stage = ?, error = ?, updated_at = ?
+                WHERE run_id = ? AND invoice_id = ? AND state != 'done'
+            """, (stage, str(error), time.time(), self.run_id, str(invoice_id)))
+
+    def done_ids(self):
+        rows = self.db.execute("SELECT invoice_id FROM run_invoices WHERE run_id = ? AND state = 'done'",
+                               (self.run_id,)).fetchall()
+        return {row["invoice_id"] for row in rows}
+
+    def pending_invoices(self):
+        """Factures listées mais pas encore synchronisées (en attente ou en échec), telles que listées"""
+        rows = self.db.execute("SELECT payload FROM run_invoices WHERE run_id = ? AND state != 'done'",
+                               (self.run_id,)).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
+
+    def iter_listed(self):
+        """Toutes les factures listées par le run (pour le curseur des synchronisations incrémentales)"""
+        for row in self.db.execute("SELECT payload FROM run_invoices WHERE run_id = ?", (self.run_id,)):
+            yield json.loads(row["payload"])
+
+    def counts(self):
+        """Nombre de factures du run par état"""
+        rows = self.db.execute("SELECT state, COUNT(*) AS n FROM run_invoices WHERE run_id = ? GROUP BY state",
+                               (self.run_id,)).fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+    def finish_run(self, complete):
+        """Clôt le run: completed si tout est synchronisé, incomplete sinon (il peut être repris)"""
+        status = "completed" if complete else "incomplete"
+        with self._lock, self.db:
+            self.db.execute("UPDATE runs SET status = ?, finished_at = ? WHERE run_id = ?",
+                            (status, time.time(), self.run_id))
+        return status
+
+    def purge(self, keep_days=SYNC_JOURNAL_KEEP_DAYS):
+        """Supprime les runs clos depuis plus de keep_days jours"""
+        if keep_days <= 0:
+            return
+        cutoff = time.time() - keep_days * 86400
+        with self._lock, self.db:
+            old_runs = [row["run_id"] for row in self.db.execute(
+                "SELECT run_id FROM runs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))]
+            for table in ("run_invoices", "run_pages", "runs"):
+                self.db.executemany(f"DELETE FROM {table} WHERE run_id = ?", [(run_id,) for run_id in old_runs])
+
+    def close(self):
+        self.db.close()
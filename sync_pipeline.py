@@ -0,0 +1,257 @@
+import logging
+import queue
+import threading
+import time
+from airtable_api import AirtableBatchWriter
+from dead_letter import DeadLetterStore
+from sellsy_api import is_complete_invoice
+from config import SYNC_FETCH_WORKERS, SYNC_PDF_WORKERS, SYNC_WRITE_WORKERS, SYNC_QUEUE_SIZE, DEAD_LETTER_DB
+
+logger = logging.getLogger("sync_pipeline")
+
+# Marqueur de fin de flux transmis d'une étape à la suivante
+_STOP = object()
+
+
+class SyncPipeline:
+    """
+    Pipeline de synchronisation Sellsy -> Airtable en trois étapes concurrentes:
+    récupération des détails (+ formatage), téléchargement du PDF, écriture Airtable.
+
+    Les étapes sont reliées par des files bornées: la mémoire reste constante
+    quel que soit le nombre de factures, et le débit n'est limité que par les API.
+    """
+
+    def __init__(self, sellsy, airtable, fetch_workers=SYNC_FETCH_WORKERS, pdf_workers=SYNC_PDF_WORKERS,
+                 write_workers=SYNC_WRITE_WORKERS, queue_size=SYNC_QUEUE_SIZE, journal=None, dead_letters=None,
+                 require_details=False, refresh_details=False):
+        self.sellsy = sellsy
+        self.airtable = airtable
+        # Journal de reprise (SyncJournal): état de chaque facture, terminée ou en échec
+        self.journal = journal
+        # Factures en échec (DeadLetterStore, désactivé si DEAD_LETTER_DB est vide)
+        if dead_letters is None and DEAD_LETTER_DB:
+            dead_letters = DeadLetterStore()
+        self.dead_letters = dead_letters
+        # Sans détails Sellsy, échouer au lieu d'écrire les données de base (nouvelles tentatives)
+        self.require_details = require_details
+        # Relire les détails chez Sellsy sans passer par le cache ni un miroir frais (nouvelles tentatives)
+        self.refresh_details = refresh_details
+        self.fetch_workers = max(1, fetch_workers)
+        self.pdf_workers = max(1, pdf_workers)
+        self.write_workers = max(1, write_workers)
+        self.queue_size = max(1, queue_size)
+
+        self.writers = []
+        self.errors = []  # Liste de {"id", "stage", "error"}
+        self.processed_count = 0
+        self.invalid_count = 0  # Factures de la liste sans ID, ignorées
+        self.total = None
+        self._pdf_failed = set()  # Factures écrites sans leur PDF (restent en échec)
+        self._written_ids = set()  # Factures confirmées par Airtable
+        self._lock = threading.Lock()
+
+    def run(self, invoices, total=None):
+        """Traite les factures (liste ou itérable) et retourne le bilan de la synchronisation"""
+        if total is None and hasattr(invoices, "__len__"):
+            total = len(invoices)
+        self.total = total
+
+        start_time = time.time()
+        fetch_queue = queue.Queue(maxsize=self.queue_size)
+        pdf_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        logger.info("🚀 Pipeline: %s worker(s) détails, %s worker(s) PDF, %s worker(s) Airtable (files de %s)",
+                    self.fetch_workers, self.pdf_workers, self.write_workers, self.queue_size)
+
+        self.writers = [AirtableBatchWriter(self.airtable, on_written=self._on_written)
+                        for _ in range(self.write_workers)]
+
+        threads = []
+        threads += self._start_stage("détails", self._fetch_stage, fetch_queue, pdf_queue,
+                                     self.fetch_workers, self.pdf_workers)
+        threads += self._start_stage("pdf", self._pdf_stage, pdf_queue, write_queue,
+                                     self.pdf_workers, self.write_workers)
+        for writer in self.writers:
+            thread = threading.Thread(target=self._write_worker, args=(write_queue, writer), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+        # Alimentation de la première étape (bloque si la file est pleine). Si la source lève
+        # (pagination en échec), les factures déjà reçues sont terminées avant de propager l'erreur
+        try:
+            for invoice in invoices:
+                if not invoice.get("id"):
+                    # Rien à journaliser ni à retraiter sans ID: la facture est seulement signalée
+                    self.invalid_count += 1
+                    logger.warning("⚠️ Facture sans ID ignorée - Clés: %s", list(invoice))
+                    continue
+                fetch_queue.put(invoice)
+        finally:
+            for _ in range(self.fetch_workers):
+                fetch_queue.put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        return self._summary(time.time() - start_time)
+
+    def _start_stage(self, name, handler, in_queue, out_queue, workers, next_workers):
+        """Démarre les workers d'une étape; le dernier à terminer propage la fin à l'étape suivante"""
+        remaining = [workers]
+
+        def worker():
+            while True:
+                item = in_queue.get()
+                if item is _STOP:
+                    break
+                result = self._safe_call(name, handler, item)
+                if result is not None:
+                    out_queue.put(result)
+
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                for _ in range(next_workers):
+                    out_queue.put(_STOP)
+
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _safe_call(self, stage, handler, item):
+        """Exécute une étape en isolant les erreurs de chaque facture"""
+        try:
+            return handler(item)
+        except Exception as e:
+            invoice_id = item.get("id")
+            logger.error("❌ Erreur à l'étape %s pour la facture %s: %s", stage, invoice_id, e)
+            # Instantané: la facture listée, ou ses détails une fois récupérés
+            self._record_error(invoice_id, stage, e, payload=item.get("details", item))
+            return None
+
+    def _record_error(self, invoice_id, stage, error, payload=None, error_class=None):
+        with self._lock:
+            self.errors.append({"id": str(invoice_id), "stage": stage, "error": str(error)})
+        if self.journal:
+            self.journal.mark_failed(invoice_id, stage, error)
+        if self.dead_letters:
+            self.dead_letters.add(invoice_id, stage, error, payload, error_class)
+
+    def _on_written(self, invoice_ids):
+        """Factures confirmées par Airtable: comptées, terminées dans le journal, résolues si leur PDF a été obtenu"""
+        with self._lock:
+            self._written_ids.update(invoice_ids)
+            self.processed_count += len(invoice_ids)
+            processed = self.processed_count
+        progress = f"{processed}/{self.total}" if self.total else str(processed)
+        logger.debug("✅ %s facture(s) écrite(s) dans Airtable (%s).", len(invoice_ids), progress)
+        if self.journal:
+            self.journal.mark_done(invoice_ids)
+        if self.dead_letters:
+            self.dead_letters.resolve([invoice_id for invoice_id in invoice_ids if invoice_id not in self._pdf_failed])
+
+    def _fetch_stage(self, invoice):
+        """Récupère les détails complets de la facture (si la liste ne suffit pas) et les formate pour Airtable"""
+        invoice_id = str(invoice["id"])
+        if is_complete_invoice(invoice) and not self.refresh_details:
+            # La page de liste (recherche avec projection) contient déjà les champs utiles
+            invoice_details = invoice
+        else:
+            invoice_details = self.sellsy.get_invoice_details(invoice_id, use_cache=not self.refresh_details)
+        if not invoice_details:
+            if self.require_details:
+                raise RuntimeError("détails Sellsy indisponibles")
+            logger.warning("⚠️ Impossible de récupérer les détails de la facture %s - utilisation des données de base",
+                           invoice_id)
+        source_data = invoice_details if invoice_details else invoice
+
+        formatted_invoice = self.airtable.format_invoice_for_airtable(source_data)
+        if not formatted_invoice:
+            logger.warning("⚠️ La facture %s n'a pas pu être formatée correctement", invoice_id)
+            self._record_error(invoice_id, "format", ValueError("formatage impossible"), payload=source_data)
+            return None
+
+        return {"id": invoice_id, "invoice": invoice, "details": source_data, "formatted": formatted_invoice}
+
+    def _pdf_stage(self, item):
+        """Télécharge le PDF de la facture"""
+        # Les détails déjà récupérés fournissent le lien PDF: pas de second appel à Sellsy
+        item["pdf_path"] = self.sellsy.download_invoice_pdf(item["id"], invoice_details=item["details"])
+        if item["pdf_path"] is None and self.dead_letters:
+            # La facture est tout de même écrite; elle reste en échec jusqu'à l'obtention du PDF
+            with self._lock:
+                self._pdf_failed.add(item["id"])
+            self.dead_letters.add(item["id"], "pdf", "téléchargement du PDF impossible", payload=item["details"],
+                                  error_class="PdfDownloadError")
+        return item
+
+    def _write_worker(self, write_queue, writer):
+        """Ajoute les factures au lot d'écriture Airtable du worker"""
+        accepted = {}  # ID -> détails des factures confiées au writer, pour les erreurs
+        while True:
+            item = write_queue.get()
+            if item is _STOP:
+                break
+            try:
+                writer.add(item["formatted"], item.get("pdf_path"))
+                accepted[item["id"]] = item["details"]
+                if len(accepted) > 2 * writer.batch_size:
+                    # Mémoire bornée: ne garder que les factures encore en attente d'écriture
+                    reported = {str(entry["ID_Facture"]) for entry in writer.errors}
+                    with self._lock:
+                        accepted = {invoice_id: details for invoice_id, details in accepted.items()
+                                    if invoice_id not in self._written_ids and invoice_id not in reported}
+            except Exception as e:
+                if item["id"] in writer.pending:
+                    # Ajoutée au lot avant l'échec de l'envoi: elle partira avec le prochain
+                    accepted[item["id"]] = item["details"]
+                else:
+                    logger.error("❌ Erreur à l'étape airtable pour la facture %s: %s", item['id'], e)
+                    self._record_error(item["id"], "airtable", e, payload=item["details"])
+                # Le lot en cours d'envoi a été retiré du writer sans être écrit
+                self._record_unwritten(writer, accepted, e, keep_pending=True)
+
+        try:
+            writer.flush()
+        except Exception as e:
+            self._record_unwritten(writer, accepted, e)
+
+    def _record_unwritten(self, writer, accepted, error, keep_pending=False):
+        """Met en échec les factures confiées au writer qui n'ont été ni écrites ni signalées en erreur"""
+        reported = {str(entry["ID_Facture"]) for entry in writer.errors}
+        if keep_pending:
+            reported.update(writer.pending)
+        with self._lock:
+            unwritten = [invoice_id for invoice_id in accepted
+                         if invoice_id not in self._written_ids and invoice_id not in reported]
+        for invoice_id in unwritten:
+            logger.error("❌ Erreur à l'étape airtable pour la facture %s: %s", invoice_id, error)
+            self._record_error(invoice_id, "airtable", error, payload=accepted.pop(invoice_id))
+
+    def _summary(self, elapsed):
+        """Agrège le bilan des workers d'écriture"""
+        created = sum(writer.created_count for writer in self.writers)
+        updated = sum(writer.updated_count for writer in self.writers)
+        skipped = sum(writer.skipped_count for writer in self.writers)
+        for writer in self.writers:
+            writer.report()
+            for error in writer.errors:
+                self._record_error(error["ID_Facture"], "airtable", error["error"], payload=error.get("fields"),
+                                   error_class=error.get("error_class"))
+
+        rate = self.processed_count / elapsed if elapsed > 0 else 0
+        logger.info("⏱️ %s facture(s) traitée(s) en %.1f s (%.2f factures/s)", self.processed_count, elapsed, rate)
+        if self.invalid_count:
+            logger.warning("⚠️ %s facture(s) sans ID ignorée(s)", self.invalid_count)
+        return {
+            "processed": self.processed_count,
+            "created": created,
+            "updated": updated,
+            "skipped": skipped,
+            "invalid": self.invalid_count,
+            "errors": list(self.errors),
+            "elapsed": elapsed,
+        }
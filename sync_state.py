@@ -0,0 +1,114 @@
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from config import SYNC_STATE_FILE
+
+logger = logging.getLogger("sync_state")
+
+# Champs de date utilisés pour le curseur, du plus au moins pertinent
+CURSOR_DATE_FIELDS = ["updated", "updated_at", "created", "created_at", "date"]
+
+
+def invoice_cursor(invoice):
+    """Retourne le curseur (horodatage, ID) d'une facture Sellsy, ou None si aucune date"""
+    for field in CURSOR_DATE_FIELDS:
+        if invoice.get(field):
+            return {"timestamp": str(invoice[field]), "id": str(invoice.get("id", ""))}
+    return None
+
+
+def _parse_timestamp(value):
+    """Horodatage ISO en datetime (UTC si le fuseau n'est pas précisé), ou None s'il est illisible"""
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def _cursor_key(cursor):
+    """
+    Clé de comparaison d'un curseur, ou None si son horodatage est illisible. Les dates
+    sont comparées en datetime: Sellsy ne renvoie pas toujours le même format
+    (fuseau, secondes fractionnaires), ce qui fausse une comparaison de chaînes.
+    """
+    timestamp = _parse_timestamp(cursor.get("timestamp", ""))
+    if timestamp is None:
+        return None
+    # Les ID Sellsy sont numériques: les comparer comme des nombres quand c'est possible
+    invoice_id = cursor.get("id", "")
+    return (timestamp, int(invoice_id) if invoice_id.isdigit() else 0, invoice_id)
+
+
+def is_after_cursor(invoice, cursor):
+    """Indique si la facture est postérieure au curseur (les factures sans date lisible sont conservées)"""
+    if not cursor:
+        return True
+    current = invoice_cursor(invoice)
+    if not current:
+        return True
+    current_key, cursor_key = _cursor_key(current), _cursor_key(cursor)
+    if current_key is None or cursor_key is None:
+        return True
+    return current_key > cursor_key
+
+
+def max_cursor(invoices, cursor=None):
+    """Retourne le curseur le plus récent entre celui fourni et ceux des factures"""
+    best = cursor
+    best_key = _cursor_key(cursor) if cursor else None
+    for invoice in invoices:
+        current = invoice_cursor(invoice)
+        current_key = _cursor_key(current) if current else None
+        if current_key is not None and (best_key is None or current_key > best_key):
+            best, best_key = current, current_key
+    return best
+
+
+class SyncState:
+    """État persistant des synchronisations (curseur de la dernière synchronisation réussie)"""
+
+    def __init__(self, path=SYNC_STATE_FILE):
+        self.path = path
+        self.data = self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("⚠️ État de synchronisation illisible (%s): %s, synchronisation complète", self.path, e)
+            return {}
+
+    def get_cursor(self, name):
+        """Retourne le curseur enregistré pour une synchronisation, ou None"""
+        return self.data.get(name, {}).get("cursor")
+
+    def save_cursor(self, name, cursor):
+        """Enregistre le curseur d'une synchronisation réussie (écriture atomique)"""
+        self.data[name] = {"cursor": cursor, "saved_at": datetime.now().isoformat()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logger.info("💾 Curseur de synchronisation '%s' enregistré: %s", name, cursor)
+
+
+class CursorTracker:
+    """Enveloppe un flux de factures pour compter les éléments et suivre le curseur le plus récent"""
+
+    def __init__(self, invoices, cursor=None):
+        self.invoices = invoices
+        self.cursor = cursor
+        self.count = 0
+
+    def __iter__(self):
+        for invoice in self.invoices:
+            self.count += 1
+            self.cursor = max_cursor([invoice], self.cursor)
+            yield invoice
@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+# Configuration factice et bases dans un répertoire temporaire: config.py est lu à l'import
+_WORK_DIR = tempfile.mkdtemp(prefix="sellsy-airtable-tests-")
+os.environ.update({
+    "SELLSY_CLIENT_ID": "test-client",
+    "SELLSY_CLIENT_SECRET": "test-secret",
+    "AIRTABLE_API_KEY": "test-key",
+    "AIRTABLE_BASE_ID": "appTest",
+    "AIRTABLE_TABLE_NAME": "Factures",
+    "SELLSY_TOKEN_CACHE_FILE": "",
+    "SELLSY_MIRROR_DB": "",
+    "PDF_STORAGE_DIR": os.path.join(_WORK_DIR, "pdf_invoices"),
+    "WEBHOOK_QUEUE_DB": os.path.join(_WORK_DIR, "webhook_queue.sqlite"),
+    "SYNC_JOURNAL_DB": os.path.join(_WORK_DIR, "sync_journal.sqlite"),
+    "DEAD_LETTER_DB": "",
+    "SYNC_STATE_FILE": os.path.join(_WORK_DIR, "sync_state.json"),
+})
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
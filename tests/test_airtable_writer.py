@@ -0,0 +1,51 @@
+from airtable_api import AirtableAPI, AirtableBatchWriter
+
+
+class FakeTable:
+    """Table Airtable en mémoire dont les écritures par lot échouent"""
+
+    def __init__(self):
+        self.records = {}
+
+    def batch_upsert(self, records, key_fields=None):
+        raise RuntimeError("INVALID_VALUE_FOR_COLUMN")
+
+    def create(self, fields):
+        record_id = f"rec{len(self.records) + 1}"
+        self.records[record_id] = dict(fields)
+        return {"id": record_id, "fields": dict(fields)}
+
+    def update(self, record_id, fields):
+        self.records[record_id].update(fields)
+        return {"id": record_id, "fields": self.records[record_id]}
+
+
+def make_api():
+    api = AirtableAPI()
+    api.table = FakeTable()
+    api.index = {}
+    return api
+
+
+def invoice(invoice_id, amount):
+    return {"ID_Facture": invoice_id, "Numéro": f"F-{invoice_id}", "Montant_HT": amount}
+
+
+def test_fallback_counts_actual_outcomes():
+    api = make_api()
+    for invoice_id, amount in (("1", 10.0), ("2", 20.0)):
+        record = api.table.create(invoice(invoice_id, amount))
+        api.index[invoice_id] = record
+
+    written = []
+    writer = AirtableBatchWriter(api, on_written=written.extend)
+    writer.pending = {
+        "1": invoice("1", 10.0),   # identique: ignorée
+        "2": invoice("2", 25.0),   # modifiée
+        "3": invoice("3", 30.0),   # nouvelle
+    }
+    writer.flush()
+
+    assert (writer.created_count, writer.updated_count, writer.skipped_count) == (1, 1, 1)
+    assert sorted(written) == ["1", "2", "3"]
+    assert writer.errors == []
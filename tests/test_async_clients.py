@@ -0,0 +1,27 @@
+import asyncio
+
+import httpx
+import pytest
+
+import rate_limiter
+from async_clients import AsyncAirtableAPI
+
+
+def test_airtable_request_raises_after_persistent_429(monkeypatch):
+    # Limiteurs neufs: chaque 429 divise le débit de l'hôte par deux
+    monkeypatch.setattr(rate_limiter, "_limiters", {})
+    calls = []
+
+    def respond(request):
+        calls.append(request)
+        return httpx.Response(429, headers={"Retry-After": "0"})
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(respond)) as client:
+            airtable = AsyncAirtableAPI(client)
+            airtable.MAX_RETRIES = 2
+            await airtable.find_invoice_by_id("42")
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(scenario())
+    assert len(calls) == 2
@@ -0,0 +1,48 @@
+import time
+
+from dead_letter import DeadLetterStore
+
+
+def make_store(tmp_path, **kwargs):
+    return DeadLetterStore(str(tmp_path / "dead_letter.sqlite"), **kwargs)
+
+
+def test_attempts_are_delayed_exponentially(tmp_path):
+    store = make_store(tmp_path, max_attempts=5, base_delay=10)
+    store.add("1", "pdf", RuntimeError("timeout"), payload={"id": "1"})
+    assert [entry["invoice_id"] for entry in store.due()] == ["1"]
+
+    for attempt, delay in enumerate((10, 20, 40), start=1):
+        entry = store.entries()[0]
+        before = time.time()
+        store.begin_attempt([entry])
+        entry = store.entries()[0]
+        assert entry["attempts"] == attempt
+        # Gigue de ±20 % autour du délai exponentiel
+        assert before + delay * 0.8 <= entry["next_attempt_at"] <= time.time() + delay * 1.2
+        assert store.due() == []
+
+
+def test_entry_is_abandoned_after_max_attempts(tmp_path):
+    store = make_store(tmp_path, max_attempts=2, base_delay=0)
+    store.add("1", "détails", "introuvable")
+    store.begin_attempt(store.due())
+    store.begin_attempt(store.due())
+
+    assert store.due() == []
+    assert store.next_due_at() is None
+    assert store.counts() == {"pending": 0, "abandoned": 1, "resolved": 0}
+
+
+def test_failure_after_resolution_starts_over(tmp_path):
+    store = make_store(tmp_path, max_attempts=5, base_delay=10)
+    store.add("1", "pdf", "timeout")
+    store.begin_attempt(store.due())
+    store.resolve(["1"])
+    assert store.counts()["resolved"] == 1
+
+    store.add("1", "airtable", ValueError("champ invalide"))
+    entry = store.entries()[0]
+    assert entry["attempts"] == 0
+    assert entry["error_class"] == "ValueError"
+    assert store.due()[0]["invoice_id"] == "1"
@@ -0,0 +1,83 @@
+import os
+
+from async_clients import AsyncSellsyAPI
+from pdf_store import PdfStore
+from sellsy_api import SellsyAPI
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+        self.headers = {"Content-Type": "application/pdf", "Content-Length": str(len(body))}
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+
+def pdf(fill, size=1000):
+    return b"%PDF" + fill * (size - 4)
+
+
+def stored_ids(store):
+    return sorted(row["invoice_id"] for row in store.db.execute("SELECT invoice_id FROM pdfs"))
+
+
+def test_identical_pdfs_share_one_object(tmp_path):
+    store = PdfStore(str(tmp_path))
+    path_1, _ = store.save_response("1", FakeResponse(pdf(b"a")))
+    path_2, _ = store.save_response("2", FakeResponse(pdf(b"a")))
+
+    assert path_1 == path_2
+    assert store.total_size() == 1000
+
+
+def test_least_recently_used_pdfs_are_evicted(tmp_path):
+    store = PdfStore(str(tmp_path), max_bytes=2500)
+    path_1, _ = store.save_response("1", FakeResponse(pdf(b"a")))
+    store.save_response("2", FakeResponse(pdf(b"b")))
+    store.path_for("1")  # la facture 1 redevient la plus récemment utilisée
+    store.save_response("3", FakeResponse(pdf(b"c")))
+
+    assert stored_ids(store) == ["1", "3"]
+    assert os.path.exists(path_1)
+    assert store.total_size() <= 2500
+
+
+def test_lookup_returns_path_without_writing_when_eviction_is_off(tmp_path):
+    store = PdfStore(str(tmp_path))
+    path, _ = store.save_response("1", FakeResponse(pdf(b"a")))
+    saved_access = store.get("1")["last_access"]
+
+    entry = store.get("1", touch=True)
+    assert entry["path"] == path
+    assert store.path_for("1") == path
+    assert store.db.execute("SELECT last_access FROM pdfs").fetchone()[0] == saved_access
+
+
+def test_committed_pdf_is_never_evicted(tmp_path):
+    store = PdfStore(str(tmp_path), max_bytes=500)
+    path, _ = store.save_response("1", FakeResponse(pdf(b"a")))
+
+    assert stored_ids(store) == ["1"]
+    assert os.path.exists(path)
+
+
+def test_pdf_of_in_flight_download_is_not_evicted(tmp_path):
+    store = PdfStore(str(tmp_path), max_bytes=1500)
+    store.save_response("1", FakeResponse(pdf(b"a")))
+
+    store._begin_download("1")
+    store.save_response("2", FakeResponse(pdf(b"b")))
+    assert stored_ids(store) == ["1", "2"]
+
+    store._end_download("1")
+    store.save_response("3", FakeResponse(pdf(b"c")))
+    assert stored_ids(store) == ["3"]
+
+
+def test_sync_and_async_clients_share_one_store():
+    sellsy = SellsyAPI()
+    async_sellsy = AsyncSellsyAPI()
+
+    assert async_sellsy.pdf_store is sellsy.pdf_store
@@ -0,0 +1,50 @@
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+from urllib3.util.retry import Retry
+
+from rate_limiter import get_rate_limiter, install_rate_limiter
+
+
+def serve(statuses):
+    """Serveur local qui répond successivement les statuts donnés (le dernier ensuite)"""
+    statuses = list(statuses)
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = statuses.pop(0) if len(statuses) > 1 else statuses[0]
+            calls.append(status)
+            self.send_response(status)
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, calls
+
+
+def test_429_reaches_limiter_despite_session_retry():
+    server, calls = serve([429, 200])
+    url = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        session = requests.Session()
+        # Stratégie de retry par défaut de pyairtable: 429 renvoyé par urllib3
+        session.mount(url, requests.adapters.HTTPAdapter(max_retries=Retry(total=5, status_forcelist=(429,))))
+        install_rate_limiter(session, url)
+        limiter = get_rate_limiter(url)
+        rate = limiter.rate
+
+        response = session.get(url)
+    finally:
+        server.shutdown()
+
+    assert response.status_code == 200
+    assert calls == [429, 200]
+    assert limiter.rate < rate
+    assert 429 not in session.get_adapter(url).max_retries.status_forcelist
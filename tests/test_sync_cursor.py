@@ -0,0 +1,80 @@
+import pytest
+
+from sellsy_api import SellsyAPI
+from sync_journal import SyncJournal
+from sync_state import is_after_cursor, max_cursor
+
+TOTAL_INVOICES = 250
+
+
+@pytest.fixture
+def sellsy(monkeypatch):
+    """Client Sellsy dont la liste (du plus récent au plus ancien) est servie localement"""
+    invoices = [{"id": str(TOTAL_INVOICES - index), "created": "2024-01-01T00:00:00+00:00"}
+                for index in range(TOTAL_INVOICES)]
+
+    def fetch_page(self, offset, page_size, filters, max_retries=5, retry_delay=5):
+        return invoices[offset:offset + page_size], {"total": TOTAL_INVOICES, "offset": offset}
+
+    monkeypatch.setattr(SellsyAPI, "_fetch_invoice_page", fetch_page)
+    api = SellsyAPI()
+    yield api
+    api.close()
+
+
+def test_listing_truncated_by_limit_is_not_complete(sellsy):
+    invoices = list(sellsy.iter_invoices(limit=150))
+
+    assert len(invoices) == 150
+    assert sellsy.listing_truncated
+    assert not sellsy.listing_complete
+
+
+def test_full_listing_is_complete(sellsy):
+    invoices = list(sellsy.iter_invoices(limit=1000))
+
+    assert len(invoices) == TOTAL_INVOICES
+    assert sellsy.listing_complete
+    assert not sellsy.listing_truncated
+
+
+def test_limit_equal_to_available_invoices_is_complete(sellsy):
+    invoices = list(sellsy.iter_invoices(limit=TOTAL_INVOICES))
+
+    assert len(invoices) == TOTAL_INVOICES
+    assert sellsy.listing_complete
+    assert not sellsy.listing_truncated
+
+
+def test_limit_on_full_page_boundary_is_truncated(sellsy):
+    list(sellsy.iter_invoices(limit=200))
+
+    assert sellsy.listing_truncated
+    assert not sellsy.listing_complete
+
+
+def test_truncated_listing_is_recorded_in_journal(sellsy, tmp_path):
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"))
+    journal.start_run("sync", {"limit": 100})
+
+    list(sellsy.iter_invoices(limit=100, journal=journal))
+
+    # Le run a terminé sa liste, mais le curseur ne doit pas avancer
+    assert journal.run["listing_done"] == 1
+    assert journal.run["listing_truncated"] == 1
+
+
+def test_cursor_timestamps_compared_as_datetimes():
+    cursor = {"timestamp": "2024-01-01T09:30:00Z", "id": "10"}
+    # 10:00 à Paris (UTC+1) est antérieur à 09:30 UTC, contrairement à l'ordre des chaînes
+    earlier = {"id": "11", "updated": "2024-01-01T10:00:00+01:00"}
+    later = {"id": "12", "updated": "2024-01-01T09:30:00.500000+00:00"}
+
+    assert not is_after_cursor(earlier, cursor)
+    assert is_after_cursor(later, cursor)
+    assert max_cursor([earlier, later], cursor)["id"] == "12"
+
+
+def test_unreadable_timestamp_is_kept():
+    cursor = {"timestamp": "2024-01-01T09:30:00Z", "id": "10"}
+    assert is_after_cursor({"id": "11", "updated": "hier"}, cursor)
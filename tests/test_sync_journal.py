@@ -0,0 +1,56 @@
+from main import _remaining_invoices
+from sync_journal import SyncJournal
+
+
+def listed(*invoice_ids):
+    return [{"id": invoice_id, "created": "2024-01-01T00:00:00+00:00"} for invoice_id in invoice_ids]
+
+
+def test_resume_returns_only_unfinished_invoices(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    journal = SyncJournal(path)
+    run_id = journal.start_run("sync", {"limit": 100})
+    journal.record_page(0, listed("1", "2", "3"), next_offset=100)
+    journal.mark_done(["1"])
+    journal.mark_failed("2", "pdf", "timeout")
+    journal.finish_run(False)
+    journal.close()
+
+    resumed = SyncJournal(path)
+    run = resumed.resume_run(run_id)
+
+    assert run["status"] == "incomplete"
+    assert run["listing_offset"] == 100
+    assert resumed.run["status"] == "running"
+    assert resumed.done_ids() == {"1"}
+    assert sorted(invoice["id"] for invoice in resumed.pending_invoices()) == ["2", "3"]
+
+
+def test_resume_unknown_run(tmp_path):
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"))
+    assert journal.resume_run("inconnu") is None
+    assert journal.run_id is None
+
+
+def test_remaining_invoices_skip_listing_when_done(tmp_path):
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"))
+    journal.start_run("sync", {"limit": 100})
+    journal.record_page(0, listed("1", "2"), next_offset=100)
+    journal.set_listing_done(True)
+    journal.mark_done(["2"])
+
+    # Liste terminée: Sellsy n'est pas interrogé
+    remaining = list(_remaining_invoices(None, journal, 100, {}))
+    assert [invoice["id"] for invoice in remaining] == ["1"]
+
+
+def test_failed_pages_are_kept_until_received(tmp_path):
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"))
+    journal.start_run("sync", {"limit": 300})
+    journal.record_failed_page(100, "timeout", next_offset=200)
+    journal.record_failed_page(100, "timeout")
+    assert journal.failed_pages() == [100]
+    assert journal.run["listing_offset"] == 200
+
+    journal.record_page(100, listed("5"))
+    assert journal.failed_pages() == []
@@ -0,0 +1,132 @@
+import pytest
+
+from airtable_api import AirtableBatchWriter
+from main import _run_sync
+from sync_journal import SyncJournal
+from sync_pipeline import SyncPipeline
+
+
+class FakeSellsy:
+    def get_invoice_details(self, invoice_id, use_cache=True):
+        return {"id": invoice_id, "reference": f"F-{invoice_id}"}
+
+    def download_invoice_pdf(self, invoice_id, invoice_details=None):
+        return f"/pdf/{invoice_id}.pdf"
+
+
+class FakeTable:
+    def __init__(self, fail_batches=False):
+        self.fail_batches = fail_batches
+        self.written = []
+
+    def batch_upsert(self, records, key_fields=None):
+        if self.fail_batches:
+            raise RuntimeError("Airtable indisponible")
+        self.written += [record["fields"]["ID_Facture"] for record in records]
+        created = [{"id": f"rec{record['fields']['ID_Facture']}", "fields": record["fields"]} for record in records]
+        return {"records": created, "createdRecords": [record["id"] for record in created]}
+
+
+class FakeAirtable:
+    def __init__(self, table):
+        self.table = table
+
+    def format_invoice_for_airtable(self, invoice):
+        return {"ID_Facture": str(invoice["id"]), "Numéro": invoice.get("reference", "")}
+
+    def prepare_invoice_fields(self, invoice_data, pdf_path=None):
+        return dict(invoice_data)
+
+    def find_invoice_by_id(self, sellsy_id):
+        return None
+
+    def is_unchanged(self, existing_record, fields):
+        return False
+
+    def insert_or_update_invoice(self, invoice_data, pdf_path=None):
+        raise RuntimeError("Airtable indisponible")
+
+    def _update_index(self, sellsy_id, record_id, fields):
+        pass
+
+
+def make_pipeline(table):
+    return SyncPipeline(FakeSellsy(), FakeAirtable(table), fetch_workers=2, pdf_workers=2)
+
+
+def test_processed_counts_confirmed_writes():
+    table = FakeTable()
+    summary = make_pipeline(table).run([{"id": str(i)} for i in range(1, 26)])
+
+    assert summary["processed"] == 25
+    assert sorted(table.written, key=int) == [str(i) for i in range(1, 26)]
+    assert summary["errors"] == []
+
+
+def test_failing_source_stops_workers_and_raises():
+    table = FakeTable()
+    pipeline = make_pipeline(table)
+
+    def invoices():
+        yield {"id": "1"}
+        yield {"id": "2"}
+        raise RuntimeError("pagination interrompue")
+
+    with pytest.raises(RuntimeError, match="pagination"):
+        pipeline.run(invoices())
+    # Les factures reçues avant l'erreur ont été écrites
+    assert pipeline.processed_count == 2
+
+
+def test_failed_final_flush_records_buffered_invoices(monkeypatch):
+    def broken_write(self, chunk):
+        raise ConnectionError("connexion perdue")
+
+    monkeypatch.setattr(AirtableBatchWriter, "_write_chunk", broken_write)
+    summary = make_pipeline(FakeTable()).run([{"id": str(i)} for i in range(1, 6)])
+
+    assert summary["processed"] == 0
+    assert sorted(error["id"] for error in summary["errors"]) == ["1", "2", "3", "4", "5"]
+    assert {error["stage"] for error in summary["errors"]} == {"airtable"}
+
+
+def test_failed_batch_send_records_the_batch_once(monkeypatch):
+    calls = []
+    original = AirtableBatchWriter._write_chunk
+
+    def flaky_write(self, chunk):
+        calls.append(len(chunk))
+        if len(calls) == 1:
+            raise ConnectionError("connexion perdue")
+        return original(self, chunk)
+
+    monkeypatch.setattr(AirtableBatchWriter, "_write_chunk", flaky_write)
+    summary = make_pipeline(FakeTable()).run([{"id": str(i)} for i in range(1, 16)])
+
+    # Premier lot de 10 perdu, les 5 suivantes écrites
+    assert summary["processed"] == 5
+    assert len(summary["errors"]) == 10
+    assert len({error["id"] for error in summary["errors"]}) == 10
+
+
+def test_invoices_without_id_are_skipped():
+    summary = make_pipeline(FakeTable()).run([{"id": "1"}, {"reference": "F-X"}, {"id": ""}, {"id": "2"}])
+
+    assert summary["processed"] == 2
+    assert summary["invalid"] == 2
+    assert summary["errors"] == []
+
+
+def test_listing_failure_closes_journal_run(tmp_path):
+    class BrokenListing(FakeSellsy):
+        def iter_invoices(self, limit, journal=None, **filters):
+            yield {"id": "1"}
+            raise RuntimeError("Sellsy indisponible")
+
+    journal = SyncJournal(str(tmp_path / "journal.sqlite"))
+    journal.start_run("sync", {"limit": 100, "filters": {}})
+
+    with pytest.raises(RuntimeError):
+        _run_sync(BrokenListing(), FakeAirtable(FakeTable()), journal, 1, 1, None)
+    assert journal.run["status"] == "incomplete"
+    assert journal.run["finished_at"] is not None
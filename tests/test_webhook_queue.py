@@ -0,0 +1,133 @@
+import asyncio
+import time
+
+from webhook_queue import WebhookQueue, WebhookWorkerPool
+
+
+def make_queue(tmp_path, **kwargs):
+    kwargs.setdefault("coalesce_window", 0)
+    return WebhookQueue(str(tmp_path / "queue.sqlite"), **kwargs)
+
+
+def test_claim_skips_job_under_lease(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=60)
+    job_id, _ = queue.enqueue("1", "invoice.updated", {"relatedid": "1"})
+
+    assert queue.claim()["id"] == job_id
+    assert queue.claim() is None
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=0.05)
+    job_id, _ = queue.enqueue("1", "invoice.updated", {"relatedid": "1"})
+    queue.claim()
+
+    time.sleep(0.1)
+    job = queue.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_release_puts_job_back_without_counting_attempt(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=60)
+    job_id, _ = queue.enqueue("1", "invoice.updated", {"relatedid": "1"})
+    claimed = queue.claim()
+
+    queue.release([claimed])
+    job = queue.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 1
+
+
+def test_stale_owner_cannot_complete_or_fail_reclaimed_job(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=0.05)
+    queue.enqueue("1", "invoice.updated", {"relatedid": "1"})
+    stale = queue.claim()
+
+    time.sleep(0.1)
+    current = queue.claim()
+    assert queue.complete(stale) is False
+    assert queue.fail(stale, RuntimeError("trop tard")) == "lost"
+    assert queue.extend_lease(stale) is False
+    assert queue.stats()["processing"] == 1
+
+    assert queue.complete(current) is True
+    assert queue.stats()["done"] == 1
+
+
+def test_heartbeat_keeps_long_job_leased(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=0.2)
+    queue.enqueue("1", "invoice.updated", {"relatedid": "1"})
+    reclaimed = []
+
+    async def handler(job):
+        for _ in range(5):
+            await asyncio.sleep(0.1)
+            reclaimed.append(await asyncio.to_thread(queue.claim))
+
+    async def scenario():
+        pool = WebhookWorkerPool(queue, handler, workers=1, poll_interval=0.01)
+        pool.start()
+        while queue.stats()["done"] == 0:
+            await asyncio.sleep(0.05)
+        await pool.stop(timeout=1)
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=10))
+    assert reclaimed == [None] * 5
+    assert queue.stats()["done"] == 1
+
+
+def test_stop_releases_in_flight_jobs(tmp_path):
+    queue = make_queue(tmp_path, visibility_timeout=60)
+    job_id, _ = queue.enqueue("1", "invoice.updated", {"relatedid": "1"})
+    started = asyncio.Event()
+
+    async def handler(job):
+        started.set()
+        await asyncio.sleep(60)
+
+    async def scenario():
+        pool = WebhookWorkerPool(queue, handler, workers=1, poll_interval=0.01)
+        pool.start()
+        await asyncio.wait_for(started.wait(), timeout=5)
+        await pool.stop(timeout=0.1)
+
+    asyncio.run(scenario())
+    stats = queue.stats()
+    assert stats["processing"] == 0
+    assert stats["depth"] == 1
+    assert queue.claim()["id"] == job_id
+
+
+def test_content_hash_duplicate_only_within_coalesce_window(tmp_path):
+    queue = make_queue(tmp_path, coalesce_window=0.1)
+    payload = {"relatedid": "1", "eventType": "invoice.updated"}
+
+    assert queue.enqueue("1", "invoice.updated", payload)[1] == "queued"
+    assert queue.enqueue("1", "invoice.updated", payload)[1] == "duplicate"
+
+    time.sleep(0.15)
+    queue.complete(queue.claim())
+    # Même contenu après la fenêtre: nouvelle mise à jour de la facture
+    assert queue.enqueue("1", "invoice.updated", payload)[1] == "queued"
+
+
+def test_delivery_id_duplicate_within_ttl(tmp_path):
+    queue = make_queue(tmp_path, coalesce_window=0.05, idempotency_ttl=60)
+    payload = {"relatedid": "1", "eventid": "evt-1"}
+    job_id, outcome = queue.enqueue("1", "invoice.updated", payload)
+    assert outcome == "queued"
+
+    time.sleep(0.1)
+    queue.complete(queue.claim())
+    assert queue.enqueue("1", "invoice.updated", payload) == (job_id, "duplicate")
+
+
+def test_delivery_id_expires_after_ttl(tmp_path):
+    queue = make_queue(tmp_path, idempotency_ttl=0.05)
+    payload = {"relatedid": "1", "eventid": "evt-1"}
+    queue.enqueue("1", "invoice.updated", payload)
+    queue.complete(queue.claim())
+
+    time.sleep(0.1)
+    assert queue.enqueue("1", "invoice.updated", payload)[1] == "queued"
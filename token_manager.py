@@ -0,0 +1,211 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from config import SELLSY_TOKEN_CACHE_FILE, SELLSY_TOKEN_REFRESH_MARGIN
+from metrics import metrics
+
+logger = logging.getLogger("token_manager")
+
+# Un token qui expire dans moins de EXPIRY_MARGIN secondes n'est plus distribué
+EXPIRY_MARGIN = 60
+
+# Délai avant une nouvelle tentative quand le renouvellement en arrière-plan échoue (secondes)
+BACKGROUND_RETRY_DELAY = 30
+
+
+class TokenManager:
+    """
+    Gestionnaire de token OAuth partagé entre threads et tâches asyncio.
+
+    - Un seul renouvellement à la fois ("single-flight"): les appelants qui trouvent
+      le token expiré attendent celui en cours au lieu d'interroger Sellsy chacun.
+    - Renouvellement proactif en arrière-plan refresh_margin secondes avant l'expiration.
+    - Cache disque optionnel (fichier en 0600, lié aux identifiants) pour que les
+      exécutions courtes (CLI, CI) réutilisent un token encore valide.
+
+    fetch() doit retourner la réponse OAuth: {"access_token": ..., "expires_in": ...}.
+    afetch(), coroutine équivalente, est utilisée par aget_token quand elle est fournie:
+    le renouvellement passe alors par le client httpx (pool et limiteur partagés) dans
+    la boucle asyncio, et le renouvellement proactif y est planifié.
+    """
+
+    def __init__(self, fetch, cache_path=SELLSY_TOKEN_CACHE_FILE, cache_key="",
+                 refresh_margin=SELLSY_TOKEN_REFRESH_MARGIN, proactive=True, afetch=None):
+        self.fetch = fetch
+        self.afetch = afetch
+        self.cache_path = cache_path
+        # Seule une empreinte des identifiants est écrite dans le cache
+        self.cache_key = hashlib.sha256(str(cache_key).encode("utf-8")).hexdigest()[:16]
+        self.refresh_margin = refresh_margin
+        self.proactive = proactive
+        self.access_token = None
+        self.expires_at = 0
+        self.refresh_count = 0
+        self._lock = threading.Lock()
+        self._async_lock = None
+        self._loop = None
+        self._timer = None
+        self._load_cache()
+
+    def _is_fresh(self, stale_token=None):
+        return (self.access_token is not None and self.access_token != stale_token
+                and time.time() < self.expires_at - EXPIRY_MARGIN)
+
+    def get_token(self, stale_token=None):
+        """
+        Retourne un token valide (bloquant). stale_token signale un token refusé (401):
+        il n'est renouvelé que s'il est encore le token courant.
+        """
+        if self._is_fresh(stale_token):
+            return self.access_token
+        with self._lock:
+            # Un autre appelant a pu renouveler le token pendant l'attente du verrou
+            if self._is_fresh(stale_token):
+                return self.access_token
+            self._refresh()
+            return self.access_token
+
+    async def aget_token(self, stale_token=None):
+        """
+        Équivalent asynchrone de get_token: renouvellement par afetch dans la boucle,
+        ou dans un thread (get_token) sans afetch
+        """
+        if self.afetch is None:
+            if self._is_fresh(stale_token):
+                return self.access_token
+            return await asyncio.to_thread(self.get_token, stale_token)
+
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._async_lock = asyncio.Lock()
+            if self.access_token is not None:
+                # Token repris du cache avant le démarrage de la boucle
+                self._schedule_refresh(self._refresh_delay(self.expires_at - time.time()))
+        if self._is_fresh(stale_token):
+            return self.access_token
+        async with self._async_lock:
+            # Une autre tâche a pu renouveler le token pendant l'attente
+            if self._is_fresh(stale_token):
+                return self.access_token
+            await self._arefresh()
+            return self.access_token
+
+    def invalidate(self):
+        """Oublie le token courant (le prochain appel en demandera un nouveau)"""
+        with self._lock:
+            self.access_token = None
+            self.expires_at = 0
+
+    def close(self):
+        """Arrête le renouvellement en arrière-plan"""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _refresh(self):
+        """Demande un nouveau token (verrou déjà pris)"""
+        with metrics.timer("token"):
+            token_data = self.fetch()
+        self._store(token_data)
+
+    async def _arefresh(self):
+        """Demande un nouveau token par afetch (verrou asyncio déjà pris)"""
+        with metrics.timer("token"):
+            token_data = await self.afetch()
+        self._store(token_data)
+
+    def _store(self, token_data):
+        """Enregistre un nouveau token et planifie son renouvellement"""
+        lifetime = float(token_data["expires_in"])
+        self.access_token = token_data["access_token"]
+        self.expires_at = time.time() + lifetime
+        self.refresh_count += 1
+        self._save_cache()
+        if lifetime <= self.refresh_margin:
+            logger.warning("⚠️ Token valable %ss, moins que la marge de renouvellement (%ss): "
+                           "renouvellement à mi-durée de vie", lifetime, self.refresh_margin)
+        self._schedule_refresh(self._refresh_delay(lifetime))
+
+    def _refresh_delay(self, lifetime):
+        """
+        Délai avant le renouvellement proactif d'un token valable encore lifetime secondes:
+        refresh_margin avant l'expiration, mais jamais avant la moitié de sa durée de vie
+        (sinon un token plus court que la marge serait redemandé en boucle)
+        """
+        return max(lifetime - self.refresh_margin, lifetime / 2, 1.0)
+
+    def _schedule_refresh(self, delay):
+        if not self.proactive:
+            return
+        self.close()
+        if self.afetch is not None:
+            # Le renouvellement asynchrone a besoin de la boucle: planifié dès le premier aget_token
+            if self._loop is not None:
+                self._timer = self._loop.call_later(
+                    delay, lambda: self._loop.create_task(self._abackground_refresh()))
+            return
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        with self._lock:
+            try:
+                self._refresh()
+                logger.info("🔄 Token d'accès renouvelé en arrière-plan")
+            except Exception as e:
+                logger.warning("⚠️ Échec du renouvellement du token en arrière-plan: %s", e)
+                # Réessayer tant que le token courant n'a pas expiré
+                if time.time() + BACKGROUND_RETRY_DELAY < self.expires_at:
+                    self._schedule_refresh(BACKGROUND_RETRY_DELAY)
+
+    async def _abackground_refresh(self):
+        async with self._async_lock:
+            try:
+                await self._arefresh()
+                logger.info("🔄 Token d'accès renouvelé en arrière-plan")
+            except Exception as e:
+                logger.warning("⚠️ Échec du renouvellement du token en arrière-plan: %s", e)
+                if time.time() + BACKGROUND_RETRY_DELAY < self.expires_at:
+                    self._schedule_refresh(BACKGROUND_RETRY_DELAY)
+
+    def _load_cache(self):
+        """Reprend le token du cache disque s'il est sûr (propriétaire, droits 0600) et encore valide"""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            stat = os.stat(self.cache_path)
+            if stat.st_mode & 0o077 or (hasattr(os, "getuid") and stat.st_uid != os.getuid()):
+                logger.warning("⚠️ Cache de token ignoré: droits trop ouverts sur %s", self.cache_path)
+                return
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning("⚠️ Cache de token illisible (%s): %s", self.cache_path, e)
+            return
+
+        if cached.get("key") != self.cache_key or time.time() >= cached.get("expires_at", 0) - EXPIRY_MARGIN:
+            return
+        self.access_token = cached["access_token"]
+        self.expires_at = cached["expires_at"]
+        logger.info("🔑 Token d'accès repris du cache")
+        self._schedule_refresh(self._refresh_delay(self.expires_at - time.time()))
+
+    def _save_cache(self):
+        """Écrit le token dans le cache disque (atomique, lisible par le seul propriétaire)"""
+        if not self.cache_path:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": self.cache_key, "access_token": self.access_token,
+                           "expires_at": self.expires_at}, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning("⚠️ Impossible d'écrire le cache de token (%s): %s", self.cache_path, e)
@@ -1,24 +1,31 @@
 from fastapi import FastAPI, Request, Header, HTTPException, Depends
+from fastapi.responses import JSONResponse, PlainTextResponse
+import asyncio
 import hmac
 import hashlib
 import json
 import os
 import logging
 from datetime import datetime
-from sellsy_api import SellsyAPI
-from airtable_api import AirtableAPI
-from config import WEBHOOK_SECRET
-
-# Configuration du logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from async_clients import AsyncSellsyAPI, AsyncAirtableAPI, create_async_client
+from webhook_queue import WebhookQueue, WebhookWorkerPool
+from dead_letter import DeadLetterStore
+from metrics import metrics
+from logging_setup import ensure_logging
+from config import WEBHOOK_SECRET, WEBHOOK_WORKERS, DEAD_LETTER_DB
+
+# Journalisation en file (niveau LOG_LEVEL) si le module est lancé directement par uvicorn;
+# depuis main.py, la configuration selon --log-level est conservée
+ensure_logging()
 logger = logging.getLogger("webhook_handler")
 
 app = FastAPI()
-sellsy = SellsyAPI()
-airtable = AirtableAPI()
+
+# Clients asynchrones partageant un même pool de connexions: un seul worker uvicorn
+# traite de nombreux webhooks simultanés sans bloquer la boucle
+http_client = create_async_client()
+sellsy = AsyncSellsyAPI(http_client)
+airtable = AsyncAirtableAPI(http_client)
 
 # Mode de développement temporaire pour accepter toutes les signatures
 # ATTENTION: Ne pas laisser activé en production sans restriction d'IP
@@ -27,14 +34,11 @@ DEBUG_SKIP_SIGNATURE = True  # Mettre à False une fois le problème résolu
 async def verify_webhook(request: Request):
     """Vérifie la signature du webhook Sellsy"""
     client_ip = request.client.host if request.client else "unknown"
-    logger.info(f"Webhook request received from {client_ip}")
-    
-    # Récupérer tous les headers pour déboguer
-    headers = dict(request.headers.items())
-    logger.info(f"Received headers: {headers}")
+    logger.debug("Webhook request received from %s", client_ip)
     
     # Utiliser spécifiquement le header mentionné dans la documentation Sellsy
-    sellsy_signature = headers.get('x-webhook-signature') or headers.get('X-Webhook-Signature')
+    # (les en-têtes et la signature ne sont pas journalisés)
+    sellsy_signature = request.headers.get('x-webhook-signature')
     
     # En mode debug, continuer même sans signature
     if not sellsy_signature and not DEBUG_SKIP_SIGNATURE:
@@ -45,29 +49,24 @@ async def verify_webhook(request: Request):
     body = await request.body()
     body_str = body.decode('utf-8') if body else "empty"
     
-    # Log pour déboguer
-    if sellsy_signature:
-        logger.info(f"Webhook received - Signature: {sellsy_signature}")
-    logger.info(f"Raw body content (first 200 chars): {body_str[:200]}...")
+    logger.debug("Raw body content (first 200 chars): %s...", body_str[:200])
     
     # En mode debug, on peut sauter la vérification de signature
     if DEBUG_SKIP_SIGNATURE:
-        logger.warning("⚠️ Mode DEBUG actif : vérification de signature désactivée")
-        
         # Analyser le body selon le format (form-urlencoded ou JSON)
         content_type = request.headers.get('content-type', '')
         
         if 'application/x-www-form-urlencoded' in content_type:
             # Traiter comme form-urlencoded
             form_data = await request.form()
-            logger.info(f"Form data: {dict(form_data)}")
+            logger.debug("Form data: %s", dict(form_data))
             return dict(form_data)
         else:
             # Essayer de traiter comme JSON
             try:
                 return json.loads(body_str)
             except json.JSONDecodeError as e:
-                logger.error(f"Could not parse webhook body as JSON: {e}")
+                logger.error("Could not parse webhook body as JSON: %s", e)
                 raise HTTPException(status_code=400, detail="Format de données invalide")
                 
     # Vérifier si le secret webhook est configuré
@@ -78,11 +77,10 @@ async def verify_webhook(request: Request):
     # Calcul de la signature comme spécifié dans la documentation Sellsy
     # SHA1(SIGN_KEY + WEBHOOK_BODY)
     calculated_signature = hashlib.sha1((WEBHOOK_SECRET + body_str).encode()).hexdigest()
-    logger.info(f"Calculated signature: {calculated_signature}")
     
     # Comparer les signatures
     if hmac.compare_digest(calculated_signature, sellsy_signature):
-        logger.info("✅ Signature validée")
+        logger.debug("✅ Signature validée")
         
         # Analyser le body selon le format (form-urlencoded ou JSON)
         content_type = request.headers.get('content-type', '')
@@ -90,19 +88,77 @@ async def verify_webhook(request: Request):
         if 'application/x-www-form-urlencoded' in content_type:
             # Traiter comme form-urlencoded
             form_data = await request.form()
-            logger.info(f"Form data: {dict(form_data)}")
+            logger.debug("Form data: %s", dict(form_data))
             return dict(form_data)
         else:
             # Essayer de traiter comme JSON
             try:
                 return json.loads(body_str)
             except json.JSONDecodeError as e:
-                logger.error(f"Could not parse webhook body as JSON: {e}")
+                logger.error("Could not parse webhook body as JSON: %s", e)
                 raise HTTPException(status_code=400, detail="Format de données invalide")
     else:
-        logger.warning(f"❌ Signature invalide. Attendue: {sellsy_signature}, Calculée: {calculated_signature}")
+        logger.warning("❌ Signature invalide reçue de %s", client_ip)
         raise HTTPException(status_code=401, detail="Signature invalide")
 
+async def process_invoice_job(job):
+    """Traite un job webhook: détails Sellsy, PDF puis insertion/mise à jour Airtable (lève en cas d'échec)"""
+    resource_id = job["resource_id"]
+    logger.debug("Traitement de la facture %s depuis le webhook", resource_id)
+    
+    # Toujours relire Sellsy: le webhook signale justement une modification
+    logger.debug("Récupération des détails de la facture %s...", resource_id)
+    invoice_details = await sellsy.get_invoice_details(resource_id)
+    if not invoice_details:
+        raise Exception(f"Impossible de récupérer les détails de la facture {resource_id}")
+    
+    # Formater la facture pour Airtable
+    formatted_invoice = airtable.format_invoice_for_airtable(invoice_details)
+    if not formatted_invoice:
+        raise Exception("Impossible de formater les données de la facture")
+    
+    # Télécharger le PDF de la facture
+    logger.debug("Téléchargement du PDF de la facture %s...", resource_id)
+    pdf_path = await sellsy.download_invoice_pdf(resource_id, invoice_details=invoice_details)
+    logger.debug("PDF téléchargé: %s", pdf_path if pdf_path else 'échec')
+    
+    # Insérer ou mettre à jour dans Airtable
+    record_id = await airtable.insert_or_update_invoice(formatted_invoice, pdf_path)
+    logger.info("✅ Facture %s traitée avec succès dans Airtable (ID: %s)", resource_id, record_id)
+    if dead_letters:
+        if pdf_path:
+            await asyncio.to_thread(dead_letters.resolve, [resource_id])
+        else:
+            # La facture est tout de même écrite; elle reste en échec jusqu'à l'obtention du PDF
+            await asyncio.to_thread(dead_letters.add, resource_id, "pdf", "téléchargement du PDF impossible",
+                                    payload=invoice_details, error_class="PdfDownloadError")
+    return record_id
+
+def dead_letter_job(job, error):
+    """Enregistre la facture d'un job abandonné pour `main.py retry-failed`"""
+    dead_letters.add(job["resource_id"], "webhook", error, payload=job["payload"])
+
+# Factures en échec partagées avec les synchronisations (désactivé si DEAD_LETTER_DB est vide)
+dead_letters = DeadLetterStore() if DEAD_LETTER_DB else None
+
+webhook_queue = WebhookQueue()
+webhook_workers = WebhookWorkerPool(webhook_queue, process_invoice_job, workers=WEBHOOK_WORKERS,
+                                    on_abandoned=dead_letter_job if dead_letters else None)
+
+@app.on_event("startup")
+async def start_webhook_workers():
+    """Démarre les workers qui vident la file des webhooks"""
+    if DEBUG_SKIP_SIGNATURE:
+        logger.warning("⚠️ Mode DEBUG actif : vérification de signature désactivée")
+    webhook_workers.start()
+
+@app.on_event("shutdown")
+async def stop_webhook_workers():
+    """Arrête proprement les workers (les jobs en attente restent dans la file) et ferme les connexions"""
+    await webhook_workers.stop()
+    await sellsy.aclose()
+    await http_client.aclose()
+
 @app.post("/webhook/sellsy")
 async def handle_webhook(request: Request):
     """Gère les webhooks entrants de Sellsy"""
@@ -128,75 +184,46 @@ async def handle_webhook(request: Request):
                            payload.get("resource_type") or
                            payload.get("type", "unknown"))
         
-        logger.info(f"Processing webhook: {event_type} for {related_type} {resource_id}")
+        logger.debug("Processing webhook: %s for %s %s", event_type, related_type, resource_id)
         
         # Vérifier que c'est bien une facture
         if related_type == "invoice" and resource_id:
             # Accepter soit les événements docslog, soit les événements invoice standards
             if event_type in ["docslog", "invoice.created", "invoice.updated", "created", "updated"]:
-                logger.info(f"Traitement de la facture {resource_id} depuis le webhook")
-                
-                try:
-                    # Récupérer les détails complets de la facture
-                    logger.info(f"Récupération des détails de la facture {resource_id}...")
-                    invoice_details = sellsy.get_invoice_details(resource_id)
-                    
-                    if not invoice_details:
-                        logger.error(f"Impossible de récupérer les détails de la facture {resource_id}")
-                        return {"status": "error", "message": f"Impossible de récupérer les détails de la facture {resource_id}"}
-                    
-                    logger.info(f"Détails de la facture {resource_id} récupérés avec succès")
-                    
-                    # Formater la facture pour Airtable
-                    logger.info("Formatage des données de la facture pour Airtable...")
-                    formatted_invoice = airtable.format_invoice_for_airtable(invoice_details)
-                    
-                    if not formatted_invoice:
-                        logger.error("Échec du formatage des données de la facture")
-                        return {"status": "error", "message": "Impossible de formater les données de la facture"}
-                    
-                    logger.info("Données de la facture formatées avec succès")
-                    
-                    # Télécharger le PDF de la facture
-                    logger.info(f"Téléchargement du PDF de la facture {resource_id}...")
-                    pdf_path = sellsy.download_invoice_pdf(resource_id)
-                    logger.info(f"PDF téléchargé: {pdf_path if pdf_path else 'échec'}")
-                    
-                    # Insérer ou mettre à jour dans Airtable
-                    logger.info("Insertion/mise à jour dans Airtable...")
-                    record_id = airtable.insert_or_update_invoice(formatted_invoice, pdf_path)
-                    
-                    logger.info(f"✅ Facture {resource_id} traitée avec succès dans Airtable (ID: {record_id})")
-                    return {
-                        "status": "success", 
-                        "message": f"Facture {resource_id} traitée dans Airtable (ID: {record_id})",
-                        "timestamp": str(datetime.now())
-                    }
-                    
-                except Exception as e:
-                    logger.exception(f"Exception lors du traitement du webhook pour la facture {resource_id}: {e}")
-                    return {
-                        "status": "error", 
-                        "message": f"Erreur lors du traitement: {str(e)}",
-                        "timestamp": str(datetime.now())
-                    }
+                # Enregistrer le job et répondre immédiatement: le traitement se fait en arrière-plan
+                # (écriture SQLite hors de la boucle)
+                job_id, outcome = await asyncio.to_thread(webhook_queue.enqueue, resource_id, event_type, payload)
+                if outcome == "duplicate":
+                    logger.info("Événement déjà reçu pour la facture %s (job %s), ignoré", resource_id, job_id)
+                    return {"status": "duplicate", "job_id": job_id,
+                            "message": f"Événement déjà reçu pour la facture {resource_id}"}
+                if outcome == "coalesced":
+                    logger.info("Événement regroupé avec le job en attente %s de la facture %s", job_id, resource_id)
+                else:
+                    logger.info("Facture %s mise en file (job %s)", resource_id, job_id)
+                return JSONResponse(status_code=202, content={
+                    "status": outcome,
+                    "job_id": job_id,
+                    "message": f"Facture {resource_id} mise en file de traitement",
+                    "timestamp": str(datetime.now())
+                })
             else:
-                logger.info(f"Type d'événement non géré: {event_type}")
+                logger.info("Type d'événement non géré: %s", event_type)
                 return {"status": "ignored", "message": f"Type d'événement non géré: {event_type}"}
         else:
-            logger.info(f"Type de ressource non géré: {related_type}")
+            logger.info("Type de ressource non géré: %s", related_type)
             return {"status": "ignored", "message": f"Type de ressource non géré: {related_type}"}
     except HTTPException as http_ex:
         # Réutiliser l'exception HTTP déjà levée
         raise http_ex
     except Exception as e:
-        logger.exception(f"Erreur non gérée dans le handler webhook: {e}")
+        logger.exception("Erreur non gérée dans le handler webhook: %s", e)
         raise HTTPException(status_code=500, detail=f"Erreur interne du serveur: {str(e)}")
 
 @app.get("/webhook/test")
 async def test_webhook():
     """Endpoint de test pour vérifier que le serveur est en ligne"""
-    logger.info(f"Test endpoint called at {datetime.now()}")
+    logger.info("Test endpoint called at %s", datetime.now())
     
     # Vérifier la présence des variables d'environnement nécessaires
     env_vars = {
@@ -211,7 +238,7 @@ async def test_webhook():
     # Tester la connexion à l'API Sellsy
     sellsy_status = "unknown"
     try:
-        token = sellsy.get_access_token()
+        token = await sellsy.get_access_token()
         sellsy_status = "connected" if token else "failed_to_get_token"
     except Exception as e:
         sellsy_status = f"error: {str(e)}"
@@ -234,6 +261,30 @@ async def test_webhook():
         "debug_mode": DEBUG_SKIP_SIGNATURE
     }
 
+@app.get("/webhook/queue")
+async def webhook_queue_status():
+    """État de la file des webhooks: profondeur, retard et derniers échecs"""
+    stats = await asyncio.to_thread(webhook_queue.stats)
+    return {
+        **stats,
+        "workers": webhook_workers.workers,
+        "recent_failures": await asyncio.to_thread(webhook_queue.recent_failures)
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métriques au format Prometheus: durées par étape, requêtes par code, tentatives, octets et file des webhooks"""
+    stats = await asyncio.to_thread(webhook_queue.stats)
+    gauges = {
+        "webhook_jobs": ("Jobs webhook par état", {
+            (("state", state),): stats[key]
+            for state, key in [("pending", "depth"), ("processing", "processing"), ("done", "done"), ("failed", "failed")]
+        }),
+        "webhook_queue_lag_seconds": ("Âge du plus ancien job en attente", {(): stats["lag_seconds"]}),
+        "webhook_workers": ("Workers de la file des webhooks", {(): webhook_workers.workers}),
+    }
+    return PlainTextResponse(metrics.render_prometheus(gauges), media_type="text/plain; version=0.0.4")
+
 @app.get("/")
 async def root():
     """Page d'accueil simple"""
@@ -242,6 +293,8 @@ async def root():
         "status": "running",
         "endpoints": {
             "webhook": "/webhook/sellsy",
+            "queue": "/webhook/queue",
+            "metrics": "/metrics",
             "test": "/webhook/test"
         }
     }
@@ -0,0 +1,372 @@
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from config import (WEBHOOK_QUEUE_DB, WEBHOOK_MAX_ATTEMPTS, WEBHOOK_RETRY_BASE_DELAY,
+                    WEBHOOK_COALESCE_WINDOW, WEBHOOK_COALESCE_MAX_WAIT, WEBHOOK_IDEMPOTENCY_TTL,
+                    WEBHOOK_VISIBILITY_TIMEOUT)
+
+logger = logging.getLogger("webhook_queue")
+
+# Champs du payload identifiant un événement de façon unique, s'ils sont fournis
+EVENT_ID_FIELDS = ["eventid", "event_id", "eventId", "uuid"]
+
+# Préfixe des clés calculées à partir du contenu (événement sans identifiant de livraison)
+CONTENT_KEY_PREFIX = "sha256:"
+
+
+def idempotency_key(payload):
+    """Clé d'idempotence d'un événement: son identifiant s'il en a un, sinon l'empreinte de son contenu"""
+    payload = payload or {}
+    for field in EVENT_ID_FIELDS:
+        if payload.get(field):
+            return f"{field}:{payload[field]}"
+    canonical = json.dumps(payload, sort_keys=True, default=str)
+    return CONTENT_KEY_PREFIX + hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class WebhookQueue:
+    """
+    File de jobs durable adossée à SQLite (mode WAL).
+
+    Les webhooks sont enregistrés avant la réponse HTTP: un redémarrage du service
+    ne perd aucun événement. Les jobs en échec sont replanifiés avec un délai
+    exponentiel jusqu'à max_attempts, puis marqués "failed". Un job réservé l'est pour
+    visibility_timeout secondes: passé ce bail (processus arrêté pendant le traitement),
+    il peut être réservé à nouveau. Le worker prolonge le bail tant qu'il traite le job
+    (extend_lease) et chaque réservation reçoit un jeton: complete, fail et release sont
+    ignorés pour un job repris entre-temps par un autre worker.
+
+    Les événements d'une même facture arrivant pendant la fenêtre de regroupement
+    sont fusionnés en un seul job en attente. Un événement déjà reçu est ignoré:
+    pendant idempotency_ttl s'il porte un identifiant de livraison, seulement pendant
+    la fenêtre de regroupement sinon (deux mises à jour successives d'une facture
+    peuvent produire exactement le même payload).
+    """
+
+    def __init__(self, path=WEBHOOK_QUEUE_DB, max_attempts=WEBHOOK_MAX_ATTEMPTS, base_delay=WEBHOOK_RETRY_BASE_DELAY,
+                 coalesce_window=WEBHOOK_COALESCE_WINDOW, coalesce_max_wait=WEBHOOK_COALESCE_MAX_WAIT,
+                 idempotency_ttl=WEBHOOK_IDEMPOTENCY_TTL, visibility_timeout=WEBHOOK_VISIBILITY_TIMEOUT):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_wait = max(coalesce_max_wait, coalesce_window)
+        self.idempotency_ttl = idempotency_ttl
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    resource_id TEXT NOT NULL,
+                    event_type TEXT,
+                    payload TEXT,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    last_error TEXT
+                )
+            """)
+            columns = {row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")}
+            if "coalesced" not in columns:
+                # Base créée par une version précédente
+                self.db.execute("ALTER TABLE jobs ADD COLUMN coalesced INTEGER NOT NULL DEFAULT 0")
+            if "claimed_at" not in columns:
+                self.db.execute("ALTER TABLE jobs ADD COLUMN claimed_at REAL")
+            if "claim_token" not in columns:
+                self.db.execute("ALTER TABLE jobs ADD COLUMN claim_token TEXT")
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, next_attempt_at)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_resource ON jobs(resource_id, status)")
+            self.db.execute("""
+                CREATE TABLE IF NOT EXISTS idempotency_keys (
+                    key TEXT PRIMARY KEY,
+                    job_id INTEGER,
+                    received_at REAL NOT NULL,
+                    duplicates INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+    def enqueue(self, resource_id, event_type=None, payload=None, key=None):
+        """
+        Enregistre un événement et retourne (job_id, résultat), le résultat valant:
+        "queued" (nouveau job), "coalesced" (fusionné dans le job en attente de la facture)
+        ou "duplicate" (événement déjà reçu, rien n'est fait). key remplace la clé
+        d'idempotence calculée (identifiant de livraison fourni par l'appelant).
+        """
+        now = time.time()
+        resource_id = str(resource_id)
+        key = key or idempotency_key(payload)
+        ttl = self.coalesce_window if key.startswith(CONTENT_KEY_PREFIX) else self.idempotency_ttl
+        payload_json = json.dumps(payload or {}, default=str)
+        if now - self._last_purge > 3600:
+            self.purge_idempotency_keys()
+        with self._lock, self.db:
+            seen = self.db.execute(
+                "SELECT job_id FROM idempotency_keys WHERE key = ? AND received_at >= ?",
+                (key, now - ttl)
+            ).fetchone()
+            if seen is not None:
+                self.db.execute("UPDATE idempotency_keys SET duplicates = duplicates + 1 WHERE key = ?", (key,))
+                return seen["job_id"], "duplicate"
+
+            # Un job en cours de traitement a peut-être déjà lu Sellsy: seul un job encore en attente est fusionné
+            pending = self.db.execute(
+                "SELECT id, created_at, next_attempt_at FROM jobs WHERE resource_id = ? AND status = 'pending' "
+                "ORDER BY id LIMIT 1",
+                (resource_id,)
+            ).fetchone()
+            if pending is not None:
+                # Chaque événement repousse le traitement, sans dépasser l'attente maximale
+                deadline = pending["created_at"] + self.coalesce_max_wait
+                next_attempt_at = max(pending["next_attempt_at"], min(now + self.coalesce_window, deadline))
+                self.db.execute(
+                    "UPDATE jobs SET event_type = ?, payload = ?, next_attempt_at = ?, coalesced = coalesced + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (event_type, payload_json, next_attempt_at, now, pending["id"])
+                )
+                job_id, outcome = pending["id"], "coalesced"
+            else:
+                cursor = self.db.execute(
+                    "INSERT INTO jobs (resource_id, event_type, payload, next_attempt_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (resource_id, event_type, payload_json, now + self.coalesce_window, now, now)
+                )
+                job_id, outcome = cursor.lastrowid, "queued"
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, job_id, received_at) VALUES (?, ?, ?)",
+                (key, job_id, now)
+            )
+            return job_id, outcome
+
+    def purge_idempotency_keys(self):
+        """Supprime les clés d'idempotence expirées"""
+        now = time.time()
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM idempotency_keys WHERE received_at < ?", (now - self.idempotency_ttl,))
+        self._last_purge = now
+
+    def claim(self):
+        """
+        Réserve le prochain job prêt (ou None) en le passant à l'état "processing" pour la
+        durée du bail; un job "processing" dont le bail a expiré est repris. Le job retourné
+        porte le jeton de cette réservation (claim_token)
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        with self._lock, self.db:
+            row = self.db.execute(
+                "SELECT * FROM jobs WHERE (status = 'pending' AND next_attempt_at <= ?) "
+                "OR (status = 'processing' AND COALESCE(claimed_at, updated_at) < ?) "
+                "ORDER BY next_attempt_at, id LIMIT 1",
+                (now, now - self.visibility_timeout)
+            ).fetchone()
+            if row is None:
+                return None
+            if row["status"] == "processing":
+                logger.warning("Job %s (facture %s): bail expiré, job repris", row["id"], row["resource_id"])
+            self.db.execute(
+                "UPDATE jobs SET status = 'processing', attempts = attempts + 1, claimed_at = ?, claim_token = ?, "
+                "updated_at = ? WHERE id = ?",
+                (now, token, now, row["id"])
+            )
+        job = dict(row)
+        job["attempts"] += 1
+        job["claim_token"] = token
+        job["payload"] = json.loads(job["payload"] or "{}")
+        return job
+
+    def extend_lease(self, job):
+        """Prolonge le bail d'un job en cours; False si le job a été repris par un autre worker"""
+        now = time.time()
+        with self._lock, self.db:
+            return self.db.execute(
+                "UPDATE jobs SET claimed_at = ?, updated_at = ? "
+                "WHERE id = ? AND status = 'processing' AND claim_token IS ?",
+                (now, now, job["id"], job.get("claim_token"))
+            ).rowcount > 0
+
+    def complete(self, job):
+        """Marque un job traité; False (rien n'est modifié) si le bail a été perdu"""
+        with self._lock, self.db:
+            owned = self.db.execute(
+                "UPDATE jobs SET status = 'done', last_error = NULL, claim_token = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'processing' AND claim_token IS ?",
+                (time.time(), job["id"], job.get("claim_token"))
+            ).rowcount > 0
+        if not owned:
+            logger.warning("Job %s: bail perdu, le job a été repris par un autre worker", job["id"])
+        return owned
+
+    def fail(self, job, error):
+        """
+        Replanifie un job en échec (délai exponentiel avec gigue) ou l'abandonne après max_attempts.
+        Retourne le nouvel état, ou "lost" si le bail a été perdu (le job n'est pas modifié)
+        """
+        now = time.time()
+        if job["attempts"] >= self.max_attempts:
+            status, next_attempt_at = "failed", now
+        else:
+            delay = self.base_delay * (2 ** (job["attempts"] - 1))
+            status, next_attempt_at = "pending", now + delay * random.uniform(0.8, 1.2)
+        with self._lock, self.db:
+            owned = self.db.execute(
+                "UPDATE jobs SET status = ?, next_attempt_at = ?, last_error = ?, claim_token = NULL, updated_at = ? "
+                "WHERE id = ? AND status = 'processing' AND claim_token IS ?",
+                (status, next_attempt_at, str(error), now, job["id"], job.get("claim_token"))
+            ).rowcount > 0
+        if not owned:
+            logger.warning("Job %s: bail perdu, le job a été repris par un autre worker", job["id"])
+            return "lost"
+        return status
+
+    def release(self, jobs):
+        """Remet immédiatement en attente des jobs réservés mais non traités (arrêt du service)"""
+        now = time.time()
+        with self._lock, self.db:
+            released = 0
+            for job in jobs:
+                # La tentative interrompue n'est pas comptée; un job repris ailleurs n'est pas touché
+                released += self.db.execute(
+                    "UPDATE jobs SET status = 'pending', attempts = MAX(attempts - 1, 0), claimed_at = NULL, "
+                    "claim_token = NULL, next_attempt_at = ?, updated_at = ? "
+                    "WHERE id = ? AND status = 'processing' AND claim_token IS ?",
+                    (now, now, job["id"], job.get("claim_token"))
+                ).rowcount
+        if released:
+            logger.warning("%s job(s) webhook interrompu(s) remis en attente", released)
+        return released
+
+    def stats(self):
+        """Profondeur de la file, jobs en cours/en échec et retard du plus ancien job en attente"""
+        now = time.time()
+        with self._lock:
+            counts = {row["status"]: row["total"] for row in self.db.execute(
+                "SELECT status, COUNT(*) AS total FROM jobs GROUP BY status"
+            )}
+            oldest = self.db.execute(
+                "SELECT MIN(created_at) AS oldest FROM jobs WHERE status IN ('pending', 'processing')"
+            ).fetchone()["oldest"]
+            coalesced = self.db.execute("SELECT COALESCE(SUM(coalesced), 0) AS total FROM jobs").fetchone()["total"]
+            duplicates = self.db.execute(
+                "SELECT COALESCE(SUM(duplicates), 0) AS total FROM idempotency_keys"
+            ).fetchone()["total"]
+        return {
+            "depth": counts.get("pending", 0),
+            "processing": counts.get("processing", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "lag_seconds": round(now - oldest, 1) if oldest else 0.0,
+            "coalesced": coalesced,
+            "duplicates": duplicates
+        }
+
+    def recent_failures(self, limit=20):
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT id, resource_id, event_type, attempts, last_error, updated_at FROM jobs "
+                "WHERE status = 'failed' ORDER BY updated_at DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class WebhookWorkerPool:
+    """
+    Tâches asyncio qui vident la file en attendant handler(job) (une exception = nouvel
+    essai plus tard). Le bail du job est prolongé tous les tiers de visibility_timeout
+    pendant le traitement. Les accès SQLite, brefs, sont faits hors de la boucle.
+    on_abandoned(job, erreur) est appelé pour un job abandonné après max_attempts.
+    """
+
+    def __init__(self, queue, handler, workers=2, poll_interval=1.0, on_abandoned=None):
+        self.queue = queue
+        self.handler = handler
+        self.on_abandoned = on_abandoned
+        self.workers = max(1, workers)
+        self.poll_interval = poll_interval
+        self._stop = None
+        self._tasks = []
+        self._in_flight = {}  # ID du job -> job réservé en cours de traitement
+
+    def start(self):
+        """Démarre les workers (à appeler depuis la boucle asyncio du service)"""
+        self._stop = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._run(), name=f"webhook-worker-{idx + 1}")
+                       for idx in range(self.workers)]
+        logger.info("%s worker(s) webhook démarré(s)", self.workers)
+
+    async def stop(self, timeout=30):
+        """Laisse les jobs en cours se terminer (au plus timeout secondes) puis arrête les workers"""
+        if self._stop is None:
+            return
+        self._stop.set()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        # Les jobs des workers interrompus sont rendus à la file au lieu d'attendre l'expiration du bail
+        if self._in_flight:
+            await asyncio.to_thread(self.queue.release, list(self._in_flight.values()))
+            self._in_flight.clear()
+        self._tasks = []
+
+    async def _run(self):
+        while not self._stop.is_set():
+            job = await asyncio.to_thread(self.queue.claim)
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.debug("Job %s: facture %s (tentative %s)", job['id'], job['resource_id'], job['attempts'])
+            self._in_flight[job["id"]] = job
+            heartbeat = asyncio.create_task(self._heartbeat(job))
+            try:
+                try:
+                    await self.handler(job)
+                finally:
+                    heartbeat.cancel()
+                await asyncio.to_thread(self.queue.complete, job)
+                del self._in_flight[job["id"]]
+            except Exception as e:
+                del self._in_flight[job["id"]]
+                status = await asyncio.to_thread(self.queue.fail, job, e)
+                if status == "lost":
+                    continue
+                if status == "failed":
+                    logger.error("Job %s abandonné après %s tentative(s): %s", job['id'], job['attempts'], e)
+                    if self.on_abandoned:
+                        await asyncio.to_thread(self.on_abandoned, job, e)
+                else:
+                    logger.warning("Job %s en échec (%s), nouvel essai planifié", job['id'], e)
+
+    async def _heartbeat(self, job):
+        """Prolonge le bail du job tant que le handler s'exécute"""
+        interval = max(self.queue.visibility_timeout / 3, 0.01)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                owned = await asyncio.to_thread(self.queue.extend_lease, job)
+            except Exception as e:
+                logger.warning("Job %s: prolongation du bail impossible (%s)", job["id"], e)
+                continue
+            if not owned:
+                logger.warning("Job %s: bail perdu pendant le traitement", job["id"])
+                return